@@ -1,45 +1,79 @@
+import asyncio
 import logging
 import os
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 from aiohttp import web
 from dotenv import load_dotenv
-from backend.tools.rag.ai_search import report_grounding_tool, search_tool
-from backend.helpers import load_prompt_from_markdown
+from backend.tools.rag.cache import SearchResultCache
 from backend.rtmt import RTMiddleTier
-from backend.azure import get_azure_credentials, fetch_prompt_from_azure_storage
+from backend.azure import get_azure_credentials
 from backend.rtmt import RTMiddleTier
 from backend.acs import AcsCaller
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents.aio import SearchClient
 from functools import partial
-from backend.log import log_conversation
+from backend.log import ConversationLogSink
+from backend.journal import TranscriptJournal
+from backend.metrics import WorkerMetricsExchange
+from backend.logconfig import configure_logging
+from backend.startup import Startup
+from backend.prompt import PromptProvider
+from backend.credentials import COGNITIVE_SERVICES_SCOPE, SEARCH_SCOPE, STORAGE_SCOPE, AsyncTokenCache
+
+if TYPE_CHECKING:
+    from azure.search.documents.aio import SearchClient
 
-logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger("voicerag")
 
 async def create_app():
     load_dotenv()
+    log_listener = configure_logging(
+        os.environ.get("LOG_LEVEL", "INFO"),
+        json_format=os.environ.get("LOG_FORMAT", "text").lower() == "json",
+        queue_size=int(os.environ.get("LOG_QUEUE_SIZE", 10_000))
+    )
 
-    # azure_credentials = get_azure_credentials(os.environ.get("AZURE_TENANT_ID"))
-    search_client: Optional[SearchClient] = None
+    search_client: Optional["SearchClient"] = None
     caller: Optional[AcsCaller] = None
 
-    # Load LLM connection and authentication
     llm_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
     llm_deployment = os.environ.get("AZURE_OPENAI_COMPLETION_DEPLOYMENT_NAME")
     llm_key = os.environ.get("AZURE_OPENAI_API_KEY")
-    llm_credential = AzureKeyCredential(llm_key)
-    if not llm_endpoint or not llm_deployment or not llm_credential:
-        raise ValueError("LLM connection or authentication error. Check environment variables.")
-
-    # Load Azure AI Search connection and authentication
     search_key = os.environ.get("AZURE_SEARCH_API_KEY")
     search_endpoint=os.environ.get("AZURE_SEARCH_ENDPOINT")
     search_index=os.environ.get("AZURE_SEARCH_INDEX")
     search_semantic_configuration=os.environ.get("AZURE_SEARCH_SEMANTIC_CONFIGURATION")
-    if (search_endpoint is not None and search_index is not None and search_key is not None and search_semantic_configuration is not None):
-        search_credential = AzureKeyCredential(search_key)
+    storage_connection_string = os.environ.get("AZURE_STORAGE_CONNECTION_STRING")
+    storage_account_url = os.environ.get("AZURE_STORAGE_ACCOUNT_URL")
+
+    # The services configured without a key authenticate with Entra ID, through one token cache shared by
+    # all of them, which refreshes the tokens in the background so that calls never wait on them
+    token_scopes = []
+    if not llm_key:
+        token_scopes.append(COGNITIVE_SERVICES_SCOPE)
+    if search_endpoint is not None and not search_key:
+        token_scopes.append(SEARCH_SCOPE)
+    if storage_account_url and not storage_connection_string:
+        token_scopes.append(STORAGE_SCOPE)
+    token_cache: Optional[AsyncTokenCache] = None
+    if token_scopes:
+        token_cache = AsyncTokenCache(
+            get_azure_credentials(os.environ.get("AZURE_TENANT_ID")),
+            token_scopes,
+            refresh_margin=float(os.environ.get("ENTRA_TOKEN_REFRESH_MARGIN_SECONDS", 300))
+        )
+
+    # Load LLM connection and authentication
+    llm_credential = AzureKeyCredential(llm_key) if llm_key else token_cache
+    if not llm_endpoint or not llm_deployment or not llm_credential:
+        raise ValueError("LLM connection or authentication error. Check environment variables.")
+
+    # Load Azure AI Search connection and authentication
+    if (search_endpoint is not None and search_index is not None and search_semantic_configuration is not None):
+        # The search SDK is only imported when search is configured, it is slow to import
+        from azure.search.documents.aio import SearchClient
+        search_credential = AzureKeyCredential(search_key) if search_key else token_cache
         search_client = SearchClient(search_endpoint, search_index, search_credential, user_agent="RTMiddleTier")
     else:
         logger.warning("Azure AI Search is not configured")
@@ -50,6 +84,7 @@ async def create_app():
     acs_callback_path = os.environ.get("ACS_CALLBACK_PATH")
     acs_media_streaming_websocket_path = os.environ.get("ACS_MEDIA_STREAMING_WEBSOCKET_PATH")
     acs_inbound_event_grid_path = os.environ.get("ACS_INBOUND_EVENT_GRID_PATH")
+    acs_sample_rate = int(os.environ.get("ACS_AUDIO_SAMPLE_RATE", 24000))
     if (acs_source_number is not None and
         acs_connection_string is not None and
         acs_callback_path is not None and
@@ -59,41 +94,120 @@ async def create_app():
             acs_connection_string,
             acs_callback_path,
             acs_media_streaming_websocket_path,
-            acs_inbound_event_grid_path
+            acs_inbound_event_grid_path,
+            acs_sample_rate,
+            max_concurrent_answers=int(os.environ.get("ACS_MAX_CONCURRENT_ANSWERS", 16)),
+            event_dedupe_ttl=float(os.environ.get("ACS_EVENT_DEDUPE_TTL_SECONDS", 600))
         )
     else:
         logger.warning("Azure Communication Services is not configured")
 
+    # Conversation logs are uploaded in the background so that hang-ups never wait on storage
+    conversation_log_sink = ConversationLogSink(
+        storage_connection_string,
+        os.environ.get("AZURE_STORAGE_CONTAINER"),
+        spool_dir=os.environ.get("CONVERSATION_LOG_SPOOL_DIR"),
+        account_url=storage_account_url,
+        credential=token_cache
+    )
+    # Transcripts are journaled to disk while the call goes on and handed to the sink at hang-up
+    transcript_journal = TranscriptJournal(
+        os.environ.get("CONVERSATION_JOURNAL_DIR"),
+        tail_size=int(os.environ.get("CONVERSATION_JOURNAL_TAIL", 20)),
+        flush_interval=float(os.environ.get("CONVERSATION_JOURNAL_FLUSH_SECONDS", 1))
+    )
+
+    # Each worker shares its metrics with the other workers of the container through this directory
+    metrics_exchange = WorkerMetricsExchange(
+        os.environ.get("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "voicerag-metrics"),
+        interval=float(os.environ.get("METRICS_SNAPSHOT_SECONDS", 5))
+    )
+
     # Create the OpenAI Realtime API handler
-    rtmt = RTMiddleTier(llm_endpoint, llm_deployment, llm_credential)
+    rtmt = RTMiddleTier(
+        llm_endpoint,
+        llm_deployment,
+        llm_credential,
+        pool_size=int(os.environ.get("AZURE_OPENAI_REALTIME_POOL_SIZE", 2)),
+        pool_idle_ttl=float(os.environ.get("AZURE_OPENAI_REALTIME_POOL_IDLE_TTL", 300)),
+        tool_timeout=float(os.environ.get("TOOL_TIMEOUT_SECONDS", 10)),
+        acs_sample_rate=acs_sample_rate,
+        normalize_input_gain=os.environ.get("ACS_AUDIO_NORMALIZE_GAIN", "false").lower() == "true",
+        vad_gate=os.environ.get("ACS_VAD_GATE", "false").lower() == "true",
+        vad_threshold_dbfs=float(os.environ.get("ACS_VAD_THRESHOLD_DBFS", -45)),
+        vad_pre_roll_ms=int(os.environ.get("ACS_VAD_PRE_ROLL_MS", 400)),
+        vad_hangover_ms=int(os.environ.get("ACS_VAD_HANGOVER_MS", 800)),
+        upstream_coalesce_ms=int(os.environ.get("ACS_UPSTREAM_COALESCE_MS", 60)),
+        upstream_coalesce_bytes=int(os.environ.get("ACS_UPSTREAM_COALESCE_BYTES", 0)) or None,
+        playback_frame_ms=int(os.environ.get("ACS_PLAYBACK_FRAME_MS", 40)),
+        playback_lead_ms=int(os.environ.get("ACS_PLAYBACK_LEAD_MS", 200)),
+        relay_queue_max_audio_bytes=int(os.environ.get("RELAY_QUEUE_MAX_AUDIO_BYTES", 192_000)),
+        journal=transcript_journal,
+        log_sample_every=int(os.environ.get("LOG_SAMPLE_EVERY", 50)),
+        record_dir=os.environ.get("RELAY_RECORD_DIR"),
+        record_anonymize_audio=os.environ.get("RELAY_RECORD_ANONYMIZE_AUDIO", "true").lower() == "true"
+    )
 
-    # Set the system prompt
-    system_prompt = None
+    # Set the system prompt: the one shipped with the app until the one in Azure Storage has been fetched,
+    # which is then kept up to date; new calls take the latest prompt, calls in progress keep theirs
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    prompt_provider = PromptProvider(
+        storage_connection_string,
+        container_name=os.environ.get("PROMPT_CONTAINER", "prompt"),
+        blob_name=os.environ.get("PROMPT_BLOB", "system_prompt.md"),
+        fallback_path=Path(BASE_DIR) / 'system_prompt.md',  # Ensure the file is in the same folder
+        on_update=lambda prompt: setattr(rtmt, "system_message", prompt),
+        refresh_interval=float(os.environ.get("PROMPT_REFRESH_SECONDS", 30)),
+        account_url=storage_account_url,
+        credential=token_cache
+    )
+    await prompt_provider.load_fallback()
 
-    # Attempt to fetch from Azure Storage
-    try:
-        system_prompt = await fetch_prompt_from_azure_storage(
-            container_name='prompt',
-            file_name='system_prompt.md'
-        )
-    except Exception as e:
-        logger.warning(f"Could not fetch system prompt from Azure Storage: {e}")
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        file_path = os.path.join(BASE_DIR, 'system_prompt.md')  # Ensure the file is in the same folder
-        system_prompt = await load_prompt_from_markdown(file_path)
+    async def warm_up_realtime():
+        await rtmt.start()
+        await rtmt.wait_warm()
 
-    rtmt.system_message = system_prompt
+    async def recover_journals():
+        # Finalize the conversations of workers that died in the middle of a call
+        for call_id, path in await asyncio.to_thread(transcript_journal.recover):
+            conversation_log_sink.submit_journal(call_id, path)
+
+    # The independent startup steps run concurrently in the background, each within its deadline;
+    # /ready reports the worker ready once they are all over and the call path (credentials, Realtime) is warm
+    startup = Startup(timeout=float(os.environ.get("STARTUP_STEP_TIMEOUT_SECONDS", 20)))
+    if token_cache is not None:
+        # Only the Realtime API token is on the call path, search and storage work without theirs
+        startup.add("credentials", token_cache.start, required=COGNITIVE_SERVICES_SCOPE in token_scopes)
+    if prompt_provider.remote_enabled:
+        startup.add("prompt", prompt_provider.refresh)
+    startup.add("realtime", warm_up_realtime, required=True)
+    startup.add("recovery", recover_journals)
 
     # Register the tools for function calling
     if search_client is not None and search_semantic_configuration is not None:
-        rtmt.tools["search"] = search_tool(search_client, search_semantic_configuration)
+        from backend.tools.rag.ai_search import report_grounding_tool, search_tool
+        search_cache = SearchResultCache(
+            max_entries=int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", 512)),
+            ttl=float(os.environ.get("SEARCH_CACHE_TTL_SECONDS", 300))
+        )
+        rtmt.tools["search"] = search_tool(
+            search_client,
+            search_semantic_configuration,
+            search_cache,
+            max_concurrent_queries=int(os.environ.get("SEARCH_MAX_CONCURRENT_QUERIES", 4)),
+            token_budget=int(os.environ.get("SEARCH_RESULT_TOKEN_BUDGET", 1000))
+        )
         rtmt.tools["report_grounding"] = report_grounding_tool(search_client)
+        # Opens the connection to the search service before the first call needs it
+        startup.add("search", search_client.get_document_count)
 
     # Define the WebSocket handler for the Web Frontend
     async def websocket_handler(request: web.Request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
-        await rtmt.forward_messages(ws, False)
+        journal = await rtmt.forward_messages(ws, False)
+        # Browser sessions are not logged
+        await transcript_journal.discard(journal)
         return ws
 
     # Define the WebSocket handler for the Azure Communication Services Audio Stream
@@ -105,12 +219,11 @@ async def create_app():
         direction = request.query.get("direction", "unknown")
         call_id = request.query.get("callConnectionId", "unknown-call")
 
-        print(f"Direzione flusso audio: {direction}")
-        print(f"🔌 WebSocket ACS connesso per call: {call_id}")
+        logger.info("🔌 WebSocket ACS connesso per call: %s (direzione flusso audio: %s)", call_id, direction)
 
         # Ricevi messaggi e salva log conversazione
-        messages = await rtmt.forward_messages(ws, True, request)
-        log_conversation(call_id, messages)
+        journal = await rtmt.forward_messages(ws, True, request)
+        conversation_log_sink.submit_journal(journal.call_id, journal.path)
 
         return ws
 
@@ -126,9 +239,23 @@ async def create_app():
     
     async def update_voice(request):
         data = await request.json()
-        rtmt.selected_voice = data.get('voice', 'alloy')
+        # Without a call_id the voice applies to calls started from now on, live calls keep theirs
+        try:
+            if not await rtmt.update_voice(data.get('voice', 'alloy'), data.get('call_id')):
+                return web.Response(status=404, text="Call not found")
+        except ValueError as e:
+            return web.Response(status=409, text=str(e))
         return web.Response(text="Voice selected successfully")
 
+    async def healthz(request):
+        return web.Response(text="ok")
+
+    async def ready(request):
+        return web.json_response({"ready": startup.ready, "steps": startup.status}, status=200 if startup.ready else 503)
+
+    async def metrics(request):
+        return web.Response(text=await metrics_exchange.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
     async def call(request):
         body = await request.json()
         if (caller is not None):
@@ -146,6 +273,30 @@ async def create_app():
     app.router.add_get("/realtime", websocket_handler)
     app.router.add_get("/realtime-acs", websocket_handler_acs)
     app.router.add_post('/update-voice', update_voice)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/healthz', healthz)
+    app.router.add_get('/ready', ready)
+
+    async def start_background_tasks(app):
+        conversation_log_sink.start()
+        metrics_exchange.start()
+        startup.start()
+        prompt_provider.start()
+
+    async def cleanup_background_tasks(app):
+        await startup.close()
+        await prompt_provider.close()
+        if token_cache is not None:
+            await token_cache.close()
+        await rtmt.close()
+        await conversation_log_sink.close()
+        await metrics_exchange.close()
+        if caller is not None:
+            await caller.close()
+        log_listener.stop()
+
+    app.on_startup.append(start_background_tasks)
+    app.on_cleanup.append(cleanup_background_tasks)
     
     if (caller is not None):
         app.router.add_post("/acs", caller.outbound_call_handler)
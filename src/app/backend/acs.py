@@ -1,8 +1,14 @@
+import asyncio
+import logging
 import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Hashable, Optional
 from aiohttp import web
 from azure.core.messaging import CloudEvent
+from azure.communication.callautomation.aio import CallAutomationClient
 from azure.communication.callautomation import (
-    CallAutomationClient,
     PhoneNumberIdentifier,
     MediaStreamingOptions,
     MediaStreamingTransportType,
@@ -10,6 +16,62 @@ from azure.communication.callautomation import (
     MediaStreamingAudioChannelType,
     AudioFormat,
 )
+from backend.logconfig import call_id_var
+from backend.metrics import Counter, Histogram
+
+logger = logging.getLogger("voicerag.acs")
+
+ring_to_answer = Histogram(
+    "voicerag_ring_to_answer_seconds",
+    "Time from ACS raising the IncomingCall event until the call is answered",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0)
+)
+call_control_latency = Histogram(
+    "voicerag_call_control_seconds",
+    "Duration of the Call Automation requests, by operation and outcome",
+    ["operation", "outcome"]
+)
+inbound_events = Counter(
+    "voicerag_inbound_call_events_total",
+    "IncomingCall events received from Event Grid, by outcome (answered, duplicate, failed)",
+    ["outcome"]
+)
+
+class RecentEvents:
+    """
+    Remembers the keys of the events seen in the last `ttl` seconds, up to `max_entries`, so that
+    events Event Grid delivers again are recognized.
+    """
+    max_entries: int
+    ttl: float
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, float] = OrderedDict()
+
+    def add(self, *keys: Optional[Hashable]) -> bool:
+        """
+        Records the keys, ignoring the missing ones. Returns False if any of them was already seen.
+        """
+        now = time.monotonic()
+        while self._entries:
+            oldest, expires_at = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[oldest]
+        keys = [key for key in keys if key is not None]
+        if any(key in self._entries for key in keys):
+            return False
+        for key in keys:
+            self._entries[key] = now + self.ttl
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def discard(self, *keys: Optional[Hashable]):
+        for key in keys:
+            self._entries.pop(key, None)
 
 class AcsCaller:
     source_number: str
@@ -17,10 +79,20 @@ class AcsCaller:
     callback_uri: str
     websocket_url: str
     media_streaming_configuration: MediaStreamingOptions
+    # Shared by all the calls of the process, so requests reuse its connections
+    call_automation_client: CallAutomationClient
+    # IncomingCall events already handed to an answer task, by event id and correlation id
+    recent_events: RecentEvents
 
-    def __init__(self, source_number: str, acs_connection_string: str, acs_callback_path: str, acs_media_streaming_websocket_path: str, acs_inbound_event_grid_path: str):
+    def __init__(self, source_number: str, acs_connection_string: str, acs_callback_path: str, acs_media_streaming_websocket_path: str, acs_inbound_event_grid_path: str, sample_rate: int = 24000,
+                 max_concurrent_answers: int = 16,
+                 event_dedupe_ttl: float = 600.0):
         self.source_number = source_number
         self.acs_connection_string = acs_connection_string
+        self.call_automation_client = CallAutomationClient.from_connection_string(acs_connection_string)
+        self.recent_events = RecentEvents(ttl=event_dedupe_ttl)
+        self._answer_slots = asyncio.Semaphore(max_concurrent_answers)
+        self._answer_tasks: set[asyncio.Task] = set()
 
         base_url = os.environ.get("ACS_BASE_URL")
         if not base_url:
@@ -30,8 +102,15 @@ class AcsCaller:
         self.websocket_url = base_url.rstrip("/").replace("https://", "wss://") + acs_media_streaming_websocket_path
         self.inbound_event_grid_path = base_url.rstrip("/") + acs_inbound_event_grid_path
 
-        print(f"Callback URI: {self.callback_uri}")
-        print(f"WebSocket URL: {self.websocket_url}")
+        logger.info("Callback URI: %s", self.callback_uri)
+        logger.info("WebSocket URL: %s", self.websocket_url)
+
+        audio_formats = {
+            16000: AudioFormat.PCM16_K_MONO,
+            24000: AudioFormat.PCM24_K_MONO,
+        }
+        if sample_rate not in audio_formats:
+            raise ValueError(f"Unsupported ACS media streaming sample rate {sample_rate}, expected one of {list(audio_formats)}")
 
         self.media_streaming_configuration = MediaStreamingOptions(
             transport_url=self.websocket_url,
@@ -40,23 +119,57 @@ class AcsCaller:
             audio_channel_type=MediaStreamingAudioChannelType.MIXED,
             start_media_streaming=True,
             enable_bidirectional=True,
-            audio_format=AudioFormat.PCM24_K_MONO,
+            audio_format=audio_formats[sample_rate],
         )
 
+    async def close(self):
+        if self._answer_tasks:
+            # Let the calls being answered get their answer before the client goes away
+            _, pending = await asyncio.wait(self._answer_tasks, timeout=5.0)
+            for task in pending:
+                task.cancel()
+        await self.call_automation_client.close()
+
     async def initiate_call(self, target_number: str):
-        print(f"📲 Inizio chiamata verso: {target_number}")
-        self.call_automation_client = CallAutomationClient.from_connection_string(self.acs_connection_string)
+        logger.info("📲 Inizio chiamata verso: %s", target_number)
         target_participant = PhoneNumberIdentifier(target_number)
         source_caller = PhoneNumberIdentifier(self.source_number)
 
-        print("Chiamata in corso...")
-        self.call_automation_client.create_call(
-            target_participant,
-            self.callback_uri,
-            media_streaming=self.media_streaming_configuration,
-            source_caller_id_number=source_caller,
-        )
-        print("create_call invocato")
+        logger.debug("Chiamata in corso...")
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            await self.call_automation_client.create_call(
+                target_participant,
+                self.callback_uri,
+                media_streaming=self.media_streaming_configuration,
+                source_caller_id_number=source_caller,
+            )
+            outcome = "ok"
+        finally:
+            call_control_latency.labels("create_call", outcome).observe(time.monotonic() - start)
+        logger.debug("create_call invocato")
+
+    async def answer_incoming_call(self, incoming_call_context: str, event_time: Optional[str] = None, received_at: Optional[float] = None):
+        """
+        Answers an incoming call and records the ring-to-answer time, from the `eventTime` of the
+        IncomingCall event, or from when the event was received (`time.time()`) if it has none.
+        """
+        raised_at = _parse_event_time(event_time) or received_at or time.time()
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            await self.call_automation_client.answer_call(
+                incoming_call_context,
+                self.callback_uri,
+                media_streaming=self.media_streaming_configuration
+            )
+            outcome = "ok"
+        finally:
+            call_control_latency.labels("answer_call", outcome).observe(time.monotonic() - start)
+        elapsed = time.time() - raised_at
+        ring_to_answer.observe(max(0.0, elapsed))
+        logger.info("✅ Risposta alla chiamata eseguita in %.0f ms dallo squillo", elapsed * 1000)
 
     async def outbound_call_handler(self, request):
         cloudevent = await request.json()
@@ -66,18 +179,25 @@ class AcsCaller:
                 continue
 
             call_connection_id = event.data.get("callConnectionId")
-            print(f"{event.type} ricevuto (CallConnectionId: {call_connection_id})")
+            call_id_var.set(call_connection_id or "-")
+            logger.info("%s ricevuto", event.type)
 
             if event.type == "Microsoft.Communication.CallConnected":
-                print("Chiamata connessa – attesa connessione WebSocket da ACS...")
+                logger.info("Chiamata connessa – attesa connessione WebSocket da ACS...")
 
         return web.Response(status=200)
     
     async def inbound_call_event_handler(self, request):
+        """
+        Acknowledges the Event Grid batch right away and answers its incoming calls in the background,
+        concurrently up to `max_concurrent_answers`, so Event Grid never times out and delivers it again.
+        Events delivered again anyway are recognized by their id or correlation id and skipped.
+        """
+        received_at = time.time()
         try:
             body = await request.json()
             if not isinstance(body, list):
-                print("Payload Event Grid non è una lista")
+                logger.warning("Payload Event Grid non è una lista")
                 return web.Response(status=400)
 
             for event_dict in body:
@@ -85,30 +205,56 @@ class AcsCaller:
 
                 if event_type == "Microsoft.EventGrid.SubscriptionValidationEvent":
                     validation_code = event_dict["data"]["validationCode"]
-                    print(f"Event Grid validation ricevuta: {validation_code}")
+                    logger.info("Event Grid validation ricevuta: %s", validation_code)
                     return web.json_response({"validationResponse": validation_code})
 
                 elif event_type == "Microsoft.Communication.IncomingCall":
                     data = event_dict["data"]
-                    incoming_call_context = data.get("incomingCallContext")
-                    from_number = data.get("from")
-                    to_number = data.get("to")
+                    keys = _event_keys(event_dict)
+                    if not self.recent_events.add(*keys):
+                        inbound_events.labels("duplicate").inc()
+                        logger.info("Evento IncomingCall %s già ricevuto, ignorato", event_dict.get("id"))
+                        continue
 
-                    print(f"Incoming call da {from_number} a {to_number}")
+                    logger.info("Incoming call da %s a %s", data.get("from"), data.get("to"))
 
                     # Rispondi alla chiamata
-                    call_automation_client = CallAutomationClient.from_connection_string(self.acs_connection_string)
-                    call_automation_client.answer_call(
-                        incoming_call_context,
-                        self.callback_uri,
-                        media_streaming=self.media_streaming_configuration
-                    )
-                    print("✅ Risposta alla chiamata eseguita")
-
-        except Exception as e:
-            print(f"Errore handler inbound: {str(e)}")
+                    task = asyncio.create_task(self._answer_in_background(data.get("incomingCallContext"), event_dict.get("eventTime"), received_at, keys))
+                    self._answer_tasks.add(task)
+                    task.add_done_callback(self._answer_tasks.discard)
+
+        except Exception:
+            logger.exception("Errore handler inbound")
             return web.Response(status=500)
 
         return web.Response(status=200)
 
+    async def _answer_in_background(self, incoming_call_context: str, event_time: Optional[str], received_at: float, keys: tuple[Optional[str], ...]):
+        async with self._answer_slots:
+            try:
+                await self.answer_incoming_call(incoming_call_context, event_time, received_at)
+                inbound_events.labels("answered").inc()
+            except Exception:
+                inbound_events.labels("failed").inc()
+                # A later delivery of the same event may still answer the call
+                self.recent_events.discard(*keys)
+                logger.exception("Errore risposta alla chiamata")
+
+def _event_keys(event_dict: dict) -> tuple[Optional[str], ...]:
+    event_id = event_dict.get("id")
+    correlation_id = (event_dict.get("data") or {}).get("correlationId")
+    return (
+        f"id:{event_id}" if event_id else None,
+        f"correlation:{correlation_id}" if correlation_id else None,
+    )
 
+def _parse_event_time(event_time: Optional[str]) -> Optional[float]:
+    if not event_time:
+        return None
+    try:
+        parsed = datetime.fromisoformat(event_time)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
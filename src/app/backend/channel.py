@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+import aiohttp
+from backend.metrics import Counter, Histogram
+
+logger = logging.getLogger("voicerag.channel")
+
+relay_queue_high_water = Histogram(
+    "voicerag_relay_queue_high_water_bytes",
+    "Largest backlog of each call's outbound queue, observed when the call ends",
+    ["direction"],
+    buckets=(1_000, 4_000, 16_000, 64_000, 128_000, 256_000, 512_000, 1_000_000)
+)
+relay_queue_dropped = Counter(
+    "voicerag_relay_queue_dropped_total",
+    "Audio messages dropped because the receiving side could not keep up",
+    ["direction"]
+)
+relay_messages = Counter(
+    "voicerag_relay_messages_total",
+    "Messages written to the client and upstream sockets",
+    ["direction"]
+)
+relay_bytes = Counter(
+    "voicerag_relay_bytes_total",
+    "Bytes written to the client and upstream sockets",
+    ["direction"]
+)
+
+class OutboundChannel:
+    """
+    Bounded outbound queue of one websocket, drained by its own writer task so that the task reading the
+    other socket never waits on this one. Messages are written in the order they were queued.
+    When the queued audio exceeds `max_audio_bytes` the oldest audio messages are dropped, since late audio
+    is worthless in a live call; control messages are never dropped.
+    `send_str` and `send_json` mirror the websocket methods and queue control messages; `on_sent` is called
+    once a control message has been written. Once a write fails the channel is closed and sending does nothing.
+    """
+    def __init__(self, direction: str, send: Callable[[str], Awaitable[Any]], max_audio_bytes: int = 192_000):
+        self.direction = direction
+        self._send = send
+        self.max_audio_bytes = max_audio_bytes
+        # (is_audio, message, on_sent)
+        self._queue: deque[tuple[bool, str, Optional[Callable[[], None]]]] = deque()
+        self._audio_bytes = 0
+        self._queued_bytes = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.high_water_bytes = 0
+        self.dropped = 0
+        self._sent_messages = relay_messages.labels(direction)
+        self._sent_bytes = relay_bytes.labels(direction)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """
+        Stops the writer, dropping what is still queued, and records the high-water mark of the call.
+        """
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            relay_queue_high_water.labels(self.direction).observe(self.high_water_bytes)
+        self._queue.clear()
+
+    def send_audio(self, message: str):
+        if self._closed:
+            return
+        self._queue.append((True, message, None))
+        self._audio_bytes += len(message)
+        self._queued_bytes += len(message)
+        if self._audio_bytes > self.max_audio_bytes:
+            self._drop_oldest_audio()
+        self._queued(0)
+
+    async def send_str(self, message: str, on_sent: Optional[Callable[[], None]] = None):
+        if self._closed:
+            return
+        self._queue.append((False, message, on_sent))
+        self._queued(len(message))
+
+    async def send_json(self, data: Any):
+        await self.send_str(json.dumps(data))
+
+    def drop_audio(self) -> int:
+        """
+        Drops all the queued audio, keeping the control messages. Returns the number of dropped messages.
+        """
+        if self._audio_bytes == 0:
+            return 0
+        kept = deque(entry for entry in self._queue if not entry[0])
+        dropped = len(self._queue) - len(kept)
+        self._queue = kept
+        self._queued_bytes -= self._audio_bytes
+        self._audio_bytes = 0
+        return dropped
+
+    def _stop(self):
+        self._closed = True
+        self._queue.clear()
+        self._audio_bytes = 0
+        self._queued_bytes = 0
+
+    def _queued(self, size: int):
+        self._queued_bytes += size
+        if self._queued_bytes > self.high_water_bytes:
+            self.high_water_bytes = self._queued_bytes
+        self._wakeup.set()
+
+    def _drop_oldest_audio(self):
+        kept = deque()
+        queue = self._queue
+        while queue and self._audio_bytes > self.max_audio_bytes:
+            entry = queue.popleft()
+            is_audio, message, _ = entry
+            if is_audio:
+                self._audio_bytes -= len(message)
+                self._queued_bytes -= len(message)
+                self.dropped += 1
+                relay_queue_dropped.labels(self.direction).inc()
+            else:
+                kept.append(entry)
+        # Control messages found on the way keep their place at the head of the queue
+        queue.extendleft(reversed(kept))
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            is_audio, message, on_sent = self._queue.popleft()
+            if is_audio:
+                self._audio_bytes -= len(message)
+            self._queued_bytes -= len(message)
+            try:
+                await self._send(message)
+            except (ConnectionError, aiohttp.ClientError, RuntimeError) as e:
+                # The socket is closing: the websocket raises ConnectionResetError, ClientConnectionResetError
+                # or RuntimeError depending on how far the close went
+                logger.debug("Socket %s closed, dropping %d queued messages: %r", self.direction, len(self._queue), e)
+                self._stop()
+                return
+            except Exception:
+                logger.exception("Writing to the %s socket failed, dropping %d queued messages", self.direction, len(self._queue))
+                self._stop()
+                return
+            self._sent_messages.inc()
+            self._sent_bytes.inc(len(message))
+            if on_sent is not None:
+                on_sent()
@@ -0,0 +1,144 @@
+import json
+import re
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library is used when it is not installed
+    orjson = None
+
+# The discriminator is always one of the first keys of ACS and OpenAI Realtime messages,
+# so only a short prefix of the raw text has to be scanned to classify a message.
+_PEEK_WINDOW = 96
+_ACS_KIND_PATTERN = re.compile(r'"kind"\s*:\s*"([A-Za-z]+)"')
+_OPENAI_TYPE_PATTERN = re.compile(r'"type"\s*:\s*"([A-Za-z_.]+)"')
+_ACS_AUDIO_DATA_PATTERN = re.compile(r'"data"\s*:\s*"')
+_OPENAI_AUDIO_DELTA_PATTERN = re.compile(r'"delta"\s*:\s*"')
+_OPENAI_AUDIO_APPEND_PATTERN = re.compile(r'"audio"\s*:\s*"')
+# The ids of an audio delta come before its payload
+_ID_PEEK_WINDOW = 320
+_OPENAI_RESPONSE_ID_PATTERN = re.compile(r'"response_id"\s*:\s*"([^"\\]+)"')
+
+# Prebuilt envelopes the base64 payload is spliced into
+_OPENAI_AUDIO_APPEND_PREFIX = '{"type":"input_audio_buffer.append","audio":"'
+_OPENAI_AUDIO_APPEND_SUFFIX = '"}'
+_ACS_AUDIO_DATA_PREFIX = '{"kind":"AudioData","audioData":{"data":"'
+_ACS_AUDIO_DATA_SUFFIX = '"}}'
+
+class JsonCodec:
+    """
+    Serializes the messages exchanged on the relay websockets using the standard library.
+    """
+    name = "json"
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+class OrjsonCodec(JsonCodec):
+    """
+    Same as JsonCodec, backed by orjson.
+    """
+    name = "orjson"
+
+    def loads(self, data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    """
+    Returns the codec with the given name, or the fastest one available when no name is given.
+    """
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("The orjson codec was requested but orjson is not installed")
+        return OrjsonCodec()
+    if name == "json":
+        return JsonCodec()
+    raise ValueError(f"Unknown codec: {name}")
+
+def _peek(raw: str, pattern: re.Pattern) -> Optional[str]:
+    match = pattern.search(raw, 0, _PEEK_WINDOW)
+    return match.group(1) if match is not None else None
+
+def peek_acs_kind(raw: str) -> Optional[str]:
+    """
+    Returns the `kind` of a raw ACS message without parsing it, or None if it is not found near the start.
+    """
+    return _peek(raw, _ACS_KIND_PATTERN)
+
+def peek_openai_type(raw: str) -> Optional[str]:
+    """
+    Returns the `type` of a raw OpenAI Realtime message without parsing it, or None if it is not found near the start.
+    """
+    return _peek(raw, _OPENAI_TYPE_PATTERN)
+
+def peek_openai_response_id(raw: str) -> Optional[str]:
+    """
+    Returns the `response_id` of a raw OpenAI Realtime message without parsing it, or None if it is not found near the start.
+    """
+    match = _OPENAI_RESPONSE_ID_PATTERN.search(raw, 0, _ID_PEEK_WINDOW)
+    return match.group(1) if match is not None else None
+
+def _extract_string(raw: str, pattern: re.Pattern) -> Optional[str]:
+    match = pattern.search(raw)
+    if match is None:
+        return None
+    start = match.end()
+    end = raw.find('"', start)
+    if end < 0:
+        return None
+    value = raw[start:end]
+    # Base64 never needs escaping, but some serializers escape '/' or '+' anyway.
+    # Leave those messages to the generic path instead of unescaping here.
+    if "\\" in value:
+        return None
+    return value
+
+def extract_acs_audio(raw: str) -> Optional[str]:
+    """
+    Returns the base64 payload of a raw ACS `AudioData` message, or None if the message must take the generic path.
+    """
+    if peek_acs_kind(raw) != "AudioData":
+        return None
+    return _extract_string(raw, _ACS_AUDIO_DATA_PATTERN)
+
+def extract_openai_audio_delta(raw: str) -> Optional[str]:
+    """
+    Returns the base64 payload of a raw OpenAI `response.audio.delta` message, or None if the message must take the generic path.
+    """
+    if peek_openai_type(raw) != "response.audio.delta":
+        return None
+    return _extract_string(raw, _OPENAI_AUDIO_DELTA_PATTERN)
+
+def extract_openai_audio_append(raw: str) -> Optional[str]:
+    """
+    Returns the base64 payload of a raw `input_audio_buffer.append` message, or None for any other message.
+    """
+    if peek_openai_type(raw) != "input_audio_buffer.append":
+        return None
+    return _extract_string(raw, _OPENAI_AUDIO_APPEND_PATTERN)
+
+def is_openai_audio_append(raw: str) -> bool:
+    """
+    Checks whether a raw client message is an `input_audio_buffer.append` that can be forwarded untouched.
+    """
+    return peek_openai_type(raw) == "input_audio_buffer.append" and _OPENAI_AUDIO_APPEND_PATTERN.search(raw) is not None
+
+def openai_audio_append(audio: str) -> str:
+    """
+    Builds an `input_audio_buffer.append` message around a base64 payload, same as `transform_acs_to_openai_format`.
+    """
+    return _OPENAI_AUDIO_APPEND_PREFIX + audio + _OPENAI_AUDIO_APPEND_SUFFIX
+
+def acs_audio_data(audio: str) -> str:
+    """
+    Builds an ACS `AudioData` message around a base64 payload, same as `transform_openai_to_acs_format`.
+    """
+    return _ACS_AUDIO_DATA_PREFIX + audio + _ACS_AUDIO_DATA_SUFFIX
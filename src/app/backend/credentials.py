@@ -0,0 +1,142 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Optional
+from azure.core.credentials import AccessToken
+from backend.metrics import Histogram
+
+logger = logging.getLogger("voicerag.credentials")
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+SEARCH_SCOPE = "https://search.azure.com/.default"
+STORAGE_SCOPE = "https://storage.azure.com/.default"
+
+token_acquisition_latency = Histogram(
+    "voicerag_token_acquisition_seconds",
+    "Time to get an Entra ID token from the credential, by scope, what asked for it (startup, refresh, or a request that found no valid token) and outcome",
+    ["scope", "trigger", "outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+)
+
+def _scope_label(scope: str) -> str:
+    return scope.split("://", 1)[-1].split("/", 1)[0]
+
+class AsyncTokenCache:
+    """
+    Entra ID bearer tokens for the whole process, shared by the Realtime upstream and the Search and Blob
+    clients. Tokens are cached per scope and refreshed in the background `refresh_margin` seconds before
+    they expire, so getting one never waits on the network once the scope has been fetched; concurrent
+    requests for a missing token share a single fetch. Synchronous credentials (`azure.identity`) are called
+    on a worker thread, asynchronous ones (`azure.identity.aio`) are awaited.
+
+    It implements the `AsyncTokenCredential` protocol, so it can be passed as the credential of the async
+    Azure SDK clients.
+    """
+    scopes: list[str]
+    refresh_margin: float
+
+    def __init__(self, credential: Any, scopes: Optional[list[str]] = None, refresh_margin: float = 300.0, retry_interval: float = 10.0):
+        self.credential = credential
+        self.scopes = list(scopes or [])
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._tokens: dict[str, AccessToken] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._refresh_needed = asyncio.Event()
+
+    async def start(self):
+        """
+        Fetches the tokens of `scopes` concurrently and starts refreshing them in the background.
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+        await asyncio.gather(*(self._fetch(scope, "startup") for scope in self.scopes))
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        close = getattr(self.credential, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+    async def get_token(self, *scopes: str, **kwargs: Any) -> AccessToken:
+        # Options such as claims challenges are not cached, they are rare enough to go to the credential
+        if len(scopes) != 1 or kwargs.get("claims") or kwargs.get("tenant_id"):
+            return await self._call_credential(*scopes, **kwargs)
+        scope = scopes[0]
+        token = self._tokens.get(scope)
+        # A token about to expire is not handed out, it could expire before the request reaches the service
+        if token is not None and token.expires_on - 30 > time.time():
+            return token
+        return await self._fetch(scope, "request")
+
+    async def bearer_token(self, scope: str) -> str:
+        return (await self.get_token(scope)).token
+
+    async def _fetch(self, scope: str, trigger: str) -> AccessToken:
+        task = self._inflight.get(scope)
+        if task is None:
+            task = asyncio.create_task(self._fetch_once(scope, trigger))
+            self._inflight[scope] = task
+        # Shielded so a request that is cancelled (for example a caller hanging up) does not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    async def _fetch_once(self, scope: str, trigger: str) -> AccessToken:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            token = await self._call_credential(scope)
+            outcome = "ok"
+        finally:
+            self._inflight.pop(scope, None)
+            token_acquisition_latency.labels(_scope_label(scope), trigger, outcome).observe(time.perf_counter() - start)
+        self._tokens[scope] = token
+        if scope not in self.scopes:
+            self.scopes.append(scope)
+        # The refresh loop reschedules itself on the new expiry
+        self._refresh_needed.set()
+        return token
+
+    async def _call_credential(self, *scopes: str, **kwargs: Any) -> AccessToken:
+        if inspect.iscoroutinefunction(self.credential.get_token):
+            return await self.credential.get_token(*scopes, **kwargs)
+        return await asyncio.to_thread(self.credential.get_token, *scopes, **kwargs)
+
+    def _next_refresh_in(self) -> Optional[float]:
+        if not self._tokens:
+            return None
+        return min(token.expires_on for token in self._tokens.values()) - self.refresh_margin - time.time()
+
+    async def _refresh_loop(self):
+        while True:
+            delay = self._next_refresh_in()
+            self._refresh_needed.clear()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._refresh_needed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            failed = False
+            for scope, token in list(self._tokens.items()):
+                if token.expires_on - self.refresh_margin <= time.time():
+                    try:
+                        await self._fetch(scope, "refresh")
+                    except Exception as e:
+                        failed = True
+                        logger.warning("Could not refresh the Entra ID token for %s, the current one expires in %.0f s: %s",
+                                       scope, token.expires_on - time.time(), e)
+            next_refresh_in = self._next_refresh_in()
+            if failed or (next_refresh_in is not None and next_refresh_in <= 0):
+                # Also paces the refresh of tokens that are issued with less than `refresh_margin` to live
+                await asyncio.sleep(self.retry_interval)
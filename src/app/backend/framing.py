@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import binascii
+import time
+from collections import deque
+from typing import Callable, Optional
+
+def _decoded_length(audio: str) -> int:
+    return len(audio) * 3 // 4 - (len(audio) - len(audio.rstrip("=")))
+
+class AudioCoalescer:
+    """
+    Batches small base64 pcm16 frames into larger ones, so that the caller audio goes upstream in fewer
+    `input_audio_buffer.append` messages. `add` returns a batch once `max_ms` of audio (or `max_bytes`
+    of PCM, whichever comes first) has been collected; `flush` returns whatever is pending.
+    """
+    def __init__(self, sample_rate: int, max_ms: int = 60, max_bytes: Optional[int] = None):
+        budget = sample_rate * max_ms // 1000 * 2
+        self.max_bytes = min(budget, max_bytes) if max_bytes else budget
+        self._chunks: list[str] = []
+        self._bytes = 0
+
+    @property
+    def pending(self) -> bool:
+        return len(self._chunks) > 0
+
+    def add(self, audio: str) -> Optional[str]:
+        self._chunks.append(audio)
+        self._bytes += _decoded_length(audio)
+        if self._bytes >= self.max_bytes:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        chunks, self._chunks, self._bytes = self._chunks, [], 0
+        if len(chunks) <= 1:
+            return chunks[0] if chunks else None
+        # Unpadded base64 chunks encode whole 3 byte groups and can simply be concatenated
+        if not any(chunk.endswith("=") for chunk in chunks[:-1]):
+            return "".join(chunks)
+        return base64.b64encode(b"".join(binascii.a2b_base64(chunk) for chunk in chunks)).decode("ascii")
+
+class PacedAudioSender:
+    """
+    Re-chunks the assistant audio into fixed `frame_ms` frames and sends them at real-time rate, at most
+    `lead_ms` ahead of what the client is playing. OpenAI produces audio faster than real time, so without
+    pacing the whole answer ends up in the client's playback buffer and an interruption cannot stop it;
+    here the rest stays in this queue, where `clear` drops it.
+    """
+    def __init__(self, send: Callable[[str], None], sample_rate: int, frame_ms: int = 40, lead_ms: int = 200):
+        self._send = send
+        self.frame_ms = frame_ms
+        self.lead = lead_ms / 1000
+        self.set_sample_rate(sample_rate)
+        self._buffer = bytearray()
+        self._frames: deque[bytes] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Monotonic time at which the client finishes playing the audio sent so far
+        self._playhead = 0.0
+
+    def set_sample_rate(self, sample_rate: int):
+        self._bytes_per_second = sample_rate * 2
+        self._frame_bytes = sample_rate * self.frame_ms // 1000 * 2
+
+    @property
+    def queued_ms(self) -> float:
+        queued = len(self._buffer) + sum(len(frame) for frame in self._frames)
+        return 1000 * queued / self._bytes_per_second
+
+    @property
+    def pending_ms(self) -> float:
+        """
+        Audio fed but not played by the client yet: still queued here, or sent and waiting in the client's buffer.
+        """
+        return self.queued_ms + 1000 * max(0.0, self._playhead - time.monotonic())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def feed(self, audio: str):
+        self._buffer += binascii.a2b_base64(audio)
+        frame_bytes = self._frame_bytes
+        if len(self._buffer) >= frame_bytes:
+            whole = len(self._buffer) - len(self._buffer) % frame_bytes
+            view = memoryview(self._buffer)
+            self._frames.extend(bytes(view[i:i + frame_bytes]) for i in range(0, whole, frame_bytes))
+            view.release()
+            del self._buffer[:whole]
+            self._wakeup.set()
+
+    def end_of_audio(self):
+        """
+        Queues the last partial frame of an answer.
+        """
+        if self._buffer:
+            self._frames.append(bytes(self._buffer))
+            self._buffer.clear()
+            self._wakeup.set()
+
+    def clear(self) -> float:
+        """
+        Drops the audio not sent yet, and assumes the client stops playing too. Returns the dropped milliseconds.
+        """
+        dropped = self.queued_ms
+        self._buffer.clear()
+        self._frames.clear()
+        self._playhead = time.monotonic()
+        return dropped
+
+    async def _run(self):
+        while True:
+            if not self._frames:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            if self._playhead < now:
+                # The client has played everything, start a new stretch from now
+                self._playhead = now
+            ahead = self._playhead - now
+            if ahead > self.lead:
+                await asyncio.sleep(ahead - self.lead)
+                continue
+            frame = self._frames.popleft()
+            self._playhead += len(frame) / self._bytes_per_second
+            self._send(base64.b64encode(frame).decode("ascii"))
@@ -1,14 +1,140 @@
+import base64
+import binascii
 import json
-from openai.types.beta.realtime import (InputAudioBufferAppendEvent, SessionUpdateEvent)
-from openai.types.beta.realtime.session_update_event import Session, SessionTurnDetection
-from typing import Any, Literal, Optional
+import numpy as np
+from math import gcd
+from typing import TYPE_CHECKING, Any, Literal, Optional
 from backend.tools.tools import Tool
 
-def transform_acs_to_openai_format(msg_data: Any, model: Optional[str], tools: dict[str, Tool], system_message: Optional[str], temperature: Optional[float], max_tokens: Optional[int], disable_audio: Optional[bool], voice: str) -> InputAudioBufferAppendEvent | SessionUpdateEvent | Any | None:
+if TYPE_CHECKING:
+    # Only used in annotations, importing the openai package takes a good part of a second
+    from openai.types.beta.realtime import InputAudioBufferAppendEvent, SessionUpdateEvent
+
+# The OpenAI Realtime API exchanges pcm16 audio at 24 kHz, mono, little endian
+OPENAI_SAMPLE_RATE = 24000
+SUPPORTED_SAMPLE_RATES = (8000, 16000, 24000)
+
+def _lowpass_filter(cutoff: float, taps: int) -> np.ndarray:
+    """
+    Windowed-sinc low-pass FIR filter. `cutoff` is relative to the Nyquist frequency.
+    """
+    n = np.arange(taps) - (taps - 1) / 2
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(taps, 8.0)
+    return (h / h.sum()).astype(np.float32)
+
+class Resampler:
+    """
+    Streaming rational resampler: zero-stuffs by `up`, low-pass filters and keeps every `down`-th sample.
+    The filter history and decimation phase are carried over between frames, so consecutive frames
+    resample exactly like one continuous signal. The zero-stuffing buffer is kept and reused across frames.
+    """
+    def __init__(self, from_rate: int, to_rate: int, taps_per_phase: int = 16):
+        divisor = gcd(from_rate, to_rate)
+        self.up = to_rate // divisor
+        self.down = from_rate // divisor
+        taps = taps_per_phase * max(self.up, self.down) + 1
+        # Cut below the lower of the two Nyquist frequencies, the gain of `up` restores the level after zero-stuffing
+        self._filter = _lowpass_filter(0.95 / max(self.up, self.down), taps) * self.up
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._stuffed = np.zeros(0, dtype=np.float32)
+        self._phase = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        history = len(self._history)
+        size = len(samples) * self.up + history
+        if len(self._stuffed) < size:
+            self._stuffed = np.zeros(size, dtype=np.float32)
+        stuffed = self._stuffed[:size]
+        if self.up > 1:
+            stuffed.fill(0)
+        stuffed[:history] = self._history
+        stuffed[history::self.up] = samples
+        filtered = np.convolve(stuffed, self._filter, mode="valid")
+        # Copied, the buffer is overwritten by the next frame
+        self._history[:] = stuffed[size - history:]
+        out = filtered[self._phase::self.down]
+        self._phase = (self._phase - len(filtered)) % self.down
+        return out
+
+class GainNormalizer:
+    """
+    Slow automatic gain control that brings speech towards `target_dbfs` RMS. Frames quieter than
+    `noise_floor_dbfs` leave the gain unchanged so that line noise is not amplified.
+    """
+    def __init__(self, target_dbfs: float = -20.0, max_gain_db: float = 18.0, noise_floor_dbfs: float = -50.0, smoothing: float = 0.2):
+        self.target_rms = 32768 * 10 ** (target_dbfs / 20)
+        self.max_gain = 10 ** (max_gain_db / 20)
+        self.noise_floor_rms = 32768 * 10 ** (noise_floor_dbfs / 20)
+        self.smoothing = smoothing
+        self.gain = 1.0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if len(samples) == 0:
+            return samples
+        rms = float(np.sqrt(np.dot(samples, samples) / len(samples)))
+        if rms > self.noise_floor_rms:
+            wanted = min(self.max_gain, self.target_rms / rms)
+            self.gain += (wanted - self.gain) * self.smoothing
+        samples *= self.gain
+        return samples
+
+class AudioConverter:
+    """
+    Converts base64 pcm16 mono audio from `from_rate` to `to_rate`, with optional gain normalization.
+    Keeps per-stream state (filter history, gain, odd trailing bytes), so use one converter per call and direction.
+    When the rates match and no normalization is requested the payload is returned untouched.
+    The float32 and int16 sample buffers are allocated once per converter and grown when a larger frame comes.
+    """
+    def __init__(self, from_rate: int, to_rate: int, normalize_gain: bool = False):
+        for rate in (from_rate, to_rate):
+            if rate not in SUPPORTED_SAMPLE_RATES:
+                raise ValueError(f"Unsupported sample rate {rate}, expected one of {SUPPORTED_SAMPLE_RATES}")
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self.resampler = Resampler(from_rate, to_rate) if from_rate != to_rate else None
+        self.normalizer = GainNormalizer() if normalize_gain else None
+        self._remainder = b""
+        self._samples = np.zeros(0, dtype=np.float32)
+        self._pcm_out = np.zeros(0, dtype="<i2")
+
+    @property
+    def passthrough(self) -> bool:
+        return self.resampler is None and self.normalizer is None
+
+    def convert(self, audio: str) -> str:
+        if self.passthrough:
+            return audio
+        pcm = binascii.a2b_base64(audio)
+        if self._remainder:
+            pcm = self._remainder + pcm
+        # A frame may end in the middle of a sample, keep the odd byte for the next one
+        usable = len(pcm) & ~1
+        self._remainder = pcm[usable:]
+        count = usable // 2
+        if len(self._samples) < count:
+            self._samples = np.zeros(count, dtype=np.float32)
+        # A view on the decoded bytes, converted into the reused float buffer
+        samples = self._samples[:count]
+        np.copyto(samples, np.frombuffer(pcm, dtype="<i2", count=count))
+
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        if self.normalizer is not None:
+            samples = self.normalizer.process(samples)
+
+        np.clip(np.rint(samples, out=samples), -32768, 32767, out=samples)
+        if len(self._pcm_out) < len(samples):
+            self._pcm_out = np.zeros(len(samples), dtype="<i2")
+        pcm_out = self._pcm_out[:len(samples)]
+        np.copyto(pcm_out, samples, casting="unsafe")
+        return base64.b64encode(memoryview(pcm_out)).decode("ascii")
+
+def transform_acs_to_openai_format(msg_data: Any, model: Optional[str], tools: dict[str, Tool], system_message: Optional[str], temperature: Optional[float], max_tokens: Optional[int], disable_audio: Optional[bool], voice: str, converter: Optional[AudioConverter] = None) -> "InputAudioBufferAppendEvent | SessionUpdateEvent | Any | None":
     """
     Transforms websocket message data from Azure Communication Services (ACS) to the OpenAI Realtime API format.
     Args:
         msg_data_json (str): The JSON string containing the ACS message data.
+        converter (AudioConverter): Optional converter from the ACS audio format to the OpenAI Realtime API audio format.
     Returns:
         Optional[str]: The transformed message in the OpenAI Realtime API format
     This is needed to plug the Azure Communication Services audio stream into the OpenAI Realtime API.
@@ -47,18 +173,20 @@ def transform_acs_to_openai_format(msg_data: Any, model: Optional[str], tools: d
     # Message from Azure Communication Services with audio data.
     # Transform the message to the OpenAI Realtime API format.
     elif msg_data["kind"] == "AudioData":
+        audio = msg_data["audioData"]["data"]
         oai_message = {
             "type": "input_audio_buffer.append",
-            "audio": msg_data["audioData"]["data"]
+            "audio": converter.convert(audio) if converter is not None else audio
         }
 
     return oai_message
 
-def transform_openai_to_acs_format(msg_data: Any) -> Optional[Any]:
+def transform_openai_to_acs_format(msg_data: Any, converter: Optional[AudioConverter] = None) -> Optional[Any]:
     """
     Transforms websocket message data from the OpenAI Realtime API format into the Azure Communication Services (ACS) format.
     Args:
         msg_data_json (str): The JSON string containing the message data from the OpenAI Realtime API.
+        converter (AudioConverter): Optional converter from the OpenAI Realtime API audio format to the ACS audio format.
     Returns:
         Optional[str]: A JSON string containing the transformed message in ACS format, or None if the message type is not handled.
     This is needed to plug the OpenAI Realtime API audio stream into Azure Communication Services.
@@ -73,7 +201,7 @@ def transform_openai_to_acs_format(msg_data: Any) -> Optional[Any]:
         acs_message = {
             "kind": "AudioData",
             "audioData": {
-                "data": msg_data["delta"]
+                "data": converter.convert(msg_data["delta"]) if converter is not None else msg_data["delta"]
             }
         }
 
@@ -88,8 +216,3 @@ def transform_openai_to_acs_format(msg_data: Any) -> Optional[Any]:
         }
 
     return acs_message
-
-async def load_prompt_from_markdown(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        prompt = file.read()
-    return prompt
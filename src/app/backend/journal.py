@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import Any, Optional
+from backend.process import process_alive
+
+logger = logging.getLogger("voicerag.journal")
+
+class CallJournal:
+    """
+    Transcript of one call, appended to `{call_id}.{pid}.jsonl` as the call goes on. Only the last `tail_size`
+    entries stay in memory; the file is written by the `TranscriptJournal` flusher, so a worker that dies
+    loses at most the last flush interval of the conversation.
+    """
+    __slots__ = ("call_id", "path", "tail", "count", "_pending", "_closed")
+
+    def __init__(self, call_id: str, path: Path, tail_size: int):
+        self.call_id = call_id
+        self.path = path
+        self.tail: deque[dict] = deque(maxlen=tail_size)
+        self.count = 0
+        self._pending: list[str] = []
+        self._closed = False
+
+    def append(self, entry: dict):
+        if self._closed:
+            return
+        self.tail.append(entry)
+        self.count += 1
+        self._pending.append(json.dumps(entry, default=str))
+
+    def _take_pending(self) -> Optional[str]:
+        if not self._pending:
+            return None
+        lines, self._pending = self._pending, []
+        return "\n".join(lines) + "\n"
+
+class TranscriptJournal:
+    """
+    Manages the call journals of this process in `directory` and flushes them every `flush_interval` seconds.
+    Journals are handed to the `ConversationLogSink` when the call ends; `recover` claims the ones left
+    behind by workers that died in the middle of a call.
+    """
+    directory: Path
+
+    def __init__(self, directory: Optional[str] = None, tail_size: int = 20, flush_interval: float = 1.0):
+        self.directory = Path(directory or os.path.join(tempfile.gettempdir(), "voicerag-journal"))
+        self.tail_size = tail_size
+        self.flush_interval = flush_interval
+        self._journals: dict[str, CallJournal] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._flusher is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._flusher = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        # Journals of calls still open stay on disk and are recovered at the next start
+        await self._flush(list(self._journals.values()))
+
+    def open(self, call_id: str) -> CallJournal:
+        journal = CallJournal(call_id, self.directory / f"{call_id}.{os.getpid()}.jsonl", self.tail_size)
+        self._journals[call_id] = journal
+        return journal
+
+    async def finish(self, journal: CallJournal) -> Path:
+        """
+        Writes what is still pending and stops tracking the journal. The file stays until it is uploaded or discarded.
+        """
+        journal._closed = True
+        self._journals.pop(journal.call_id, None)
+        await self._flush([journal])
+        return journal.path
+
+    async def discard(self, journal: CallJournal):
+        journal._closed = True
+        self._journals.pop(journal.call_id, None)
+        await asyncio.to_thread(journal.path.unlink, missing_ok=True)
+
+    def recover(self) -> list[tuple[str, Path]]:
+        """
+        Claims the journals of processes that are no longer running, by renaming them to this process,
+        and returns them as (call_id, path) so they can be finalized. Safe to run from several workers at once.
+        """
+        recovered = []
+        for path in sorted(self.directory.glob("*.jsonl")):
+            call_id, _, pid = path.stem.rpartition(".")
+            if not call_id or not pid.isdigit() or int(pid) == os.getpid() or process_alive(int(pid)):
+                continue
+            claimed = path.with_name(f"{call_id}.{os.getpid()}.jsonl")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Another worker got there first
+                continue
+            logger.info("Recovered the journal of call %s left by process %s", call_id, pid)
+            recovered.append((call_id, claimed))
+        return recovered
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush(list(self._journals.values()))
+
+    async def _flush(self, journals: list[CallJournal]):
+        writes = [(journal.path, data) for journal in journals if (data := journal._take_pending()) is not None]
+        if writes:
+            try:
+                await asyncio.to_thread(_append_all, writes)
+            except OSError as e:
+                logger.error("Could not write call journals: %s", e)
+
+def _append_all(writes: list[tuple[Path, str]]):
+    for path, data in writes:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+def read_journal(path: Path) -> list[Any]:
+    """
+    Reads the entries of a journal, skipping a last line cut short by a crash.
+    """
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning("Skipping a truncated line in %s", path)
+    return entries
@@ -1,14 +1,21 @@
-import os
+import asyncio
 import json
-from azure.storage.blob import BlobServiceClient
+import logging
+import os
+import random
+import tempfile
+import time
 from datetime import datetime, timezone
 from json import JSONEncoder
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+from backend.journal import read_journal
+from backend.logconfig import call_id_var
 
-# Config da env
-connection_string = os.environ.get("AZURE_STORAGE_CONNECTION_STRING")
-container_name = os.environ.get("AZURE_STORAGE_CONTAINER")
+if TYPE_CHECKING:
+    from azure.storage.blob.aio import BlobServiceClient
 
-blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+logger = logging.getLogger("voicerag.log")
 
 # Encoder custom per supportare datetime, timezone, ecc.
 class SafeJSONEncoder(JSONEncoder):
@@ -17,24 +24,279 @@ class SafeJSONEncoder(JSONEncoder):
             return obj.isoformat()
         return super().default(obj)
 
-def log_conversation(call_id: str, messages: list[dict]):
-    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H_%M_%SZ")
-    filename = f"{call_id}/conversation_{timestamp}.json"
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=filename)
+class ConversationLogSink:
+    """
+    Non-blocking uploader for conversation logs.
+    Callers hand over a finished conversation with `submit`, or the journal of a call with `submit_journal`,
+    which never await: the record is put on a bounded in-process queue and a background task drains it
+    in batches to Azure Blob Storage using the async SDK.
+    Failed uploads are retried with exponential backoff; records that still cannot be uploaded (or that do not fit
+    in the queue) are written to a local spool directory and re-sent later. `close` flushes everything on shutdown.
+    """
+    connection_string: Optional[str]
+    container_name: Optional[str]
+    spool_dir: Path
+
+    def __init__(self,
+                 connection_string: Optional[str],
+                 container_name: Optional[str],
+                 spool_dir: Optional[str] = None,
+                 max_queue_size: int = 1000,
+                 batch_size: int = 16,
+                 batch_interval: float = 1.0,
+                 max_retries: int = 4,
+                 upload_timeout: float = 15.0,
+                 spool_retry_interval: float = 60.0,
+                 account_url: Optional[str] = None,
+                 credential: Optional[Any] = None):
+        self.connection_string = connection_string
+        # Without a connection string, the account URL and an Entra ID credential such as `AsyncTokenCache`
+        self.account_url = account_url
+        self.credential = credential
+        self.container_name = container_name
+        self.spool_dir = Path(spool_dir or os.path.join(tempfile.gettempdir(), "voicerag-log-spool"))
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_retries = max_retries
+        self.upload_timeout = upload_timeout
+        self.spool_retry_interval = spool_retry_interval
+
+        self._queue: asyncio.Queue[tuple[str, Any]] = asyncio.Queue(maxsize=max_queue_size)
+        self._client: Optional["BlobServiceClient"] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._background: set[asyncio.Future] = set()
+        self._inflight: list[tuple[str, Any]] = []
+        self._closed = False
+        self._last_spool_replay = 0.0
+
+    @property
+    def upload_enabled(self) -> bool:
+        return bool((self.connection_string or (self.account_url and self.credential)) and self.container_name)
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        if self.upload_enabled:
+            if self._client is None:
+                # Imported on first use, the storage SDK is slow to import and not needed without uploads
+                from azure.storage.blob.aio import BlobServiceClient
+                if self.connection_string:
+                    self._client = BlobServiceClient.from_connection_string(self.connection_string)
+                else:
+                    self._client = BlobServiceClient(self.account_url, credential=self.credential)
+        else:
+            logger.warning("Conversation log upload is not configured, logs are kept in %s", self.spool_dir)
+        self._worker = asyncio.create_task(self._run())
+
+    def submit(self, call_id: str, messages: list[dict]) -> bool:
+        """
+        Enqueues a conversation for upload without waiting. Returns False if the sink is closed.
+        When the queue is full the record is spooled to disk on a worker thread instead.
+        """
+        return self._enqueue(call_id, {"messages": messages})
+
+    def submit_journal(self, call_id: str, path: Path) -> bool:
+        """
+        Same as `submit` for a conversation journaled to `path` (see `TranscriptJournal`). The journal is read
+        only when the record is uploaded, and deleted once it has been uploaded or spooled.
+        """
+        return self._enqueue(call_id, {"journal": str(path)})
 
-    try:
-        json_data = json.dumps({
+    def _enqueue(self, call_id: str, content: dict) -> bool:
+        if self._closed:
+            logger.warning("Conversation log sink closed, dropping log for call %s", call_id)
+            return False
+
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H_%M_%SZ")
+        blob_name = f"{call_id}/conversation_{timestamp}.json"
+        record = {
             "call_id": call_id,
             "timestamp": timestamp,
-            "messages": messages
-        }, indent=2, cls=SafeJSONEncoder)
-
-        blob_client.upload_blob(json_data, overwrite=True)
-        print(f"📝 Log JSON salvato: {filename}")
-    except Exception as e:
-        print(f"❌ Errore salvataggio JSON su blob: {e}")
-        print("🔍 Dump parziale JSON (debug):")
+            **content
+        }
+        try:
+            self._queue.put_nowait((blob_name, record))
+        except asyncio.QueueFull:
+            logger.warning("Conversation log queue full, spooling %s to disk", blob_name)
+            self._run_in_background(asyncio.to_thread(self._spool_record, blob_name, record))
+        return True
+
+    async def close(self, timeout: float = 30.0):
+        """
+        Stops accepting new records, uploads what is still queued and spools anything left when `timeout` expires.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._drain(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Timed out flushing conversation logs, spooling the remaining ones")
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+        # Whatever was not uploaded in time (including an interrupted batch) goes to the spool
+        leftovers = list(self._inflight)
+        while not self._queue.empty():
+            leftovers.append(self._queue.get_nowait())
+        for blob_name, record in leftovers:
+            try:
+                await asyncio.to_thread(self._spool_record, blob_name, record)
+            except OSError as e:
+                logger.error("Could not spool conversation log %s, log lost: %s", blob_name, e)
+
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def _drain(self):
+        await self._queue.join()
+
+    def _run_in_background(self, awaitable):
+        future = asyncio.ensure_future(awaitable)
+        self._background.add(future)
+        future.add_done_callback(self._background.discard)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            if batch:
+                # Kept until the batch completes so `close` can spool it if the worker is cancelled mid-upload
+                self._inflight = batch
+                await asyncio.gather(*(self._upload_or_spool(blob_name, record) for blob_name, record in batch))
+                self._inflight = []
+                for _ in batch:
+                    self._queue.task_done()
+
+            if time.monotonic() - self._last_spool_replay >= self.spool_retry_interval:
+                self._last_spool_replay = time.monotonic()
+                try:
+                    await self._replay_spool()
+                except Exception:
+                    # The worker must keep draining the queue, the spool is retried at the next interval
+                    logger.exception("Replaying the spooled conversation logs failed")
+
+    async def _next_batch(self) -> list[tuple[str, Any]]:
+        try:
+            first = await asyncio.wait_for(self._queue.get(), self.spool_retry_interval)
+        except asyncio.TimeoutError:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and self._queue.empty():
+                break
+            try:
+                batch.append(self._queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(self._queue.get(), remaining))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _upload_or_spool(self, blob_name: str, record: Any):
+        # Runs in its own task, the records of the batch each get their call id
+        call_id_var.set(record.get("call_id", "-"))
+        try:
+            data = await asyncio.to_thread(self._serialize, record)
+        except OSError as e:
+            logger.error("Could not read the journal of conversation log %s, log lost: %s", blob_name, e)
+            return
+        if not await self._upload(blob_name, data):
+            try:
+                await asyncio.to_thread(self._spool, blob_name, data)
+            except OSError as e:
+                logger.error("Could not spool conversation log %s, keeping its journal: %s", blob_name, e)
+                return
+        await asyncio.to_thread(self._release, record)
+
+    async def _upload(self, blob_name: str, data: str) -> bool:
+        if self._client is None:
+            return False
+
+        blob_client = self._client.get_blob_client(container=self.container_name, blob=blob_name)
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.wait_for(blob_client.upload_blob(data, overwrite=True), self.upload_timeout)
+                logger.info("Conversation log saved: %s", blob_name)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.warning("Failed to upload conversation log %s after %d attempts: %s", blob_name, attempt + 1, e)
+                    return False
+                # Exponential backoff with jitter, capped so a storage outage does not stall the queue for long
+                await asyncio.sleep(min(30.0, 0.5 * (2 ** attempt)) * random.uniform(0.5, 1.5))
+        return False
+
+    async def _replay_spool(self):
+        if self._client is None:
+            return
+        for path in await asyncio.to_thread(lambda: sorted(self.spool_dir.glob("*.json"))):
+            try:
+                envelope = json.loads(await asyncio.to_thread(path.read_text, encoding="utf-8"))
+            except OSError as e:
+                logger.warning("Skipping unreadable spooled log %s: %s", path, e)
+                continue
+            except ValueError as e:
+                await self._quarantine(path, f"not JSON: {e}")
+                continue
+            if not isinstance(envelope, dict) or not isinstance(envelope.get("blob_name"), str) or not isinstance(envelope.get("data"), str):
+                await self._quarantine(path, "missing blob_name or data")
+                continue
+            if not await self._upload(envelope["blob_name"], envelope["data"]):
+                # Storage is still unreachable, try again at the next interval
+                return
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+
+    async def _quarantine(self, path: Path, reason: str):
+        # Renamed out of the *.json pattern so it is not retried, but kept for inspection
+        bad_path = path.with_suffix(".bad")
+        try:
+            await asyncio.to_thread(os.replace, path, bad_path)
+        except OSError as e:
+            logger.error("Malformed spooled log %s (%s), could not set it aside: %s", path, reason, e)
+            return
+        logger.error("Malformed spooled log %s (%s), moved to %s", path, reason, bad_path)
+
+    def _spool_record(self, blob_name: str, record: Any):
+        self._spool(blob_name, self._serialize(record))
+        self._release(record)
+
+    @staticmethod
+    def _release(record: Any):
+        # The journal is no longer needed once its content is uploaded or spooled
+        if "journal" in record:
+            Path(record["journal"]).unlink(missing_ok=True)
+
+    def _spool(self, blob_name: str, data: str):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / (blob_name.replace("/", "__"))
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"blob_name": blob_name, "data": data}), encoding="utf-8")
+        os.replace(tmp_path, path)
+        logger.info("Conversation log spooled: %s", path)
+
+    @staticmethod
+    def _serialize(record: Any) -> str:
+        if "journal" in record:
+            record = {
+                "call_id": record["call_id"],
+                "timestamp": record["timestamp"],
+                "messages": read_journal(Path(record["journal"]))
+            }
         try:
-            print(json.dumps(messages[:2], indent=2, cls=SafeJSONEncoder))  # Mostra i primi 2 msg per debug
-        except Exception as inner:
-            print(f"⚠️ Fallita anche serializzazione parziale: {inner}")
\ No newline at end of file
+            return json.dumps(record, cls=SafeJSONEncoder)
+        except (TypeError, ValueError) as e:
+            # Keep whatever can be represented rather than losing the whole conversation
+            logger.warning("Conversation log for %s not fully serializable: %s", record.get("call_id"), e)
+            return json.dumps(record, default=str)
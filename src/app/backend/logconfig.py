@@ -0,0 +1,137 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Any
+from backend.metrics import Counter
+
+log_records_dropped = Counter(
+    "voicerag_log_records_dropped_total",
+    "Log records dropped because the log queue was full"
+)
+
+# Call the current task works for, set by the relay and copied into the tasks it starts
+call_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("call_id", default="-")
+
+# Fields that carry base64 audio in OpenAI and ACS messages
+_AUDIO_FIELDS = frozenset(("delta", "audio", "data"))
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "call_id"}
+
+def redact(value: Any, max_chars: int = 200) -> Any:
+    """
+    Copy of a relayed message fit for the logs: audio payloads are replaced by their size and other long
+    strings (prompts, tool results) are truncated.
+    """
+    if isinstance(value, dict):
+        return {
+            key: f"<{len(item)} chars of audio>" if key in _AUDIO_FIELDS and isinstance(item, str) else redact(item, max_chars)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item, max_chars) for item in value]
+    if isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}… <{len(value)} chars>"
+    return value
+
+class Redacted:
+    """
+    Log argument that redacts the message only for records that pass the level, when they are queued.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return str(redact(self.value))
+
+class LogSampler:
+    """
+    Lets through the first of every `every` occurrences of a frequent event, e.g. audio frames; 0 never does.
+    `count` is the number of occurrences so far.
+    """
+    __slots__ = ("every", "count")
+
+    def __init__(self, every: int):
+        self.every = every
+        self.count = 0
+
+    def __call__(self) -> bool:
+        self.count += 1
+        return self.every > 0 and (self.count - 1) % self.every == 0
+
+class CallContextFilter(logging.Filter):
+    """
+    Adds the `call_id` of the current task to the records that do not carry one in `extra`.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "call_id"):
+            record.call_id = call_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the fields passed through `extra` next to the standard ones.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "call_id": getattr(record, "call_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stdlib formats the record here, on the event loop, and drops its exc_info; the record is
+        # queued with its exc_info instead, so that the listener's handler formats it. Only the `Redacted`
+        # messages are copied now, the relay keeps changing them after logging them
+        if isinstance(record.args, tuple) and any(isinstance(arg, Redacted) for arg in record.args):
+            record.args = tuple(redact(arg.value) if isinstance(arg, Redacted) else arg for arg in record.args)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the event loop on a slow log sink
+            log_records_dropped.inc()
+
+def configure_logging(level: str = "INFO", json_format: bool = False, queue_size: int = 10_000) -> logging.handlers.QueueListener:
+    """
+    Routes all logging through a bounded queue to a stderr handler running on its own thread, so that the
+    event loop only pays for queuing the records that pass the level: formatting, redaction and tracebacks
+    happen on the listener thread. Returns the started listener, stop it at shutdown to flush what is still queued.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(call_id)s] %(message)s"))
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(CallContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+    # The Azure SDKs log every HTTP request at INFO
+    logging.getLogger("azure").setLevel(max(root.level, logging.WARNING))
+
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Optional, Sequence
+from backend.process import process_alive
+
+logger = logging.getLogger("voicerag.metrics")
+
+# Latency buckets in seconds, from a few milliseconds up to the point where the caller hangs up
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metric(ABC):
+    """
+    Base class of the in-process metrics. Metrics register themselves in a `MetricsRegistry` and keep one
+    child per combination of label values. Updates are plain attribute writes on the event loop thread,
+    so they cost little more than a dict lookup.
+    """
+    type_name: str = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (), registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """
+        Creates the child holding the value of one combination of label values.
+        """
+
+    def _default(self):
+        return self.labels()
+
+    def snapshot(self) -> list[list]:
+        """
+        JSON serializable copy of the children, as [label values, sample] pairs.
+        """
+        return [[list(values), self._sample(child)] for values, child in list(self._children.items())]
+
+    def render(self, peers: Sequence[list[list]] = ()) -> list[str]:
+        """
+        Lines of this metric in the Prometheus text exposition format, adding up the `snapshot` of other processes.
+        """
+        merged = {values: self._sample(child) for values, child in list(self._children.items())}
+        for peer in peers:
+            for values, sample in peer:
+                values = tuple(values)
+                merged[values] = self._merge(merged[values], sample) if values in merged else sample
+        lines = [f"# HELP {self.name} {_escape_help(self.description)}", f"# TYPE {self.name} {self.type_name}"]
+        for values, sample in merged.items():
+            lines.extend(self._render_sample(_format_labels(self.labelnames, values), sample))
+        return lines
+
+    def _sample(self, child) -> Any:
+        return child.value
+
+    def _merge(self, a: Any, b: Any) -> Any:
+        return a + b
+
+    def _render_sample(self, labels: str, sample: Any) -> list[str]:
+        return [f"{self.name}{labels} {_format_value(sample)}"]
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per upper bound plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, registry: Optional["MetricsRegistry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, description, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _sample(self, child: _HistogramChild) -> Any:
+        return [list(child.counts), child.sum, child.count]
+
+    def _merge(self, a: Any, b: Any) -> Any:
+        if len(a[0]) != len(b[0]):
+            # A process running with different buckets, e.g. during a rolling update
+            return a
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def _render_sample(self, labels: str, sample: Any) -> list[str]:
+        counts, total, count = sample
+        lines = []
+        cumulative = 0
+        label_prefix = labels[:-1] + "," if labels else "{"
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{label_prefix}le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+class MetricsRegistry:
+    """
+    Keeps track of the metrics of the process.
+    """
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def metrics(self) -> list[Metric]:
+        return list(self._metrics.values())
+
+    def snapshot(self) -> dict[str, list[list]]:
+        return {metric.name: metric.snapshot() for metric in self.metrics()}
+
+    def render(self, peers: Sequence[dict[str, list[list]]] = ()) -> str:
+        """
+        All the metrics in the Prometheus text exposition format, as served on `/metrics`,
+        added up with the snapshots of the other worker processes.
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render([peer.get(metric.name, []) for peer in peers]))
+        return "\n".join(lines) + "\n"
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _escape_label_value(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(str(value))}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+REGISTRY = MetricsRegistry()
+
+class WorkerMetricsExchange:
+    """
+    Lets `/metrics` answer for all the workers of the container, whichever worker takes the scrape: every
+    `interval` seconds each worker writes the snapshot of its registry to `{pid}.json` in `directory`, and
+    `render` adds up the live registry with the snapshots of the other workers still running.
+    Peer values are at most `interval` seconds old.
+    """
+    def __init__(self, directory: str, interval: float = 5.0, registry: Optional[MetricsRegistry] = None):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.registry = registry or REGISTRY
+        self._path = self.directory / f"{os.getpid()}.json"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # The last snapshot stays until the next scrape finds this process gone and folds it away
+        await self._write()
+
+    async def render(self) -> str:
+        peers = await asyncio.to_thread(self._read_peers)
+        return self.registry.render(peers)
+
+    async def _run(self):
+        while True:
+            await self._write()
+            await asyncio.sleep(self.interval)
+
+    async def _write(self):
+        data = json.dumps(self.registry.snapshot())
+        try:
+            await asyncio.to_thread(_write_atomic, self._path, data)
+        except OSError as e:
+            logger.error("Could not write the metrics snapshot: %s", e)
+
+    def _read_peers(self) -> list[dict[str, list[list]]]:
+        peers = []
+        for path in self.directory.glob("*.json"):
+            if path == self._path or not path.stem.isdigit():
+                continue
+            if not process_alive(int(path.stem)):
+                # Counters of workers that are gone no longer count, like a restarted exporter
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                peers.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return peers
+
+def _write_atomic(path: Path, data: str):
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(data, encoding="utf-8")
+    os.replace(temporary, path)
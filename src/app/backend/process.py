@@ -0,0 +1,13 @@
+import os
+
+def process_alive(pid: int) -> bool:
+    """
+    Tells whether a process with this pid exists, e.g. a worker that left files behind in a shared directory.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import random
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Optional
+from backend.metrics import Counter
+
+if TYPE_CHECKING:
+    from azure.storage.blob.aio import BlobClient
+
+logger = logging.getLogger("voicerag.prompt")
+
+prompt_refreshes = Counter(
+    "voicerag_prompt_refreshes_total",
+    "Checks of the system prompt in Azure Storage, by result (updated, not_modified, error)",
+    ["result"]
+)
+
+class PromptProvider:
+    """
+    Keeps the system prompt stored in Azure Storage up to date without restarts. The prompt is checked
+    every `refresh_interval` seconds with a conditional GET on its ETag, so an unchanged prompt costs a
+    304 and no download; a new one is handed to `on_update`, which only new calls pick up, calls in
+    progress keep the prompt they started with. Until the first successful fetch, and when Azure Storage
+    is not configured, the prompt is the local `fallback_path`.
+    """
+    container_name: str
+    blob_name: str
+    refresh_interval: float
+    prompt: Optional[str]
+    etag: Optional[str]
+
+    def __init__(self,
+                 connection_string: Optional[str],
+                 container_name: str,
+                 blob_name: str,
+                 fallback_path: Path,
+                 on_update: Callable[[str], None],
+                 refresh_interval: float = 30.0,
+                 account_url: Optional[str] = None,
+                 credential: Optional[Any] = None):
+        self.connection_string = connection_string
+        # Without a connection string, the account URL and an Entra ID credential such as `AsyncTokenCache`
+        self.account_url = account_url
+        self.credential = credential
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.fallback_path = fallback_path
+        self.refresh_interval = refresh_interval
+        self.prompt = None
+        self.etag = None
+        self._on_update = on_update
+        self._client: Optional["BlobClient"] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def remote_enabled(self) -> bool:
+        return bool(self.connection_string or (self.account_url and self.credential))
+
+    async def load_fallback(self) -> str:
+        prompt = await asyncio.to_thread(self.fallback_path.read_text, encoding="utf-8")
+        self._set(prompt, None)
+        return prompt
+
+    async def refresh(self) -> bool:
+        """
+        Fetches the prompt from Azure Storage if it changed since the last fetch. Returns True if it did.
+        """
+        if not self.remote_enabled:
+            raise ValueError("Missing 'AZURE_STORAGE_CONNECTION_STRING' or 'AZURE_STORAGE_ACCOUNT_URL' environment variable.")
+        from azure.core import MatchConditions
+        from azure.core.exceptions import HttpResponseError
+
+        try:
+            if self.etag is None:
+                downloader = await self._get_client().download_blob(encoding="utf-8")
+            else:
+                downloader = await self._get_client().download_blob(encoding="utf-8", etag=self.etag, match_condition=MatchConditions.IfModified)
+            prompt = await downloader.readall()
+        except Exception as e:
+            # The storage SDK reports the 304 as an error, with a type that depends on the service version
+            if isinstance(e, HttpResponseError) and e.status_code == 304:
+                prompt_refreshes.labels("not_modified").inc()
+                return False
+            prompt_refreshes.labels("error").inc()
+            raise
+        prompt_refreshes.labels("updated").inc()
+        self._set(prompt, downloader.properties.etag)
+        logger.info("System prompt %s/%s loaded (ETag %s)", self.container_name, self.blob_name, self.etag)
+        return True
+
+    def start(self):
+        if self._task is None and self.remote_enabled and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def _get_client(self) -> "BlobClient":
+        if self._client is None:
+            # Imported on first use, the storage SDK is slow to import and not needed without Azure Storage
+            from azure.storage.blob.aio import BlobClient
+            if self.connection_string:
+                self._client = BlobClient.from_connection_string(self.connection_string, self.container_name, self.blob_name)
+            else:
+                self._client = BlobClient(self.account_url, self.container_name, self.blob_name, credential=self.credential)
+        return self._client
+
+    def _set(self, prompt: str, etag: Optional[str]):
+        changed = prompt != self.prompt
+        self.prompt, self.etag = prompt, etag
+        if changed:
+            self._on_update(prompt)
+
+    async def _run(self):
+        while True:
+            # Jittered, so the workers of all the replicas do not poll in lockstep
+            await asyncio.sleep(self.refresh_interval * random.uniform(0.8, 1.2))
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("Could not refresh the system prompt from Azure Storage, keeping the current one: %s", e)
@@ -0,0 +1,98 @@
+import asyncio
+import base64
+import binascii
+import gzip
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+import numpy as np
+from backend import codec
+
+logger = logging.getLogger("voicerag.recording")
+
+RECORDING_VERSION = 1
+
+def _anonymize_audio(audio: str) -> str:
+    """
+    Replaces base64 pcm16 speech with a tone of the same length and level, so that replays still exercise
+    the voice activity gate and the converters the same way without keeping what was said.
+    """
+    pcm = binascii.a2b_base64(audio)
+    samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2).astype(np.float32)
+    if len(samples) == 0:
+        return audio
+    rms = float(np.sqrt(np.dot(samples, samples) / len(samples)))
+    tone = rms * np.sqrt(2) * np.sin(2 * np.pi * 220 / 24000 * np.arange(len(samples)))
+    return base64.b64encode(np.clip(tone, -32768, 32767).astype("<i2").tobytes() + pcm[len(samples) * 2:]).decode("ascii")
+
+def _find_audio(raw: str) -> Optional[str]:
+    return codec.extract_acs_audio(raw) or codec.extract_openai_audio_delta(raw) or codec.extract_openai_audio_append(raw)
+
+class TrafficRecorder:
+    """
+    Records the raw messages of one call in both directions to a gzipped JSON lines file, for
+    `benchmarks/replay.py`. The first line describes the call, each following line is
+    `[milliseconds since the start, "client" or "server", message]`.
+    Messages are buffered and written every `flush_every` messages on a worker thread; with
+    `anonymize_audio` the audio payloads are replaced by a tone of the same length and level.
+    """
+    def __init__(self, path: Path, is_acs_audio_stream: bool, sample_rate: int, anonymize_audio: bool = True, flush_every: int = 500):
+        self.path = path
+        self.anonymize_audio = anonymize_audio
+        self.flush_every = flush_every
+        self._start = time.monotonic()
+        self._lines = [json.dumps({"version": RECORDING_VERSION, "acs": is_acs_audio_stream, "sample_rate": sample_rate, "anonymized": anonymize_audio})]
+        self._last_write: Optional[asyncio.Future] = None
+
+    def record(self, direction: str, raw: str):
+        if self.anonymize_audio:
+            audio = _find_audio(raw)
+            if audio is not None:
+                raw = raw.replace(audio, _anonymize_audio(audio), 1)
+        self._lines.append(json.dumps([round(1000 * (time.monotonic() - self._start), 1), direction, raw]))
+        if len(self._lines) >= self.flush_every:
+            self._write(self._take_lines())
+
+    async def close(self):
+        self._write(self._take_lines())
+        if self._last_write is not None:
+            await self._last_write
+
+    def _take_lines(self) -> str:
+        lines, self._lines = self._lines, []
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def _write(self, data: str):
+        if data:
+            self._last_write = asyncio.ensure_future(self._append_after(self._last_write, data))
+
+    async def _append_after(self, previous: Optional[asyncio.Future], data: str):
+        # Writes go one after the other so the messages stay in order
+        if previous is not None:
+            await previous
+        await asyncio.to_thread(self._append, data)
+
+    def _append(self, data: str):
+        try:
+            # Each flush is a gzip member of its own, gzip readers see them as a single stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(data)
+        except OSError as e:
+            logger.error("Could not write the recording %s: %s", self.path, e)
+
+def read_recording(path: Path) -> tuple[dict, Iterator[tuple[float, str, str]]]:
+    """
+    Returns the description of a recorded call and an iterator over its (milliseconds, direction, message).
+    """
+    f = gzip.open(path, "rt", encoding="utf-8")
+    header = json.loads(f.readline())
+
+    def messages() -> Iterator[tuple[float, str, str]]:
+        with f:
+            for line in f:
+                at, direction, raw = json.loads(line)
+                yield at, direction, raw
+
+    return header, messages()
@@ -1,199 +1,673 @@
 import aiohttp
 import asyncio
 import json
-from typing import Any, Optional
-from aiohttp import ClientWebSocketResponse, web
-from azure.identity import DefaultAzureCredential, AzureDeveloperCliCredential, get_bearer_token_provider
+import logging
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+from aiohttp import web
 from azure.core.credentials import AzureKeyCredential
+from backend.credentials import COGNITIVE_SERVICES_SCOPE, AsyncTokenCache
 from backend.tools.tools import RTToolCall, Tool, ToolResultDirection
-from backend.helpers import transform_acs_to_openai_format, transform_openai_to_acs_format
+from backend.tools.executor import ToolExecutor
+from backend.helpers import OPENAI_SAMPLE_RATE, SUPPORTED_SAMPLE_RATES, AudioConverter, transform_acs_to_openai_format, transform_openai_to_acs_format
+from backend import codec
+from backend.upstream import RealtimeConnectionPool, first_audio_latency
+from backend.metrics import Counter, Gauge, Histogram
+from backend.vad import VoiceActivityGate
+from backend.framing import AudioCoalescer, PacedAudioSender
+from backend.channel import OutboundChannel
+from backend.journal import CallJournal, TranscriptJournal
+from backend.logconfig import LogSampler, Redacted, call_id_var
+from backend.recording import TrafficRecorder
 import time
-from datetime import datetime, timezone
+
+if TYPE_CHECKING:
+    from azure.identity import AzureDeveloperCliCredential, DefaultAzureCredential
+
+logger = logging.getLogger("voicerag.rtmt")
+
+# pcm16 at 24 kHz
+OPENAI_BYTES_PER_MS = OPENAI_SAMPLE_RATE * 2 / 1000
+
+response_latency = Histogram(
+    "voicerag_response_latency_seconds",
+    "Time from the end of the caller's speech (speech_stopped) to the first audio of the answer"
+)
+active_sessions = Gauge(
+    "voicerag_active_sessions",
+    "Calls being relayed by this process",
+    ["client"]
+)
+interruption_latency = Histogram(
+    "voicerag_interruption_seconds",
+    "Time from the caller talking over the assistant (speech_started) until the client is told to stop playing"
+)
+interrupted_audio_discarded = Counter(
+    "voicerag_interrupted_audio_deltas_discarded_total",
+    "Audio deltas of cancelled responses that arrived after a barge-in and were not relayed"
+)
+
+class RTSession:
+    """
+    State of a single relayed call, created by `RTMiddleTier.forward_messages` for each connection.
+    Only what changes during a call lives here; tools, prompt and model parameters stay on the
+    `RTMiddleTier` and are shared read-only, the prompt and voice are copied at connect time so later
+    changes only apply to new calls; `RTMiddleTier.update_voice` changes the voice of one live call.
+    With __slots__ a new session takes roughly 340 bytes (checked by `benchmarks/session_memory.py`);
+    the transcript is appended to `journal` on disk and only its last entries stay in memory.
+    """
+    __slots__ = (
+        "call_id",
+        "is_acs_audio_stream",
+        "voice",
+        "system_message",
+        "tools_pending",
+        "tool_executor",
+        "tool_followup",
+        "journal",
+        "start_time",
+        "start_monotonic",
+        "first_audio_sent",
+        "upstream_audio",
+        "downstream_audio",
+        "input_gate",
+        "input_coalescer",
+        "playback",
+        "active_response_id",
+        "cancelled_response_id",
+        "audio_item_id",
+        "audio_item_start_ms",
+        "audio_forwarded_ms",
+        "speech_stopped_at",
+        "to_server",
+        "greeting_requested",
+    )
+
+    def __init__(self, call_id: str, is_acs_audio_stream: bool, voice: str, system_message: Optional[str], tool_executor: ToolExecutor, journal: CallJournal):
+        self.call_id = call_id
+        self.is_acs_audio_stream = is_acs_audio_stream
+        self.voice = voice
+        self.system_message = system_message
+        self.tools_pending: dict[str, RTToolCall] = {}
+        self.tool_executor = tool_executor
+        self.tool_followup: Optional[asyncio.Task] = None
+        self.journal = journal
+        self.start_time = time.time()
+        self.start_monotonic = time.monotonic()
+        self.first_audio_sent = False
+        # Audio converters between the client and the OpenAI Realtime API format, None when no conversion is needed
+        self.upstream_audio: Optional[AudioConverter] = None
+        self.downstream_audio: Optional[AudioConverter] = None
+        # Drops the caller's silences before they are sent upstream, None when the gate is disabled
+        self.input_gate: Optional[VoiceActivityGate] = None
+        # Batches the caller frames into larger appends, None when coalescing is disabled
+        self.input_coalescer: Optional[AudioCoalescer] = None
+        # Paces the assistant audio to the phone at real-time rate, None for browser clients or when disabled
+        self.playback: Optional[PacedAudioSender] = None
+        # Barge-in bookkeeping: the response being generated, the last one cancelled (its late deltas are dropped),
+        # and the assistant audio item being played with its start in the stream of audio forwarded to the client
+        self.active_response_id: Optional[str] = None
+        self.cancelled_response_id: Optional[str] = None
+        self.audio_item_id: Optional[str] = None
+        self.audio_item_start_ms = 0.0
+        self.audio_forwarded_ms = 0.0
+        # When the caller stopped speaking, until the first audio of the answer is relayed
+        self.speech_stopped_at: Optional[float] = None
+        # Upstream channel of the call, None until the Realtime API connection is up
+        self.to_server: Optional[OutboundChannel] = None
+        # The first session.updated starts the greeting, the later ones (voice changes) must not start a response
+        self.greeting_requested = False
 
 class RTMiddleTier:
     endpoint: str
     deployment: str
     key: Optional[str] = None
+    # Voice used by calls that start from now on, see `RTSession.voice` for the voice of a live call
     selected_voice: str = "alloy"
-    tools: dict[str, Tool] = {}
+    tools: dict[str, Tool]
     model: Optional[str] = None
     system_message: Optional[str] = None
     temperature: Optional[float] = None
     max_tokens: Optional[int] = None
     disable_audio: Optional[bool] = None
+    sessions: dict[str, RTSession]
 
-    _tools_pending: dict[str, RTToolCall] = {}
-    _token_provider = None
+    _token_cache: Optional[AsyncTokenCache] = None
 
-    def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | AzureDeveloperCliCredential | DefaultAzureCredential):
+    def __init__(self,
+                 endpoint: str,
+                 deployment: str,
+                 credentials: "AzureKeyCredential | AsyncTokenCache | AzureDeveloperCliCredential | DefaultAzureCredential",
+                 codec_name: Optional[str] = None,
+                 pool_size: int = 0,
+                 pool_idle_ttl: float = 300.0,
+                 tool_timeout: float = 10.0,
+                 acs_sample_rate: int = OPENAI_SAMPLE_RATE,
+                 normalize_input_gain: bool = False,
+                 vad_gate: bool = False,
+                 vad_threshold_dbfs: float = -45.0,
+                 vad_pre_roll_ms: int = 400,
+                 vad_hangover_ms: int = 800,
+                 upstream_coalesce_ms: int = 60,
+                 upstream_coalesce_bytes: Optional[int] = None,
+                 playback_frame_ms: int = 40,
+                 playback_lead_ms: int = 200,
+                 relay_queue_max_audio_bytes: int = 192_000,
+                 journal: Optional[TranscriptJournal] = None,
+                 log_sample_every: int = 50,
+                 record_dir: Optional[str] = None,
+                 record_anonymize_audio: bool = True):
         self.endpoint = endpoint
         self.deployment = deployment
+        self.tools = {}
+        self.sessions = {}
+        self.tool_timeout = tool_timeout
+        self.acs_sample_rate = acs_sample_rate
+        self.normalize_input_gain = normalize_input_gain
+        self.vad_gate = vad_gate
+        self.vad_threshold_dbfs = vad_threshold_dbfs
+        self.vad_pre_roll_ms = vad_pre_roll_ms
+        self.vad_hangover_ms = vad_hangover_ms
+        self.upstream_coalesce_ms = upstream_coalesce_ms
+        self.upstream_coalesce_bytes = upstream_coalesce_bytes
+        self.playback_frame_ms = playback_frame_ms
+        self.playback_lead_ms = playback_lead_ms
+        self.relay_queue_max_audio_bytes = relay_queue_max_audio_bytes
+        self.journal = journal or TranscriptJournal()
+        # Audio frames are only logged one in `log_sample_every`, and only at DEBUG level
+        self._caller_audio_log = LogSampler(log_sample_every)
+        self._assistant_audio_log = LogSampler(log_sample_every)
+        # Raw traffic of every call is recorded here for `benchmarks/replay.py`, None disables recording
+        self.record_dir = Path(record_dir) if record_dir else None
+        self.record_anonymize_audio = record_anonymize_audio
+        self.codec = codec.get_codec(codec_name)
         if isinstance(credentials, AzureKeyCredential):
             self.key = credentials.key
         else:
-            self._token_provider = get_bearer_token_provider(credentials, "https://cognitiveservices.azure.com/.default")
-            self._token_provider()
+            # Pass the process-wide AsyncTokenCache to share the tokens with the other clients
+            self._token_cache = credentials if isinstance(credentials, AsyncTokenCache) else AsyncTokenCache(credentials, [COGNITIVE_SERVICES_SCOPE])
+        self.upstream = RealtimeConnectionPool(endpoint, deployment, self._auth_headers, size=pool_size, idle_ttl=pool_idle_ttl)
+
+    async def start(self):
+        self.journal.start()
+        if self.record_dir is not None:
+            self.record_dir.mkdir(parents=True, exist_ok=True)
+        await self.upstream.start()
+
+    async def wait_warm(self):
+        """
+        Returns once the pool holds a warm upstream connection, right away if it keeps none.
+        """
+        await self.upstream.wait_warm()
+
+    async def close(self):
+        await self.upstream.close()
+        await self.journal.close()
+
+    def create_session(self, call_id: str, is_acs_audio_stream: bool) -> RTSession:
+        executor = ToolExecutor(self.tools, self.tool_timeout)
+        session = RTSession(call_id, is_acs_audio_stream, self.selected_voice, self.system_message, executor, self.journal.open(call_id))
+        if is_acs_audio_stream:
+            self._configure_audio(session, self.acs_sample_rate)
+        self.sessions[call_id] = session
+        active_sessions.labels("acs" if is_acs_audio_stream else "web").inc()
+        return session
+
+    def _configure_audio(self, session: RTSession, sample_rate: int):
+        upstream = AudioConverter(sample_rate, OPENAI_SAMPLE_RATE, normalize_gain=self.normalize_input_gain)
+        downstream = AudioConverter(OPENAI_SAMPLE_RATE, sample_rate)
+        session.upstream_audio = None if upstream.passthrough else upstream
+        session.downstream_audio = None if downstream.passthrough else downstream
+        if self.vad_gate:
+            session.input_gate = VoiceActivityGate(sample_rate, self.vad_threshold_dbfs, pre_roll_ms=self.vad_pre_roll_ms, hangover_ms=self.vad_hangover_ms)
+        if self.upstream_coalesce_ms > 0:
+            # Frames are coalesced after conversion, in the OpenAI format
+            session.input_coalescer = AudioCoalescer(OPENAI_SAMPLE_RATE, self.upstream_coalesce_ms, self.upstream_coalesce_bytes)
+        if session.playback is not None:
+            session.playback.set_sample_rate(sample_rate)
+
+    async def update_voice(self, voice: str, call_id: Optional[str] = None) -> bool:
+        """
+        Changes the voice of the live call `call_id` with a session.update, or the default voice of new calls
+        when no call is given. Returns False if the call is not known. The Realtime API keeps the voice of a
+        conversation once the assistant has spoken in it, so a call that already heard the assistant raises
+        ValueError instead.
+        """
+        if call_id is None:
+            self.selected_voice = voice
+            return True
+        session = self.sessions.get(call_id)
+        if session is None:
+            return False
+        if session.audio_forwarded_ms > 0:
+            raise ValueError("The voice of a call cannot change once the assistant has spoken")
+        session.voice = voice
+        # Before the upstream connection is up the voice goes out with the first session.update of the call
+        if session.to_server is not None:
+            await session.to_server.send_json({ "type": "session.update", "session": { "voice": voice } })
+        return True
 
-    async def _process_message_to_client(self, message: Any, client_ws: web.WebSocketResponse, server_ws: ClientWebSocketResponse, is_acs_audio_stream: bool):
+    async def _auth_headers(self) -> dict[str, str]:
+        if self.key is not None:
+            return { "api-key": self.key }
+        elif self._token_cache is not None:
+            # Served from the cache, which refreshes the token in the background before it expires
+            return { "Authorization": f"Bearer {await self._token_cache.bearer_token(COGNITIVE_SERVICES_SCOPE)}" }
+        else:
+            raise ValueError("No token provider available")
+
+    async def _process_message_to_client(self, session: RTSession, message: Any, client_ws: OutboundChannel, server_ws: OutboundChannel):
+        is_acs_audio_stream = session.is_acs_audio_stream
+        on_sent = None
         if message is not None:
             match message["type"]:
                 case "session.updated":
-                    print("Sessione aggiornata → forzo risposta dell'AI")
-                    await server_ws.send_json({ "type": "response.create" })
+                    if not session.greeting_requested:
+                        session.greeting_requested = True
+                        logger.debug("Sessione aggiornata → forzo risposta dell'AI")
+                        await server_ws.send_json({ "type": "response.create" })
+
+                case "response.created":
+                    session.active_response_id = message.get("response", {}).get("id")
 
                 case "response.audio.delta":
-                    print("Ricevuto audio delta da OpenAI")
+                    if message.get("response_id") is not None and message.get("response_id") == session.cancelled_response_id:
+                        interrupted_audio_discarded.inc()
+                    else:
+                        self._send_assistant_audio(session, message["delta"], client_ws, message)
+                    message = None
+
+                case "response.audio.done":
+                    if session.playback is not None:
+                        session.playback.end_of_audio()
 
                 case "response.output_item.added":
                     if "item" in message and message["item"]["type"] == "function_call":
                         message = None
+                    elif "item" in message and message["item"]["type"] == "message":
+                        session.audio_item_id = message["item"].get("id")
+                        session.audio_item_start_ms = session.audio_forwarded_ms
 
                 case "conversation.item.created":
-                    if "item" in message and message["item"]["type"] in ["function_call", "function_call_output"]:
+                    if "item" in message and message["item"]["type"] == "function_call":
+                        item = message["item"]
+                        session.tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message.get("previous_item_id"))
                         message = None
+                    elif "item" in message and message["item"]["type"] == "function_call_output":
+                        message = None
+
+                case "response.function_call_arguments.delta":
+                    message = None
+
+                case "response.function_call_arguments.done":
+                    # Start the tool right away, the other calls of the same response run alongside it
+                    session.tool_executor.submit(message["call_id"], message["name"], message["arguments"])
+                    message = None
 
                 case "response.output_item.done":
-                    print("Fine della risposta")
-                    if len(self._tools_pending) > 0:
-                        self._tools_pending.clear()
-                        await server_ws.send_json({ "type": "response.create" })
+                    logger.debug("Fine della risposta")
+                    if "item" in message and message["item"]["type"] == "function_call":
+                        message = None
+
+                case "response.done":
+                    if session.active_response_id == message.get("response", {}).get("id"):
+                        session.active_response_id = None
+                    if session.tool_executor.pending:
+                        session.tool_followup = asyncio.create_task(self._send_tool_results(session, client_ws, server_ws))
+
+                case "input_audio_buffer.speech_stopped":
+                    session.speech_stopped_at = time.monotonic()
 
                 case "input_audio_buffer.speech_started":
-                    print("Utente ha iniziato a parlare (interruzione)")
+                    logger.info("Utente ha iniziato a parlare (interruzione)")
+                    await self._cancel_tool_calls(session, server_ws)
+                    if await self._interrupt(session, client_ws, server_ws):
+                        interrupted_at = time.monotonic()
+                        on_sent = lambda: interruption_latency.observe(time.monotonic() - interrupted_at)
 
         if is_acs_audio_stream and message is not None:
-            original_type = message.get("type")
-            message = transform_openai_to_acs_format(message)
-            if original_type == "response.audio.delta":
-                print("➡️ Audio trasformato per ACS e pronto all'invio")
+            message = transform_openai_to_acs_format(message, session.downstream_audio)
 
         if message is not None:
-            await client_ws.send_str(json.dumps(message))
+            await client_ws.send_str(self.codec.dumps(message), on_sent)
             if is_acs_audio_stream:
-                print(f"📤 Inviato a ACS → tipo: {message.get('type')}")
+                logger.debug("📤 Inviato a ACS → tipo: %s", message.get("type") or message.get("kind"))
 
-    async def _process_message_to_server(self, data: Any, ws: web.WebSocketResponse, server_ws: ClientWebSocketResponse, is_acs_audio_stream: bool):
-        if is_acs_audio_stream:
+    def _send_assistant_audio(self, session: RTSession, audio: str, client_ws: OutboundChannel, message: Optional[Any] = None, raw: Optional[str] = None):
+        """
+        Relays one assistant audio delta to the client and advances the position of the session's audio stream.
+        Browser clients get the OpenAI message itself, `raw` or `message` re-encoded.
+        """
+        session.audio_forwarded_ms += len(audio) * 3 / 4 / OPENAI_BYTES_PER_MS
+        if logger.isEnabledFor(logging.DEBUG) and self._assistant_audio_log():
+            logger.debug("Audio delta da OpenAI: %d caratteri (%d delta finora)", len(audio), self._assistant_audio_log.count)
+        if session.speech_stopped_at is not None:
+            response_latency.observe(time.monotonic() - session.speech_stopped_at)
+            session.speech_stopped_at = None
+        if not session.is_acs_audio_stream:
+            client_ws.send_audio(raw if raw is not None else self.codec.dumps(message))
+            return
+        if session.downstream_audio is not None:
+            audio = session.downstream_audio.convert(audio)
+        if session.playback is not None:
+            session.playback.feed(audio)
+        else:
+            client_ws.send_audio(codec.acs_audio_data(audio))
+
+    async def _interrupt(self, session: RTSession, client_ws: OutboundChannel, server_ws: OutboundChannel) -> bool:
+        """
+        Stops the assistant when the caller talks over it: cancels the response being generated, truncates the
+        assistant item to what the caller actually heard, so that the model does not assume the rest was said,
+        and drops the audio not played yet. Returns False if the assistant was not speaking.
+        """
+        unplayed_ms = session.playback.pending_ms if session.playback is not None else 0.0
+        interrupted = False
+        if session.active_response_id is not None:
+            await server_ws.send_json({ "type": "response.cancel" })
+            session.cancelled_response_id = session.active_response_id
+            session.active_response_id = None
+            interrupted = True
+        if session.audio_item_id is not None and (interrupted or unplayed_ms > 0):
+            played_ms = session.audio_forwarded_ms - unplayed_ms - session.audio_item_start_ms
+            await server_ws.send_json({
+                "type": "conversation.item.truncate",
+                "item_id": session.audio_item_id,
+                "content_index": 0,
+                "audio_end_ms": max(0, int(played_ms))
+            })
+            interrupted = True
+        session.audio_item_id = None
+        if session.playback is not None:
+            session.playback.clear()
+        client_ws.drop_audio()
+        return interrupted
+
+    async def _send_tool_results(self, session: RTSession, client_ws: OutboundChannel, server_ws: OutboundChannel):
+        """
+        Waits for the tool calls of the last response, sends all their outputs and asks for a single new response.
+        """
+        try:
+            outcomes = await session.tool_executor.collect()
+            for outcome in outcomes:
+                tool_call = session.tools_pending.pop(outcome.call_id, None)
+                to_client = outcome.result is not None and outcome.result.destination == ToolResultDirection.TO_CLIENT
+                await server_ws.send_json({
+                    "type": "conversation.item.create",
+                    "item": {
+                        "type": "function_call_output",
+                        "call_id": outcome.call_id,
+                        "output": "" if to_client else outcome.output_text()
+                    }
+                })
+                # Only the browser client understands tool results, the phone leg has nothing to show them on
+                if to_client and not session.is_acs_audio_stream:
+                    await client_ws.send_json({
+                        "type": "extension.middle_tier_tool_response",
+                        "previous_item_id": tool_call.previous_id if tool_call is not None else None,
+                        "tool_name": outcome.name,
+                        "tool_result": outcome.result.to_text()
+                    })
+            await server_ws.send_json({ "type": "response.create" })
+        except ConnectionResetError:
+            logger.info("🔌 Connessione chiusa prima dell'invio dei risultati dei tool")
+        except Exception:
+            # Nobody awaits this task, so its errors are logged here
+            logger.exception("❌ Errore durante l'invio dei risultati dei tool")
+
+    async def _cancel_tool_calls(self, session: RTSession, server_ws: Optional[OutboundChannel] = None):
+        """
+        Abandons the tool calls in progress. With `server_ws`, the function calls left without an output get a
+        cancelled one, so that the conversation has no dangling function_call items.
+        """
+        cancelled = session.tool_executor.cancel()
+        if session.tool_followup is not None and not session.tool_followup.done():
+            session.tool_followup.cancel()
+            cancelled += 1
+        session.tool_followup = None
+        if server_ws is not None:
+            for call_id in session.tools_pending:
+                await server_ws.send_json({
+                    "type": "conversation.item.create",
+                    "item": {
+                        "type": "function_call_output",
+                        "call_id": call_id,
+                        "output": json.dumps({"error": "Cancelled, the caller interrupted"})
+                    }
+                })
+        session.tools_pending.clear()
+        if cancelled:
+            logger.info("🛑 Chiamate tool annullate per interruzione: %d", cancelled)
+
+    async def _send_caller_audio(self, session: RTSession, audio: str, server_ws: OutboundChannel):
+        """
+        Sends one ACS audio frame upstream, through the voice activity gate and the format converter when configured.
+        """
+        if logger.isEnabledFor(logging.DEBUG) and self._caller_audio_log():
+            logger.debug("Audio dal chiamante: %d caratteri (%d frame finora)", len(audio), self._caller_audio_log.count)
+        gate = session.input_gate
+        was_open = gate is None or gate.is_open
+        frames = gate.process(audio) if gate is not None else (audio,)
+        coalescer = session.input_coalescer
+        for frame in frames:
+            if session.upstream_audio is not None:
+                frame = session.upstream_audio.convert(frame)
+            if coalescer is not None:
+                frame = coalescer.add(frame)
+                if frame is None:
+                    continue
+            server_ws.send_audio(codec.openai_audio_append(frame))
+        # Do not hold back the start of speech, nor the tail of it once the gate closes
+        if coalescer is not None and coalescer.pending and (not frames or not was_open):
+            server_ws.send_audio(codec.openai_audio_append(coalescer.flush()))
+
+    async def _flush_caller_audio(self, session: RTSession, server_ws: OutboundChannel):
+        if session.input_coalescer is not None and session.input_coalescer.pending:
+            server_ws.send_audio(codec.openai_audio_append(session.input_coalescer.flush()))
+
+    async def _process_message_to_server(self, session: RTSession, data: Any, server_ws: OutboundChannel):
+        if session.is_acs_audio_stream:
+            if data.get("kind") == "AudioMetadata":
+                # ACS announces the format of the media stream, follow it if it differs from the configured one
+                sample_rate = data.get("audioMetadata", {}).get("sampleRate")
+                if sample_rate is not None and sample_rate not in SUPPORTED_SAMPLE_RATES:
+                    # Not worth ending the call over, the configured rate is the likely one
+                    logger.warning("⚠️ Frequenza di campionamento ACS non supportata: %s Hz, resta %d Hz", sample_rate, self.acs_sample_rate)
+                elif sample_rate is not None and sample_rate != self.acs_sample_rate:
+                    logger.info("🎚️ Frequenza di campionamento ACS: %s Hz", sample_rate)
+                    self._configure_audio(session, sample_rate)
+            elif data.get("kind") == "AudioData":
+                await self._send_caller_audio(session, data["audioData"]["data"], server_ws)
+                return
+            await self._flush_caller_audio(session, server_ws)
             data = transform_acs_to_openai_format(
-                data, self.model, self.tools, self.system_message,
+                data, self.model, self.tools, session.system_message,
                 self.temperature, self.max_tokens, self.disable_audio,
-                self.selected_voice
+                session.voice, session.upstream_audio
             )
 
         if data is not None:
             match data["type"]:
                 case "session.update":
-                    session = data["session"]
-                    session["voice"] = self.selected_voice
-                    if self.system_message:
-                        session["instructions"] = self.system_message
+                    session_config = data["session"]
+                    session_config["voice"] = session.voice
+                    if session.system_message:
+                        session_config["instructions"] = session.system_message
                     if self.temperature is not None:
-                        session["temperature"] = self.temperature
+                        session_config["temperature"] = self.temperature
                     if self.max_tokens is not None:
-                        session["max_response_output_tokens"] = self.max_tokens
+                        session_config["max_response_output_tokens"] = self.max_tokens
                     if self.disable_audio is not None:
-                        session["disable_audio"] = self.disable_audio
-                    session["tool_choice"] = "auto" if len(self.tools) > 0 else "none"
-                    session["tools"] = [tool.schema for tool in self.tools.values()]
-                    data["session"] = session
+                        session_config["disable_audio"] = self.disable_audio
+                    session_config["tool_choice"] = "auto" if len(self.tools) > 0 else "none"
+                    session_config["tools"] = [tool.schema for tool in self.tools.values()]
+                    data["session"] = session_config
+
+            await server_ws.send_str(self.codec.dumps(data))
+
+    async def _relay_client_message(self, session: RTSession, raw: str, to_server: OutboundChannel):
+        """
+        Handles one text message read from the client socket.
+        """
+        # Fast path: audio frames are relayed without decoding the whole message
+        if session.is_acs_audio_stream:
+            audio = codec.extract_acs_audio(raw)
+            if audio is not None:
+                await self._send_caller_audio(session, audio, to_server)
+                return
+        elif codec.is_openai_audio_append(raw):
+            to_server.send_audio(raw)
+            return
+
+        data = self.codec.loads(raw)
+        logger.debug("⬅️ [CLIENT → SERVER] Ricevuto: %s", Redacted(data))
 
-            await server_ws.send_str(json.dumps(data))
+        if data.get("type") == "conversation.input":
+            text = data.get("input", {}).get("text")
+            if text:
+                session.journal.append({
+                    "call_id": session.call_id,
+                    "role": "user",
+                    "content": text
+                })
+                logger.debug("📝 [LOG] Utente (text): %s", text)
 
-    async def forward_messages(self, ws: web.WebSocketResponse, is_acs_audio_stream: bool, request: Optional[web.Request] = None) -> list[dict]:
-        messages: list[dict] = []
+        await self._process_message_to_server(session, data, to_server)
 
-        raw_call_id = request.query.get("callConnectionId", "unknown-call") if request else "unknown-call"
+    async def _relay_server_message(self, session: RTSession, raw: str, to_client: OutboundChannel, to_server: OutboundChannel, warm: bool = False):
+        """
+        Handles one text message read from the OpenAI Realtime API socket. `warm` tells whether the
+        upstream connection came from the pool, for the first audio latency.
+        """
+        # Fast path: audio deltas are relayed without decoding the whole message
+        audio = codec.extract_openai_audio_delta(raw)
+        if audio is not None and session.cancelled_response_id is not None:
+            response_id = codec.peek_openai_response_id(raw)
+            if response_id == session.cancelled_response_id:
+                interrupted_audio_discarded.inc()
+                return
+            if response_id is None:
+                # Let the generic path find out which response the delta belongs to
+                audio = None
+        if audio is not None:
+            self._send_assistant_audio(session, audio, to_client, raw=raw)
+            if not session.first_audio_sent:
+                session.first_audio_sent = True
+                first_audio_latency.labels("warm" if warm else "cold").observe(time.monotonic() - session.start_monotonic)
+            return
+
+        data = self.codec.loads(raw)
+        logger.debug("➡️ [SERVER → CLIENT] Ricevuto: %s", Redacted(data))
+
+        if data.get("type") == "conversation.output":
+            session.journal.append({
+                "call_id": session.call_id,
+                "role": "assistant",
+                "content": data.get("text", "[empty]")
+            })
+            logger.debug("📝 [LOG] Assistant (text): %s", data.get("text", "[empty]"))
+
+        elif data.get("type") == "response.done":
+            output = data.get("response", {}).get("output", [])
+            for item in output:
+                if item.get("type") == "message":
+                    role = item.get("role", "assistant")
+                    contents = item.get("content", [])
+                    for block in contents:
+                        if block.get("type") == "audio" and "transcript" in block:
+                            session.journal.append({
+                                "call_id": session.call_id,
+                                "role": role,
+                                "content": block["transcript"]
+                            })
+                            logger.debug("📝 [LOG] %s (transcript): %s", role.capitalize(), block["transcript"])
+
+        await self._process_message_to_client(session, data, to_client, to_server)
+
+    async def forward_messages(self, ws: web.WebSocketResponse, is_acs_audio_stream: bool, request: Optional[web.Request] = None) -> CallJournal:
+        raw_call_id = request.query.get("callConnectionId", "") if request else ""
         call_id = "".join(c for c in raw_call_id if c.isalnum() or c in ("-", "_"))
-        start_time = time.time()
-
-        print(f"🟢 forward_messages avviato – call_id: {call_id}, ACS: {is_acs_audio_stream}")
-
-        async with aiohttp.ClientSession(base_url=self.endpoint) as session:
-            params = {
-                "api-version": "2024-10-01-preview",
-                "deployment": self.deployment
-            }
-
-            headers = {}
-            if "x-ms-client-request-id" in ws.headers:
-                headers["x-ms-client-request-id"] = ws.headers["x-ms-client-request-id"]
-
-            if self.key is not None:
-                headers = { "api-key": self.key }
-            elif self._token_provider is not None:
-                headers = { "Authorization": f"Bearer {self._token_provider()}" }
-            else:
-                raise ValueError("No token provider available")
-
-            async with session.ws_connect("/openai/realtime", headers=headers, params=params) as target_ws:
-                print("🔗 Connessione a OpenAI Realtime stabilita")
-
-                async def from_client_to_server():
-                    async for msg in ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            data = json.loads(msg.data)
-                            print(f"⬅️ [CLIENT → SERVER] Ricevuto: {data}")
-
-                            if data.get("type") == "conversation.input":
-                                text = data.get("input", {}).get("text")
-                                if text:
-                                    messages.append({
-                                        "call_id": call_id,
-                                        "role": "user",
-                                        "content": text
-                                    })
-                                    print(f"📝 [LOG] Utente (text): {text}")
-
-                            await self._process_message_to_server(data, ws, target_ws, is_acs_audio_stream)
-                        else:
-                            print(f"⚠️ Messaggio client ignorato: {msg.type}")
-
-                async def from_server_to_client():
-                    async for msg in target_ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            data = json.loads(msg.data)
-                            print(f"➡️ [SERVER → CLIENT] Ricevuto: {data}")
-
-                            if data.get("type") == "conversation.output":
-                                messages.append({
-                                    "call_id": call_id,
-                                    "role": "assistant",
-                                    "content": data.get("text", "[empty]")
-                                })
-                                print(f"📝 [LOG] Assistant (text): {data.get('text', '[empty]')}")
-
-                            elif data.get("type") == "response.done":
-                                output = data.get("response", {}).get("output", [])
-                                for item in output:
-                                    if item.get("type") == "message":
-                                        role = item.get("role", "assistant")
-                                        contents = item.get("content", [])
-                                        for block in contents:
-                                            if block.get("type") == "audio" and "transcript" in block:
-                                                messages.append({
-                                                    "call_id": call_id,
-                                                    "role": role,
-                                                    "content": block["transcript"]
-                                                })
-                                                print(f"📝 [LOG] {role.capitalize()} (transcript): {block['transcript']}")
-
-                            await self._process_message_to_client(data, ws, target_ws, is_acs_audio_stream)
-                        else:
-                            print(f"⚠️ Messaggio server ignorato: {msg.type}")
-
-                try:
-                    await asyncio.gather(from_client_to_server(), from_server_to_client())
-                except ConnectionResetError:
-                    print("🔌 Connessione WebSocket terminata dal client")
-                except Exception as e:
-                    print(f"❌ Errore durante lo scambio WebSocket: {e}")
-
-        duration_sec = round(time.time() - start_time, 2)
-        messages.append({
-            "call_id": call_id,
-            "role": "system",
-            "content": f"Durata sessione: {duration_sec} secondi"
-        })
-
-        print(f"📦 Conversazione terminata. Messaggi totali: {len(messages)}")
-        return messages
+        if not call_id or call_id in self.sessions:
+            # Browser sessions have no call connection id, give each connection its own
+            call_id = f"{call_id or 'web'}-{uuid.uuid4().hex[:12]}"
+
+        # Every log record of this call, including those of the tasks started from here, carries its id
+        call_id_var.set(call_id)
+        session = self.create_session(call_id, is_acs_audio_stream)
+        journal = session.journal
+        recorder = None
+        if self.record_dir is not None:
+            recorder = TrafficRecorder(self.record_dir / f"{call_id}.{int(session.start_time)}.jsonl.gz", is_acs_audio_stream, self.acs_sample_rate, self.record_anonymize_audio)
+        # Each socket gets its own writer, so a slow peer never holds up reading from the other one
+        to_client = OutboundChannel("client", ws.send_str, self.relay_queue_max_audio_bytes)
+        to_client.start()
+        to_server: Optional[OutboundChannel] = None
+        if is_acs_audio_stream and self.playback_frame_ms > 0:
+            session.playback = PacedAudioSender(lambda audio: to_client.send_audio(codec.acs_audio_data(audio)), self.acs_sample_rate, self.playback_frame_ms, self.playback_lead_ms)
+            session.playback.start()
+
+        logger.info("🟢 forward_messages avviato – ACS: %s", is_acs_audio_stream)
+
+        conn = None
+        try:
+            conn = await self.upstream.acquire()
+            to_server = OutboundChannel("server", conn.ws.send_str, self.relay_queue_max_audio_bytes)
+            to_server.start()
+            session.to_server = to_server
+            logger.info("🔗 Connessione a OpenAI Realtime stabilita (%s)", "warm" if conn.warm else "cold")
+
+            async def from_client_to_server():
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        if recorder is not None:
+                            recorder.record("client", msg.data)
+                        await self._relay_client_message(session, msg.data, to_server)
+                    else:
+                        logger.warning("⚠️ Messaggio client ignorato: %s", msg.type)
+                # The client hung up, release the upstream socket so the other direction ends too
+                await conn.close()
+
+            async def from_server_to_client():
+                async for msg in conn.messages():
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        if recorder is not None:
+                            recorder.record("server", msg.data)
+                        await self._relay_server_message(session, msg.data, to_client, to_server, conn.warm)
+                    else:
+                        logger.warning("⚠️ Messaggio server ignorato: %s", msg.type)
+
+            try:
+                await asyncio.gather(from_client_to_server(), from_server_to_client())
+            except ConnectionResetError:
+                logger.info("🔌 Connessione WebSocket terminata dal client")
+            except Exception:
+                logger.exception("❌ Errore durante lo scambio WebSocket")
+        except Exception:
+            # The Realtime API could not be reached: the call ends here, but its journal is still finished and returned
+            logger.exception("❌ Connessione a OpenAI Realtime non riuscita")
+        finally:
+            await self._cancel_tool_calls(session)
+            if session.playback is not None:
+                await session.playback.close()
+            for channel in (to_client, to_server):
+                if channel is not None:
+                    await channel.close()
+                    if channel.dropped:
+                        logger.warning("⚠️ Coda verso %s: %d messaggi audio scartati, picco %d byte", channel.direction, channel.dropped, channel.high_water_bytes)
+            if conn is not None:
+                await conn.close()
+            if recorder is not None:
+                await recorder.close()
+            self.sessions.pop(call_id, None)
+            active_sessions.labels("acs" if is_acs_audio_stream else "web").dec()
+
+            # In the finally too, so that the journal is never left open (and flushed forever) by a call that failed
+            duration_sec = round(time.time() - session.start_time, 2)
+            journal.append({
+                "call_id": call_id,
+                "role": "system",
+                "content": f"Durata sessione: {duration_sec} secondi"
+            })
+            await self.journal.finish(journal)
+        logger.info("📦 Conversazione terminata. Messaggi totali: %d", journal.count)
+        return journal
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+from backend.metrics import Histogram
+
+logger = logging.getLogger("voicerag.startup")
+
+startup_step_latency = Histogram(
+    "voicerag_startup_step_seconds",
+    "Duration of the worker startup steps, by step and outcome (ok, timeout, error)",
+    ["step", "outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0)
+)
+cold_start = Histogram(
+    "voicerag_cold_start_seconds",
+    "Time from a worker process starting until it is ready to take calls",
+    buckets=(0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+)
+
+def process_started_at() -> float:
+    """
+    Wall clock time at which this process started, from /proc on Linux, or now elsewhere.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces, the fields after it do not
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+class Startup:
+    """
+    Runs the independent startup steps of a worker concurrently, each within `timeout` seconds, and tracks
+    when the worker is ready to take calls. A step that runs out of time is reported and goes on in the
+    background. The worker is ready once every step is over and every `required` step (the ones on the call
+    path) has succeeded: an optional step that fails or times out is only logged and measured, a required
+    one keeps the worker not ready until it succeeds, either finishing in the background after a timeout or
+    being retried after a failure, every `retry_interval` seconds doubling up to `max_retry_interval`.
+    """
+    timeout: float
+    ready: bool
+    # Outcome of each step: pending, ok, timeout or error
+    status: dict[str, str]
+
+    def __init__(self, timeout: float = 20.0, retry_interval: float = 2.0, max_retry_interval: float = 60.0):
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.ready = False
+        self.status = {}
+        self.started_at = process_started_at()
+        self._steps: dict[str, Callable[[], Awaitable[Any]]] = {}
+        self._required: set[str] = set()
+        self._finished = False
+        self._tasks: set[asyncio.Task] = set()
+        self._run_task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, step: Callable[[], Awaitable[Any]], required: bool = False):
+        self._steps[name] = step
+        self.status[name] = "pending"
+        if required:
+            self._required.add(name)
+
+    def start(self):
+        if self._run_task is None:
+            self._run_task = asyncio.create_task(self._run())
+
+    async def wait_ready(self):
+        if self._run_task is not None:
+            await asyncio.shield(self._run_task)
+
+    async def close(self):
+        tasks = [task for task in (self._run_task, *self._tasks) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self._steps.items()))
+        self._finished = True
+        if not self._update_ready():
+            logger.warning("Worker not ready, required startup steps did not succeed (%s)", self._describe())
+
+    def _update_ready(self) -> bool:
+        if not self.ready and self._finished and all(self.status[name] == "ok" for name in self._required):
+            self.ready = True
+            elapsed = time.time() - self.started_at
+            cold_start.observe(elapsed)
+            logger.info("Worker ready %.2f s after the process started (%s)", elapsed, self._describe())
+        return self.ready
+
+    def _describe(self) -> str:
+        return ", ".join(f"{name} {outcome}" for name, outcome in self.status.items())
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[Any]]):
+        start = time.perf_counter()
+        task = asyncio.create_task(self._call_step(name, step))
+        self._tasks.add(task)
+        task.add_done_callback(self._forget)
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.timeout)
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.warning("Startup step %s did not finish within %.0f s, it goes on in the background", name, self.timeout)
+        except Exception as e:
+            outcome = "error"
+            logger.warning("Startup step %s failed: %s", name, e)
+        self.status[name] = outcome
+        startup_step_latency.labels(name, outcome).observe(time.perf_counter() - start)
+        if outcome == "error":
+            self._retry_later(name, step)
+
+    async def _call_step(self, name: str, step: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await step()
+        except Exception as e:
+            # Nobody waits any more on a step past its deadline, so its outcome is recorded here
+            if self.status.get(name) == "timeout":
+                self.status[name] = "error"
+                logger.warning("Startup step %s failed in the background: %s", name, e)
+                self._retry_later(name, step)
+            raise
+        if self.status.get(name) == "timeout":
+            self.status[name] = "ok"
+            logger.info("Startup step %s finished in the background", name)
+            self._update_ready()
+        return result
+
+    def _retry_later(self, name: str, step: Callable[[], Awaitable[Any]]):
+        if name in self._required:
+            task = asyncio.create_task(self._retry(name, step))
+            self._tasks.add(task)
+            task.add_done_callback(self._forget)
+
+    async def _retry(self, name: str, step: Callable[[], Awaitable[Any]]):
+        delay = self.retry_interval
+        while True:
+            await asyncio.sleep(delay)
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(step(), self.timeout)
+            except Exception as e:
+                outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                startup_step_latency.labels(name, outcome).observe(time.perf_counter() - start)
+                delay = min(delay * 2, self.max_retry_interval)
+                logger.warning("Startup step %s failed again (%s), next attempt in %.0f s: %s", name, outcome, delay, e)
+                continue
+            startup_step_latency.labels(name, "ok").observe(time.perf_counter() - start)
+            self.status[name] = "ok"
+            logger.info("Startup step %s succeeded on retry", name)
+            self._update_ready()
+            return
+
+    def _forget(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Optional
+from backend.metrics import Histogram
+from backend.tools.tools import Tool, ToolResult
+
+logger = logging.getLogger("voicerag.tools")
+
+tool_latency = Histogram(
+    "voicerag_tool_seconds",
+    "Execution time of the tool calls, by tool and outcome (ok, error, timeout)",
+    ["tool", "outcome"]
+)
+
+class ToolCallOutcome:
+    """
+    Result of a finished tool call: either a `ToolResult` or the error that replaced it.
+    """
+    __slots__ = ("call_id", "name", "result", "error")
+
+    def __init__(self, call_id: str, name: str, result: Optional[ToolResult] = None, error: Optional[str] = None):
+        self.call_id = call_id
+        self.name = name
+        self.result = result
+        self.error = error
+
+    def output_text(self) -> str:
+        """
+        Text sent back to the model as `function_call_output`.
+        """
+        if self.error is not None:
+            return json.dumps({"error": self.error})
+        return self.result.to_text() if self.result is not None else ""
+
+class ToolExecutor:
+    """
+    Runs the tool calls of one session. Each call starts as soon as its arguments are complete, so the
+    calls of a response run concurrently, each bounded by its tool's timeout (or `default_timeout`).
+    `collect` waits for all of them; `cancel` abandons them when the caller interrupts.
+    Tools are called with their arguments and `session_state`, a dict where they can keep per-call data.
+    """
+    def __init__(self, tools: dict[str, Tool], default_timeout: float = 10.0):
+        self.tools = tools
+        self.default_timeout = default_timeout
+        self.session_state: dict[str, Any] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    @property
+    def pending(self) -> bool:
+        return len(self._tasks) > 0
+
+    def submit(self, call_id: str, name: str, arguments: str):
+        """
+        Starts the tool call `call_id` in the background.
+        """
+        self._tasks[call_id] = asyncio.create_task(self._run(call_id, name, arguments))
+
+    async def collect(self) -> list[ToolCallOutcome]:
+        """
+        Waits for all submitted calls and returns their outcomes in submission order.
+        """
+        tasks, self._tasks = self._tasks, {}
+        return list(await asyncio.gather(*tasks.values()))
+
+    def cancel(self) -> int:
+        """
+        Cancels the calls still running and forgets the submitted ones. Returns the number of cancelled calls.
+        """
+        tasks, self._tasks = self._tasks, {}
+        cancelled = 0
+        for task in tasks.values():
+            if task.cancel():
+                cancelled += 1
+        return cancelled
+
+    async def _run(self, call_id: str, name: str, arguments: str) -> ToolCallOutcome:
+        tool = self.tools.get(name)
+        if tool is None:
+            return ToolCallOutcome(call_id, name, error=f"Unknown tool '{name}'")
+
+        try:
+            args = json.loads(arguments) if arguments else {}
+        except ValueError as e:
+            return ToolCallOutcome(call_id, name, error=f"Invalid arguments: {e}")
+
+        timeout = tool.timeout if tool.timeout is not None else self.default_timeout
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(tool.target(args, self.session_state), timeout)
+            tool_latency.labels(name, "ok").observe(time.perf_counter() - start)
+            return ToolCallOutcome(call_id, name, result=result)
+        except asyncio.TimeoutError:
+            tool_latency.labels(name, "timeout").observe(time.perf_counter() - start)
+            logger.warning("Tool %s timed out after %.1fs", name, timeout)
+            return ToolCallOutcome(call_id, name, error=f"The tool did not answer within {timeout:g} seconds")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            tool_latency.labels(name, "error").observe(time.perf_counter() - start)
+            logger.exception("Tool %s failed", name)
+            return ToolCallOutcome(call_id, name, error=str(e))
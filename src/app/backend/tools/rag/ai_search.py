@@ -1,26 +1,45 @@
+import asyncio
+import logging
 import re
-from typing import Any
+from typing import Any, Optional
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import VectorizableTextQuery
 from backend.tools.tools import Tool, ToolResult, ToolResultDirection
+from backend.tools.rag.cache import SearchResultCache
+from backend.tools.rag.chunks import ChunkStore
+from backend.tools.rag.fusion import reciprocal_rank_fusion
+from backend.tools.rag.packing import pack_results
+
+logger = logging.getLogger("voicerag.search")
 
 KEY_PATTERN = re.compile(r'^[a-zA-Z0-9_=\-]+$')
 
+# Queries searched at once by one search call, the model is told so in the tool schema
+MAX_QUERIES = 3
+# Relevance the semantic ranker gives each result, kept with the cached results for the packer
+RERANKER_SCORE = "@search.reranker_score"
+
 _search_tool_schema = {
     "type": "function",
     "name": "search",
     "description": "Search the knowledge base. The knowledge base is in English, translate to and from English if " + \
-                   "needed. Results are formatted as a source name first in square brackets, followed by the text " + \
-                   "content, and a line with '-----' at the end of each result.",
+                   "needed. When the question needs several lookups, pass them all at once in `queries` instead of " + \
+                   "calling the tool several times. Results are formatted as a source name first in square brackets, " + \
+                   "followed by the text content, and a line with '-----' at the end of each result.",
     "parameters": {
         "type": "object",
         "properties": {
-            "query": {
-                "type": "string",
-                "description": "Search query"
+            "queries": {
+                "type": "array",
+                "items": {
+                    "type": "string"
+                },
+                "minItems": 1,
+                "maxItems": MAX_QUERIES,
+                "description": f"Search queries, one per distinct piece of information needed (at most {MAX_QUERIES})"
             }
         },
-        "required": ["query"],
+        "required": ["queries"],
         "additionalProperties": False
     }
 }
@@ -47,65 +66,120 @@ _grounding_tool_schema = {
     }
 }
 
+def _chunk_store(session_state: dict[str, Any]) -> ChunkStore:
+    store = session_state.get("chunks")
+    if store is None:
+        store = session_state["chunks"] = ChunkStore()
+    return store
+
 async def _search_tool(
     search_client: SearchClient, 
     semantic_configuration: str,
     identifier_field: str,
+    title_field: str,
     content_field: str,
     embedding_field: str,
     use_vector_query: bool,
-    args: Any) -> ToolResult:
-
-    print(f"Searching for '{args['query']}' in the knowledge base.")
-    
-    # Hybrid + Reranking query using Azure AI Search
-    vector_queries = []
-    if use_vector_query:
-        vector_queries.append(VectorizableTextQuery(text=args['query'], k_nearest_neighbors=50, fields=embedding_field))
-    
-    search_results = await search_client.search(
-        search_text=args['query'], 
-        query_type="semantic",
-        semantic_configuration_name=semantic_configuration,
-        top=5,
-        vector_queries=vector_queries,
-        select=", ".join([identifier_field, content_field])
-
-    )
-    result = ""
-    async for r in search_results:
-        result += f"[{r[identifier_field]}]: {r[content_field]}\n-----\n"
-    
+    cache: Optional[SearchResultCache],
+    query_slots: asyncio.Semaphore,
+    token_budget: int,
+    args: Any,
+    session_state: dict[str, Any]) -> ToolResult:
+
+    # "query" is what the schema used to take, older prompts and sessions may still send it
+    queries = list(dict.fromkeys(q for q in args.get("queries") or [args.get("query")] if q))
+    if not queries:
+        raise ValueError("No search query given")
+    if len(queries) > MAX_QUERIES:
+        logger.warning("Search with %d queries, only the first %d are used", len(queries), MAX_QUERIES)
+        queries = queries[:MAX_QUERIES]
+    logger.info("Searching for %s in the knowledge base.", " | ".join(f"'{q}'" for q in queries))
+
+    async def fetch(query: str) -> list[dict[str, Any]]:
+        # Hybrid + Reranking query using Azure AI Search
+        vector_queries = []
+        if use_vector_query:
+            vector_queries.append(VectorizableTextQuery(text=query, k_nearest_neighbors=50, fields=embedding_field))
+
+        async with query_slots:
+            search_results = await search_client.search(
+                search_text=query,
+                query_type="semantic",
+                semantic_configuration_name=semantic_configuration,
+                top=5,
+                vector_queries=vector_queries,
+                select=", ".join([identifier_field, title_field, content_field])
+            )
+            return [{identifier_field: r[identifier_field], title_field: r[title_field], content_field: r[content_field], RERANKER_SCORE: r.get(RERANKER_SCORE)}
+                    async for r in search_results]
+
+    async def lookup(query: str) -> list[dict[str, Any]]:
+        if cache is None:
+            return await fetch(query)
+        key = SearchResultCache.make_key(query, semantic_configuration, (identifier_field, title_field, content_field))
+        return await cache.get_or_fetch(key, lambda: fetch(query))
+
+    # The queries run concurrently, so several lookups cost about as much as the slowest one
+    rankings = await asyncio.gather(*(lookup(q) for q in queries), return_exceptions=True)
+    failed = [r for r in rankings if isinstance(r, BaseException)]
+    if len(failed) == len(rankings):
+        raise failed[0]
+    for query, ranking in zip(queries, rankings):
+        if isinstance(ranking, BaseException):
+            logger.warning("Search for '%s' failed, answering with the other queries: %s", query, ranking)
+    docs = reciprocal_rank_fusion((r for r in rankings if not isinstance(r, BaseException)), key=lambda doc: doc[identifier_field])[:5]
+
+    # Keep the chunks around so that report_grounding can cite them without another round trip
+    chunks = _chunk_store(session_state)
+    for doc in docs:
+        chunks.put(doc[identifier_field], doc[title_field], doc[content_field])
+
+    # The whole chunks are cited, but the model only gets what fits in the budget: a long tool output delays its answer
+    result = pack_results(docs, identifier_field, content_field, queries, token_budget, score_field=RERANKER_SCORE)
     return ToolResult(result, ToolResultDirection.TO_SERVER)
 
 
 # TODO: move from sending all chunks used for grounding eagerly to only sending links to 
 # the original content in storage, it'll be more efficient overall
-async def _report_grounding_tool(search_client: SearchClient, identifier_field: str, title_field: str, content_field: str, args: Any) -> None:
+async def _report_grounding_tool(search_client: SearchClient, identifier_field: str, title_field: str, content_field: str, args: Any, session_state: dict[str, Any]) -> None:
     sources = [s for s in args["sources"] if KEY_PATTERN.match(s)]
-    list = " OR ".join(sources)
-    print(f"Grounding source: {list}")
-    # Use search instead of filter to align with how detailt integrated vectorization indexes
-    # are generated, where chunk_id is searchable with a keyword tokenizer, not filterable 
-    search_results = await search_client.search(search_text=list, 
-                                                search_fields=[identifier_field], 
-                                                select=[identifier_field, title_field, content_field], 
-                                                top=len(sources), 
-                                                query_type="full")
-    
-    # If your index has a key field that's filterable but not searchable and with the keyword analyzer, you can 
-    # use a filter instead (and you can remove the regex check above, just ensure you escape single quotes)
-    # search_results = await search_client.search(filter=f"search.in(chunk_id, '{list}')", select=["chunk_id", "title", "chunk"])
-
-    docs = []
-    async for r in search_results:
-        docs.append({"chunk_id": r[identifier_field], "title": r[title_field], "chunk": r[content_field]})
+    logger.info("Grounding source: %s", " OR ".join(sources))
+
+    # Chunks returned by the search tool earlier in this call are already in memory
+    chunks = _chunk_store(session_state)
+    found: dict[str, dict[str, str]] = {}
+    for source in sources:
+        entry = chunks.get(source)
+        if entry is not None:
+            found[source] = {"chunk_id": source, "title": entry[0], "chunk": entry[1]}
+
+    missing = [s for s in sources if s not in found]
+    if missing:
+        list = " OR ".join(missing)
+        # Use search instead of filter to align with how detailt integrated vectorization indexes
+        # are generated, where chunk_id is searchable with a keyword tokenizer, not filterable 
+        search_results = await search_client.search(search_text=list, 
+                                                    search_fields=[identifier_field], 
+                                                    select=[identifier_field, title_field, content_field], 
+                                                    top=len(missing), 
+                                                    query_type="full")
+        
+        # If your index has a key field that's filterable but not searchable and with the keyword analyzer, you can 
+        # use a filter instead (and you can remove the regex check above, just ensure you escape single quotes)
+        # search_results = await search_client.search(filter=f"search.in(chunk_id, '{list}')", select=["chunk_id", "title", "chunk"])
+
+        async for r in search_results:
+            chunks.put(r[identifier_field], r[title_field], r[content_field])
+            found[r[identifier_field]] = {"chunk_id": r[identifier_field], "title": r[title_field], "chunk": r[content_field]}
 
+    docs = [found[s] for s in dict.fromkeys(sources) if s in found]
     return ToolResult({"sources": docs}, ToolResultDirection.TO_CLIENT)
 
 
-def search_tool(search_client: SearchClient, semantic_configuration: str) -> Tool:
-    return Tool(schema=_search_tool_schema, target=lambda args: _search_tool(search_client, semantic_configuration, "chunk_id", "chunk", "text_vector", True, args))
+def search_tool(search_client: SearchClient, semantic_configuration: str, cache: Optional[SearchResultCache] = None, max_concurrent_queries: int = 4, token_budget: int = 1000) -> Tool:
+    # Shared by all the calls of the process, so a burst of searches does not flood the search service
+    query_slots = asyncio.Semaphore(max_concurrent_queries)
+    return Tool(schema=_search_tool_schema, target=lambda args, session_state: _search_tool(search_client, semantic_configuration, "chunk_id", "title", "chunk", "text_vector", True, cache, query_slots, token_budget, args, session_state))
 
 def report_grounding_tool(search_client: SearchClient) -> Tool:
-    return Tool(schema=_grounding_tool_schema, target=lambda args: _report_grounding_tool(search_client, "chunk_id", "title", "chunk", args))
+    return Tool(schema=_grounding_tool_schema, target=lambda args, session_state: _report_grounding_tool(search_client, "chunk_id", "title", "chunk", args, session_state))
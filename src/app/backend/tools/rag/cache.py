@@ -0,0 +1,113 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+from backend.metrics import Counter, Histogram
+
+search_cache_requests = Counter(
+    "voicerag_search_cache_requests_total",
+    "Search tool lookups by cache outcome (hit, miss, or coalesced into an in-flight query)",
+    ["result"]
+)
+search_latency = Histogram(
+    "voicerag_search_latency_seconds",
+    "Latency of the search tool lookups as seen by the caller",
+    ["cache"]
+)
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = re.compile(r"^[\s\W_]+|[\s\W_]+$")
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a search query so that trivially different phrasings share a cache entry.
+    """
+    return _WHITESPACE.sub(" ", _EDGE_PUNCTUATION.sub("", query.casefold()))
+
+class SearchResultCache:
+    """
+    Async TTL + LRU cache for search results shared by all the calls of the process.
+    Identical lookups that arrive while the first one is still running wait for it instead of
+    querying the index again (single-flight). Failed lookups are not cached.
+    """
+    max_entries: int
+    ttl: float
+
+    def __init__(self, max_entries: int = 512, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(query: str, semantic_configuration: Optional[str], fields: tuple[str, ...]) -> Hashable:
+        return (normalize_query(query), semantic_configuration, fields)
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                search_cache_requests.labels("hit").inc()
+                search_latency.labels("hit").observe(time.perf_counter() - start)
+                return value
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            outcome = "coalesced"
+        else:
+            self.misses += 1
+            outcome = "miss"
+            # The lookup runs in its own task so a caller that is cancelled (for example by a barge-in)
+            # does not cancel it for the other callers waiting on the same query
+            task = asyncio.create_task(self._fetch(key, fetch))
+            self._inflight[key] = task
+        search_cache_requests.labels(outcome).inc()
+
+        value = await asyncio.shield(task)
+        search_latency.labels(outcome).observe(time.perf_counter() - start)
+        return value
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, query: Optional[str] = None) -> int:
+        """
+        Drops the cached results of `query` (for any configuration and fields), or everything when no query is given,
+        for example after the index has been updated. Returns the number of dropped entries.
+        """
+        if query is None:
+            dropped = len(self._entries)
+            self._entries.clear()
+            return dropped
+        normalized = normalize_query(query)
+        keys = [key for key in self._entries if isinstance(key, tuple) and key[0] == normalized]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced
+        }
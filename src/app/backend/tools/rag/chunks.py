@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from typing import Optional
+
+class ChunkStore:
+    """
+    Per-session store of the knowledge base chunks returned by the search tool, so that the grounding tool
+    can cite them without downloading them again. Bounded both in number of chunks and in total characters;
+    the least recently used chunks are dropped first.
+    """
+    max_chunks: int
+    max_chars: int
+
+    def __init__(self, max_chunks: int = 64, max_chars: int = 256_000):
+        self.max_chunks = max_chunks
+        self.max_chars = max_chars
+        self._chunks: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._chars = 0
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def put(self, chunk_id: str, title: Optional[str], chunk: Optional[str]):
+        # The index may hold null fields, they are stored as empty strings
+        title = title or ""
+        chunk = chunk or ""
+        previous = self._chunks.pop(chunk_id, None)
+        if previous is not None:
+            self._chars -= len(previous[0]) + len(previous[1])
+        self._chunks[chunk_id] = (title, chunk)
+        self._chars += len(title) + len(chunk)
+        while self._chunks and (len(self._chunks) > self.max_chunks or self._chars > self.max_chars):
+            _, (old_title, old_chunk) = self._chunks.popitem(last=False)
+            self._chars -= len(old_title) + len(old_chunk)
+
+    def get(self, chunk_id: str) -> Optional[tuple[str, str]]:
+        entry = self._chunks.get(chunk_id)
+        if entry is not None:
+            self._chunks.move_to_end(chunk_id)
+        return entry
@@ -0,0 +1,17 @@
+from typing import Any, Callable, Hashable, Iterable
+
+def reciprocal_rank_fusion(rankings: Iterable[list[Any]], key: Callable[[Any], Hashable], k: int = 60) -> list[Any]:
+    """
+    Merges ranked result lists with reciprocal rank fusion: each result scores the sum of 1 / (k + rank)
+    over the lists it appears in, so results found by several queries rise to the top. Results with the
+    same key are merged, the first one seen is kept. Ties keep the order of the first list they appear in.
+    """
+    scores: dict[Hashable, float] = {}
+    results: dict[Hashable, Any] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            result_key = key(result)
+            scores[result_key] = scores.get(result_key, 0.0) + 1.0 / (k + rank)
+            results.setdefault(result_key, result)
+    # sorted is stable, so equal scores stay in first-seen order
+    return [results[result_key] for result_key in sorted(scores, key=scores.__getitem__, reverse=True)]
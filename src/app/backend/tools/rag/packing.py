@@ -0,0 +1,148 @@
+import re
+from typing import Any, Iterable, Optional
+from backend.metrics import Counter
+
+search_result_bytes_saved = Counter(
+    "voicerag_search_result_bytes_saved_total",
+    "Bytes of search results left out of the search tool output by the result packer"
+)
+search_result_tokens_saved = Counter(
+    "voicerag_search_result_tokens_saved_total",
+    "Estimated tokens of search results left out of the search tool output by the result packer"
+)
+
+# The model's tokenizer is not at hand, about four characters per token is close enough for a budget
+CHARS_PER_TOKEN = 4
+# Sentences shorter than this (headings, list markers) are not deduplicated, they are cheap and give context
+MIN_DEDUPE_CHARS = 20
+SEPARATOR = "\n-----\n"
+GAP = " … "
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"\w+")
+_WHITESPACE = re.compile(r"\s+")
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def query_terms(queries: Iterable[str]) -> set[str]:
+    return {word for query in queries for word in _WORD.findall(query.casefold()) if len(word) > 2}
+
+def _sentences(text: str) -> list[str]:
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+def _trim(sentences: list[str], terms: set[str], budget_chars: int) -> str:
+    """
+    Keeps the sentences with the most query terms that fit in `budget_chars`, in their original order;
+    the gaps left by the sentences dropped in between are marked.
+    """
+    hits = [len(terms.intersection(_WORD.findall(sentence.casefold()))) for sentence in sentences]
+    kept: list[int] = []
+    used = 0
+    for index in sorted(range(len(sentences)), key=lambda i: (-hits[i], i)):
+        cost = len(sentences[index]) + len(GAP)
+        if used + cost <= budget_chars:
+            kept.append(index)
+            used += cost
+    kept.sort()
+    parts = []
+    for position, index in enumerate(kept):
+        if position > 0:
+            parts.append(" " if index == kept[position - 1] + 1 else GAP)
+        parts.append(sentences[index])
+    return "".join(parts)
+
+def _unseen_sentences(content: str, seen: set[str]) -> tuple[list[str], list[str], bool]:
+    """
+    Splits `content` into sentences, leaving out those in `seen`. Returns the sentences, their dedupe keys,
+    and whether any was left out.
+    """
+    sentences = []
+    keys = []
+    duplicates = False
+    for sentence in _sentences(content):
+        key = _WHITESPACE.sub(" ", sentence.casefold())
+        if len(key) >= MIN_DEDUPE_CHARS and key in seen:
+            duplicates = True
+            continue
+        sentences.append(sentence)
+        keys.append(key)
+    return sentences, keys, duplicates
+
+def _mark_seen(seen: set[str], sentences: list[str], keys: list[str], text: str):
+    seen.update(key for sentence, key in zip(sentences, keys) if len(key) >= MIN_DEDUPE_CHARS and sentence in text)
+
+def pack_results(docs: list[dict[str, Any]],
+                 identifier_field: str,
+                 content_field: str,
+                 queries: Iterable[str],
+                 budget_tokens: int,
+                 score_field: Optional[str] = None,
+                 min_chunk_tokens: int = 40) -> str:
+    """
+    Formats search results for the model within about `budget_tokens`, in the order of `docs`. Sentences
+    already given by an earlier chunk (overlapping chunks of the same document) are left out. When the
+    chunks do not fit, they are trimmed to their share of the budget, keeping the sentences with the most
+    query terms; the chunks with the best `score_field` (the semantic reranker score) get their share first,
+    and the rest are dropped once less than `min_chunk_tokens` is left. With a budget of 0 the chunks are
+    returned whole.
+    Each result is the source name in square brackets, the text, and a line with '-----'.
+    """
+    full = "".join(f"[{doc[identifier_field]}]: {doc[content_field] or ''}{SEPARATOR}" for doc in docs)
+    if budget_tokens <= 0:
+        return full
+
+    budget_chars = budget_tokens * CHARS_PER_TOKEN
+    # Without overlaps most results fit as they are, in the order they were ranked
+    seen: set[str] = set()
+    texts: dict[int, str] = {}
+    for index, doc in enumerate(docs):
+        content = doc[content_field] or ""
+        sentences, keys, duplicates = _unseen_sentences(content, seen)
+        if sentences:
+            # A chunk kept whole keeps its own line breaks
+            texts[index] = content if not duplicates else " ".join(sentences)
+            _mark_seen(seen, sentences, keys, texts[index])
+    needed = sum(len(f"[{docs[index][identifier_field]}]: ") + len(text) + len(SEPARATOR) for index, text in texts.items())
+
+    if needed > budget_chars:
+        # Too long: the budget goes first to the best chunks by reranker score (stable, so results without a
+        # score and ties keep their rank), and what each chunk keeps is deduplicated against the chunks kept before it
+        priority = list(range(len(docs)))
+        if score_field is not None:
+            priority.sort(key=lambda index: -(docs[index].get(score_field) or 0.0))
+        terms = query_terms(queries)
+        seen = set()
+        texts = {}
+        used = 0
+        for position, index in enumerate(priority):
+            remaining = budget_chars - used
+            if remaining < min_chunk_tokens * CHARS_PER_TOKEN:
+                break
+            doc = docs[index]
+            header = f"[{doc[identifier_field]}]: "
+            content = doc[content_field] or ""
+            sentences, keys, duplicates = _unseen_sentences(content, seen)
+            if not sentences:
+                continue
+
+            # An even share of what is left, so what a short chunk does not use goes to the next ones,
+            # but never less than `min_chunk_tokens` so the best chunks are not starved by the ones after them
+            share = max(remaining // (len(docs) - position), min_chunk_tokens * CHARS_PER_TOKEN)
+            share = min(share, remaining) - len(header) - len(SEPARATOR)
+            text = content if not duplicates else " ".join(sentences)
+            if len(text) > share:
+                text = _trim(sentences, terms, share)
+                if not text:
+                    continue
+            # Only what was actually given to the model counts as seen
+            _mark_seen(seen, sentences, keys, text)
+            texts[index] = text
+            used += len(header) + len(text) + len(SEPARATOR)
+
+    # One join, in the order the results were ranked
+    packed = "".join(f"[{docs[index][identifier_field]}]: {texts[index]}{SEPARATOR}" for index in sorted(texts))
+    if len(packed) < len(full):
+        search_result_bytes_saved.inc(max(0, len(full.encode("utf-8")) - len(packed.encode("utf-8"))))
+        search_result_tokens_saved.inc(max(0, estimate_tokens(full) - estimate_tokens(packed)))
+    return packed
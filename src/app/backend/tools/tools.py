@@ -1,7 +1,7 @@
 import json
 from typing import Any
 from enum import Enum
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 
 class ToolResultDirection(Enum):
     TO_SERVER = 1
@@ -23,10 +23,12 @@ class ToolResult:
 class Tool:
     target: Callable[..., ToolResult]
     schema: Any
+    timeout: Optional[float]
 
-    def __init__(self, target: Any, schema: Any):
+    def __init__(self, target: Any, schema: Any, timeout: Optional[float] = None):
         self.target = target
         self.schema = schema
+        self.timeout = timeout
 
 class RTToolCall:
     tool_call_id: str
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import aiohttp
+from aiohttp import ClientWebSocketResponse, WSMessage, WSMsgType
+from backend.metrics import Histogram
+
+logger = logging.getLogger("voicerag.upstream")
+
+REALTIME_API_VERSION = "2024-10-01-preview"
+
+first_audio_latency = Histogram(
+    "voicerag_first_audio_seconds",
+    "Time from the client stream connecting to the first audio sent back to it",
+    ["upstream"]
+)
+upstream_connect_latency = Histogram(
+    "voicerag_upstream_connect_seconds",
+    "Time to open an OpenAI Realtime websocket, either for a call that found no warm connection or to refill the pool",
+    ["purpose"]
+)
+
+class UpstreamConnection:
+    """
+    An authenticated websocket to the OpenAI Realtime API handed out by `RealtimeConnectionPool`.
+    Messages the pool already read from the socket while it was idle (such as `session.created`)
+    are kept in `buffered` and replayed first by `messages`.
+    """
+    __slots__ = ("ws", "created_at", "warm", "buffered")
+
+    def __init__(self, ws: ClientWebSocketResponse, warm: bool = False):
+        self.ws = ws
+        self.created_at = time.monotonic()
+        self.warm = warm
+        self.buffered: list[WSMessage] = []
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+    async def messages(self) -> AsyncIterator[WSMessage]:
+        while self.buffered:
+            yield self.buffered.pop(0)
+        async for msg in self.ws:
+            yield msg
+
+    async def close(self):
+        if not self.ws.closed:
+            await self.ws.close()
+
+class RealtimeConnectionPool:
+    """
+    Keeps a number of authenticated OpenAI Realtime websockets open so that a new call does not wait on
+    DNS, TLS and the websocket upgrade before the first audio. Idle sockets are health checked periodically
+    and recycled after `idle_ttl` seconds; the pool is refilled in the background after each `acquire`.
+    With `size` 0 the pool only shares the HTTP session and every connection is opened on demand.
+    """
+    endpoint: str
+    deployment: str
+    size: int
+    idle_ttl: float
+    health_check_interval: float
+
+    def __init__(self,
+                 endpoint: str,
+                 deployment: str,
+                 auth_headers: Callable[[], Awaitable[dict[str, str]]],
+                 size: int = 2,
+                 idle_ttl: float = 300.0,
+                 health_check_interval: float = 15.0,
+                 connect_timeout: float = 10.0):
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self._auth_headers = auth_headers
+        self._idle: deque[UpstreamConnection] = deque()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._refill_task: Optional[asyncio.Task] = None
+        self._refill_needed = asyncio.Event()
+        self._warm = asyncio.Event()
+        self._closed = False
+
+    async def start(self):
+        self._get_session()
+        if self.size > 0 and self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill_loop())
+            self._refill_needed.set()
+
+    async def close(self):
+        self._closed = True
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+        while self._idle:
+            await self._idle.popleft().close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    async def wait_warm(self):
+        """
+        Waits for the first warm connection after `start`, see `RTMiddleTier.wait_warm`.
+        """
+        if self.size > 0:
+            await self._warm.wait()
+
+    async def acquire(self) -> UpstreamConnection:
+        """
+        Returns a warm connection if a healthy one is available, otherwise opens a new one.
+        The caller owns the returned connection and closes it when the call ends.
+        """
+        while self._idle:
+            conn = self._idle.popleft()
+            if self._is_usable(conn):
+                self._refill_needed.set()
+                return conn
+            await conn.close()
+
+        self._refill_needed.set()
+        return UpstreamConnection(await self._connect("call"), warm=False)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(base_url=self.endpoint)
+        return self._session
+
+    async def _connect(self, purpose: str) -> ClientWebSocketResponse:
+        params = {
+            "api-version": REALTIME_API_VERSION,
+            "deployment": self.deployment
+        }
+        start = time.perf_counter()
+        headers = await self._auth_headers()
+        ws = await asyncio.wait_for(
+            self._get_session().ws_connect("/openai/realtime", headers=headers, params=params),
+            self.connect_timeout
+        )
+        upstream_connect_latency.labels(purpose).observe(time.perf_counter() - start)
+        return ws
+
+    def _is_usable(self, conn: UpstreamConnection) -> bool:
+        return not conn.ws.closed and conn.ws.exception() is None and conn.age < self.idle_ttl
+
+    async def _check(self, conn: UpstreamConnection) -> bool:
+        """
+        Reads whatever the server sent while the socket was idle and pings it. Returns False if it is gone.
+        """
+        if not self._is_usable(conn):
+            return False
+        try:
+            while True:
+                msg = await conn.ws.receive(timeout=0.001)
+                if msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    return False
+                conn.buffered.append(msg)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await conn.ws.ping()
+        except (ConnectionError, RuntimeError):
+            return False
+        return True
+
+    async def _health_check(self):
+        # Each connection is taken out of the pool while it is checked, so `acquire` never hands out
+        # a socket that is being read here. Only this task adds connections, so nothing is lost.
+        healthy: deque[UpstreamConnection] = deque()
+        while self._idle:
+            conn = self._idle.popleft()
+            if await self._check(conn):
+                healthy.append(conn)
+            else:
+                await conn.close()
+        self._idle.extend(healthy)
+
+    async def _refill_loop(self):
+        failures = 0
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), self.health_check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._refill_needed.clear()
+
+            await self._health_check()
+            missing = self.size - len(self._idle)
+            if missing <= 0:
+                continue
+
+            results = await asyncio.gather(*(self._connect("pool") for _ in range(missing)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    failures += 1
+                    logger.warning("Could not pre-warm Realtime connection: %s", result)
+                else:
+                    failures = 0
+                    self._idle.append(UpstreamConnection(result, warm=True))
+                    self._warm.set()
+
+            if failures:
+                # Back off so a broken endpoint or expired credential does not turn into a connect storm
+                await asyncio.sleep(min(60.0, 2 ** min(failures, 6)) * random.uniform(0.5, 1.0))
+                self._refill_needed.set()
@@ -0,0 +1,90 @@
+import binascii
+from collections import deque
+import numpy as np
+from backend.metrics import Counter
+
+vad_frames = Counter(
+    "voicerag_vad_frames_total",
+    "Caller audio frames seen by the voice activity gate, by decision (sent or suppressed)",
+    ["decision"]
+)
+vad_suppressed_bytes = Counter(
+    "voicerag_vad_suppressed_bytes_total",
+    "Base64 audio bytes the voice activity gate kept from being sent upstream"
+)
+
+class VoiceActivityGate:
+    """
+    Energy and zero-crossing voice activity gate for the caller audio, so that long silences and line noise
+    are not sent to the OpenAI Realtime API.
+
+    A frame is speech when it is louder than `threshold_dbfs` and its zero-crossing rate is below `max_zcr`
+    (broadband hiss crosses zero far more often than voiced speech). After the last speech frame the gate
+    stays open for `hangover_ms`, which must be longer than the server VAD `silence_duration_ms` so that the
+    server still sees the end of the turn. While closed, the last `pre_roll_ms` of audio are kept and sent
+    ahead of the next speech frame so that onsets are not clipped.
+    """
+    def __init__(self, sample_rate: int, threshold_dbfs: float = -45.0, max_zcr: float = 0.4, pre_roll_ms: int = 400, hangover_ms: int = 800):
+        self.sample_rate = sample_rate
+        self.threshold_rms = 32768 * 10 ** (threshold_dbfs / 20)
+        self.max_zcr = max_zcr
+        self.pre_roll_ms = pre_roll_ms
+        self.hangover_ms = hangover_ms
+        self._pre_roll: deque[tuple[str, float]] = deque()
+        self._pre_roll_duration = 0.0
+        self._hangover_left = 0.0
+        self.frames_sent = 0
+        self.frames_suppressed = 0
+        self.bytes_suppressed = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._hangover_left > 0
+
+    def is_speech(self, samples: np.ndarray) -> bool:
+        if len(samples) < 2:
+            return False
+        rms = float(np.sqrt(np.dot(samples, samples) / len(samples)))
+        if rms < self.threshold_rms:
+            return False
+        signs = np.signbit(samples)
+        zcr = np.count_nonzero(signs[1:] != signs[:-1]) / (len(samples) - 1)
+        return zcr <= self.max_zcr
+
+    def process(self, audio: str) -> list[str]:
+        """
+        Takes one base64 pcm16 frame and returns the frames to send upstream now: nothing while the gate is
+        closed, the frame itself while it is open, and the pre-roll followed by the frame when speech starts.
+        """
+        pcm = binascii.a2b_base64(audio)
+        samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2).astype(np.float32)
+        duration_ms = 1000 * len(samples) / self.sample_rate
+
+        if self.is_speech(samples):
+            self._hangover_left = self.hangover_ms
+            frames = [frame for frame, _ in self._pre_roll]
+            frames.append(audio)
+            self._pre_roll.clear()
+            self._pre_roll_duration = 0.0
+            self._record_sent(len(frames))
+            return frames
+
+        if self._hangover_left > 0:
+            self._hangover_left -= duration_ms
+            self._record_sent(1)
+            return [audio]
+
+        self._pre_roll.append((audio, duration_ms))
+        self._pre_roll_duration += duration_ms
+        while self._pre_roll and self._pre_roll_duration - self._pre_roll[0][1] >= self.pre_roll_ms:
+            dropped, dropped_ms = self._pre_roll.popleft()
+            self._pre_roll_duration -= dropped_ms
+            self.frames_suppressed += 1
+            self.bytes_suppressed += len(dropped)
+            vad_frames.labels("suppressed").inc()
+            vad_suppressed_bytes.inc(len(dropped))
+        return []
+
+    def _record_sent(self, count: int):
+        self.frames_sent += count
+        vad_frames.labels("sent").inc(count)
@@ -0,0 +1,27 @@
+import asyncio
+from aiohttp.worker import GunicornUVLoopWebWorker, GunicornWebWorker
+
+class _DrainingHeartbeat:
+    """
+    Keeps the gunicorn heartbeat going while a worker drains its live calls after a reload or shutdown.
+    The aiohttp worker only notifies the arbiter while it accepts connections, so a draining worker would
+    be killed after `timeout`; with this the heartbeat stops only when the event loop does, and `timeout`
+    can stay short to catch a blocked loop.
+    """
+    async def _run(self):
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await super()._run()
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self.notify()
+            await asyncio.sleep(1.0)
+
+class DrainingWebWorker(_DrainingHeartbeat, GunicornWebWorker):
+    pass
+
+class DrainingUVLoopWebWorker(_DrainingHeartbeat, GunicornUVLoopWebWorker):
+    pass
@@ -0,0 +1,49 @@
+"""
+Measures the throughput of the audio conversion stage in frames per second per core.
+
+Run from `src/app`:
+
+    python -m benchmarks.audio_convert [--seconds 2]
+"""
+import argparse
+import base64
+import time
+import numpy as np
+from backend.helpers import AudioConverter
+
+def make_frame(sample_rate: int, duration_ms: int) -> str:
+    t = np.arange(sample_rate * duration_ms // 1000) / sample_rate
+    speech_like = 3000 * np.sin(2 * np.pi * 220 * t) + 800 * np.random.default_rng(0).standard_normal(len(t))
+    return base64.b64encode(speech_like.astype("<i2").tobytes()).decode("ascii")
+
+def measure(converter: AudioConverter, frame: str, seconds: float) -> float:
+    iterations = 0
+    start_cpu = time.process_time()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            converter.convert(frame)
+        iterations += 100
+    return iterations / (time.process_time() - start_cpu)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Duration of each measurement")
+    args = parser.parse_args()
+
+    # ACS sends 20 ms frames, OpenAI deltas are typically around 100 ms
+    cases = [
+        ("ACS 8 kHz -> OpenAI 24 kHz, 20 ms", 8000, 24000, False, 20),
+        ("ACS 16 kHz -> OpenAI 24 kHz, 20 ms", 16000, 24000, False, 20),
+        ("ACS 16 kHz -> OpenAI 24 kHz + gain, 20 ms", 16000, 24000, True, 20),
+        ("ACS 24 kHz -> OpenAI 24 kHz + gain, 20 ms", 24000, 24000, True, 20),
+        ("OpenAI 24 kHz -> ACS 16 kHz, 100 ms", 24000, 16000, False, 100),
+        ("OpenAI 24 kHz -> ACS 8 kHz, 100 ms", 24000, 8000, False, 100),
+    ]
+    print(f"{'case':<44} {'frames/s per core':>18} {'x real time':>12}")
+    for name, from_rate, to_rate, gain, duration_ms in cases:
+        rate = measure(AudioConverter(from_rate, to_rate, normalize_gain=gain), make_frame(from_rate, duration_ms), args.seconds)
+        print(f"{name:<44} {rate:>18,.0f} {rate * duration_ms / 1000:>12,.0f}")
+
+if __name__ == "__main__":
+    main()
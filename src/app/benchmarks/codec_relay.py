@@ -0,0 +1,86 @@
+"""
+Measures how many audio frames per second a single core can relay in each direction,
+comparing the generic decode/transform/encode path with the codec fast path.
+
+Run from `src/app`:
+
+    python -m benchmarks.codec_relay [--seconds 2]
+"""
+import argparse
+import base64
+import json
+import os
+import time
+from typing import Callable
+from backend import codec
+from backend.helpers import transform_acs_to_openai_format, transform_openai_to_acs_format
+
+# 20 ms of 24 kHz 16 bit mono PCM, the frame size ACS streams with
+ACS_FRAME_BYTES = 960
+# OpenAI audio deltas are larger and vary in size, 100 ms is typical
+OPENAI_DELTA_BYTES = 4800
+
+def make_acs_frame() -> str:
+    return json.dumps({
+        "kind": "AudioData",
+        "audioData": {
+            "timestamp": "2024-11-05T10:21:31.415Z",
+            "participantRawID": "4:+391234567890",
+            "data": base64.b64encode(os.urandom(ACS_FRAME_BYTES)).decode("ascii"),
+            "silent": False
+        }
+    })
+
+def make_openai_delta() -> str:
+    return json.dumps({
+        "type": "response.audio.delta",
+        "event_id": "event_AbCdEfGhIjKlMnOpQrStU",
+        "response_id": "resp_AbCdEfGhIjKlMnOpQrStU",
+        "item_id": "item_AbCdEfGhIjKlMnOpQrStU",
+        "output_index": 0,
+        "content_index": 0,
+        "delta": base64.b64encode(os.urandom(OPENAI_DELTA_BYTES)).decode("ascii")
+    })
+
+def measure(fn: Callable[[], object], seconds: float) -> float:
+    """
+    Returns the number of calls per second of CPU time.
+    """
+    iterations = 0
+    batch = 1000
+    start_cpu = time.process_time()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(batch):
+            fn()
+        iterations += batch
+    return iterations / (time.process_time() - start_cpu)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Duration of each measurement")
+    args = parser.parse_args()
+
+    acs_frame = make_acs_frame()
+    openai_delta = make_openai_delta()
+
+    codecs = [codec.get_codec("json")]
+    if codec.orjson is not None:
+        codecs.append(codec.get_codec("orjson"))
+
+    cases: list[tuple[str, Callable[[], object]]] = []
+    for c in codecs:
+        cases.append((f"ACS -> OpenAI generic ({c.name})",
+                      lambda c=c: c.dumps(transform_acs_to_openai_format(c.loads(acs_frame), None, {}, None, None, None, None, "alloy"))))
+        cases.append((f"OpenAI -> ACS generic ({c.name})",
+                      lambda c=c: c.dumps(transform_openai_to_acs_format(c.loads(openai_delta)))))
+    cases.append(("ACS -> OpenAI fast path", lambda: codec.openai_audio_append(codec.extract_acs_audio(acs_frame))))
+    cases.append(("OpenAI -> ACS fast path", lambda: codec.acs_audio_data(codec.extract_openai_audio_delta(openai_delta))))
+
+    print(f"ACS frame: {len(acs_frame)} chars, OpenAI delta: {len(openai_delta)} chars")
+    print(f"{'case':<36} {'frames/s per core':>18}")
+    for name, fn in cases:
+        print(f"{name:<36} {measure(fn, args.seconds):>18,.0f}")
+
+if __name__ == "__main__":
+    main()
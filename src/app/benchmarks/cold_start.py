@@ -0,0 +1,84 @@
+"""
+Measures the cold start of the server: the time from launching gunicorn until `--path` first answers
+200, which for `/ready` means the worker has loaded the prompt and pre-warmed its upstream connections
+to the mock Realtime API. Each run starts a fresh gunicorn so nothing is cached between runs, apart
+from the operating system's file cache.
+
+Run from `src/app`:
+
+    python -m benchmarks.cold_start --runs 5 [--path /ready] [--workers 1]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from benchmarks.loadtest.driver import wait_until_up
+from benchmarks.worker_capacity import free_port
+
+async def wait_until_ok(session: aiohttp.ClientSession, url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer 200 within {timeout:.0f} s")
+
+async def cold_start(session: aiohttp.ClientSession, mock_url: str, path: str, workers: int) -> float:
+    port = free_port()
+    env = dict(os.environ,
+               AZURE_OPENAI_ENDPOINT=mock_url,
+               AZURE_OPENAI_COMPLETION_DEPLOYMENT_NAME="coldstart",
+               AZURE_OPENAI_API_KEY="coldstart",
+               WEB_CONCURRENCY=str(workers),
+               HOST="127.0.0.1",
+               PORT=str(port),
+               ACCESS_LOG="",
+               LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+               METRICS_DIR=tempfile.mkdtemp(prefix="voicerag-coldstart-metrics-"),
+               CONVERSATION_JOURNAL_DIR=tempfile.mkdtemp(prefix="voicerag-coldstart-journal-"),
+               CONVERSATION_LOG_SPOOL_DIR=tempfile.mkdtemp(prefix="voicerag-coldstart-spool-"))
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "app:create_app", "-c", "gunicorn.conf.py"],
+                              env=env, stdout=subprocess.DEVNULL)
+    try:
+        await wait_until_ok(session, f"http://127.0.0.1:{port}{path}")
+        return time.monotonic() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts")
+    parser.add_argument("--path", default="/ready", help="Endpoint that must answer 200 for the server to count as started")
+    parser.add_argument("--workers", type=int, default=1, help="Gunicorn workers of the server")
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock = subprocess.Popen([sys.executable, "-m", "benchmarks.loadtest.mock_realtime", "--port", str(mock_port)])
+    durations = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, mock_url + "/stats")
+            for run in range(args.runs):
+                durations.append(await cold_start(session, mock_url, args.path, args.workers))
+                print(f"run {run + 1}: {durations[-1] * 1000:.0f} ms", flush=True)
+    finally:
+        mock.send_signal(signal.SIGTERM)
+        mock.wait(timeout=10)
+    print(f"Cold start to {args.path} with {args.workers} worker(s): median {statistics.median(durations) * 1000:.0f} ms, "
+          f"min {min(durations) * 1000:.0f} ms, max {max(durations) * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+"""
+Load test of the relay: ramps up concurrent simulated ACS calls against a gunicorn server backed by the
+mock Realtime API, and reports per step the relay latency in both directions, the caller-perceived
+turn and barge-in latencies, and the CPU and memory the server uses per call.
+
+The mock Realtime API and the server run in their own processes; the simulated calls run in this one.
+Stamps are compared across processes with the system-wide monotonic clock. The ACS stream runs at
+24 kHz, where the relay does not resample, so that the stamps survive the relay.
+
+Run from `src/app`:
+
+    python -m benchmarks.loadtest.driver --calls 10 25 50 100 --seconds 30
+
+With `--max-p99-ms` the ramp stops at the first step whose assistant audio p99 latency exceeds it, and
+the last step within it is reported as the capacity of the server. Extra relay settings can be passed
+as environment variables, e.g. `ACS_VAD_GATE=true`.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from benchmarks.loadtest.mock_acs import CallStats, acs_call
+from benchmarks.worker_capacity import cpu_seconds, free_port, percentile, process_tree
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def rss_bytes(pids: list[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            total += int(open(f"/proc/{pid}/statm").read().split()[1]) * PAGE_SIZE
+        except OSError:
+            pass
+    return total
+
+async def wait_until_up(session: aiohttp.ClientSession, url: str):
+    for _ in range(150):
+        try:
+            async with session.get(url):
+                return
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+async def run_step(session: aiohttp.ClientSession, url: str, mock_url: str, server_pid: int, calls: int, seconds: float, ramp_seconds: float, args) -> tuple[CallStats, dict, float, float]:
+    """
+    Runs `calls` concurrent calls, started evenly over `ramp_seconds`, and returns their stats, the stats of
+    the mock Realtime API, the cores used by the server and its resident memory above idle.
+    """
+    stats = CallStats()
+    async with session.get(mock_url + "/stats?reset=1"):
+        pass
+    pids = process_tree(server_pid)
+    idle_rss = rss_bytes(pids)
+    peak_rss = idle_rss
+
+    async def start_call(index: int):
+        await asyncio.sleep(ramp_seconds * index / calls)
+        await acs_call(session, url, f"load-{calls}-{index}", stop_at, stats, args.talk_ms, args.pause_ms, args.barge_in_every, args.barge_in_after_ms)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            await asyncio.sleep(1.0)
+            peak_rss = max(peak_rss, rss_bytes(pids))
+
+    cpu_start, wall_start = cpu_seconds(pids), time.monotonic()
+    stop_at = wall_start + ramp_seconds + seconds
+    sampler = asyncio.create_task(sample_rss())
+    try:
+        await asyncio.gather(*(start_call(i) for i in range(calls)))
+    finally:
+        sampler.cancel()
+    cores = (cpu_seconds(pids) - cpu_start) / (time.monotonic() - wall_start)
+    async with session.get(mock_url + "/stats") as response:
+        mock_stats = await response.json()
+    return stats, mock_stats, cores, peak_rss - idle_rss
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, nargs="+", default=[10, 25, 50], help="Concurrent calls of each step")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Duration of each step once all its calls are up")
+    parser.add_argument("--ramp-seconds", type=float, default=5.0, help="The calls of a step are started evenly over this time")
+    parser.add_argument("--workers", type=int, default=1, help="Gunicorn workers of the server")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="Stop the ramp when the assistant audio p99 latency exceeds this")
+    parser.add_argument("--speed", type=float, default=1.0, help="The mock streams answers at this multiple of real time")
+    parser.add_argument("--answer-ms", type=int, default=3000, help="Duration of each answer")
+    parser.add_argument("--talk-ms", type=int, default=1500, help="Duration of each caller turn")
+    parser.add_argument("--pause-ms", type=int, default=600, help="Pause of the caller after an answer")
+    parser.add_argument("--barge-in-every", type=int, default=3, help="Talk over every n-th answer, 0 never")
+    parser.add_argument("--barge-in-after-ms", type=int, default=800, help="How far into the answer the caller barges in")
+    args = parser.parse_args()
+
+    mock_port, port = free_port(), free_port()
+    mock_url, url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{port}"
+    mock = subprocess.Popen([sys.executable, "-m", "benchmarks.loadtest.mock_realtime", "--port", str(mock_port),
+                             "--speed", str(args.speed), "--answer-ms", str(args.answer_ms)])
+    env = dict(os.environ,
+               AZURE_OPENAI_ENDPOINT=mock_url,
+               AZURE_OPENAI_COMPLETION_DEPLOYMENT_NAME="loadtest",
+               AZURE_OPENAI_API_KEY="loadtest",
+               ACS_AUDIO_SAMPLE_RATE="24000",
+               WEB_CONCURRENCY=str(args.workers),
+               HOST="127.0.0.1",
+               PORT=str(port),
+               ACCESS_LOG="",
+               LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+               METRICS_DIR=tempfile.mkdtemp(prefix="voicerag-loadtest-metrics-"),
+               CONVERSATION_JOURNAL_DIR=tempfile.mkdtemp(prefix="voicerag-loadtest-journal-"),
+               CONVERSATION_LOG_SPOOL_DIR=tempfile.mkdtemp(prefix="voicerag-loadtest-spool-"))
+    env.pop("AZURE_STORAGE_CONNECTION_STRING", None)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "app:create_app", "-c", "gunicorn.conf.py"],
+                              env=env, stdout=subprocess.DEVNULL)
+
+    print(f"{'calls':>6} {'down p50':>9} {'down p99':>9} {'up p50':>9} {'up p99':>9} {'turn p50':>9} {'stop p50':>9} "
+          f"{'leaked':>7} {'failed':>7} {'cores':>6} {'core/call':>10} {'MB/call':>8}")
+    capacity = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, mock_url + "/stats")
+            await wait_until_up(session, url + "/")
+            for calls in args.calls:
+                stats, mock_stats, cores, rss = await run_step(session, url, mock_url, server.pid, calls, args.seconds, args.ramp_seconds, args)
+                down_p99 = percentile(stats.downstream_latencies, 0.99) * 1000
+                up = mock_stats["upstream_latencies"]
+                print(f"{calls:>6} {percentile(stats.downstream_latencies, 0.5) * 1000:>9.1f} {down_p99:>9.1f} "
+                      f"{percentile(up, 0.5) * 1000:>9.1f} {percentile(up, 0.99) * 1000:>9.1f} "
+                      f"{percentile(stats.turn_latencies, 0.5) * 1000:>9.0f} {percentile(stats.stop_latencies, 0.5) * 1000:>9.1f} "
+                      f"{stats.leaked_frames:>7} {stats.failed_calls:>7} {cores:>6.2f} {cores / calls * 100:>9.2f}% {rss / calls / 2**20:>8.2f}", flush=True)
+                if args.max_p99_ms is not None:
+                    if down_p99 > args.max_p99_ms or stats.failed_calls:
+                        break
+                    capacity = calls
+    finally:
+        server.send_signal(signal.SIGTERM)
+        mock.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+        mock.wait(timeout=10)
+
+    if args.max_p99_ms is not None:
+        print(f"Capacity within {args.max_p99_ms:.0f} ms p99: {capacity or 'below the first step'} calls with {args.workers} worker(s)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+"""
+Mock of the Azure Communication Services media streaming client for load tests.
+
+Each simulated call connects to `/realtime-acs`, announces 24 kHz PCM with `AudioMetadata` and streams
+20 ms `AudioData` frames at real-time rate for the whole call, like ACS does: silence while the caller
+listens, a tone while the caller talks. The caller waits for the assistant to finish, pauses, talks
+for `talk_ms`, and every `barge_in_every` turns talks over the answer `barge_in_after_ms` into it.
+
+Speech frames and the mock Realtime API answers carry stamps (see `mock_realtime.stamp`), from which
+the calls record how late the relay delivers the assistant audio, how long the caller waits for an
+answer, and how long the relay takes to stop the assistant after a barge-in.
+
+Run from `src/app` against a relay that is already running and pointed at the mock Realtime API:
+
+    python -m benchmarks.loadtest.mock_acs --url http://127.0.0.1:8000 --calls 20 --seconds 30
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import math
+import struct
+import time
+from dataclasses import dataclass, field
+import aiohttp
+from benchmarks.loadtest.mock_realtime import SAMPLE_RATE, StampReader, stamp
+from benchmarks.worker_capacity import percentile
+
+FRAME_MS = 20
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+# A 220 Hz tone is loud enough and voiced enough to pass for speech, also for the local VAD gate
+TONE = bytearray(struct.pack(f"<{FRAME_SAMPLES}h", *(int(4000 * math.sin(2 * math.pi * 220 * i / SAMPLE_RATE)) for i in range(FRAME_SAMPLES))))
+SILENCE = json.dumps({"kind": "AudioData", "audioData": {"data": base64.b64encode(bytes(FRAME_SAMPLES * 2)).decode("ascii"), "silent": True}})
+# The caller gives up waiting for an answer and talks again after this long
+ANSWER_TIMEOUT = 10.0
+
+@dataclass
+class CallStats:
+    """
+    Measurements of all the calls of a load step, in seconds.
+    """
+    downstream_latencies: list[float] = field(default_factory=list)
+    turn_latencies: list[float] = field(default_factory=list)
+    stop_latencies: list[float] = field(default_factory=list)
+    frames_received: int = 0
+    # Assistant audio of an interrupted answer that still reached the caller after StopAudio
+    leaked_frames: int = 0
+    turns: int = 0
+    barge_ins: int = 0
+    failed_calls: int = 0
+
+def speech_frame() -> str:
+    pcm = stamp(bytearray(TONE))
+    return json.dumps({"kind": "AudioData", "audioData": {"data": base64.b64encode(pcm).decode("ascii"), "silent": False}})
+
+async def acs_call(session: aiohttp.ClientSession, url: str, call_id: str, stop_at: float, stats: CallStats,
+                   talk_ms: int = 1500, pause_ms: int = 600, barge_in_every: int = 3, barge_in_after_ms: int = 800):
+    try:
+        async with session.ws_connect(f"{url}/realtime-acs?callConnectionId={call_id}", max_msg_size=0) as ws:
+            await ws.send_str(json.dumps({"kind": "AudioMetadata", "audioMetadata": {"encoding": "PCM", "sampleRate": SAMPLE_RATE, "channels": 1, "length": FRAME_SAMPLES * 2}}))
+            await _converse(ws, stop_at, stats, talk_ms, pause_ms, barge_in_every, barge_in_after_ms)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError):
+        stats.failed_calls += 1
+
+async def _converse(ws: aiohttp.ClientWebSocketResponse, stop_at: float, stats: CallStats, talk_ms: int, pause_ms: int, barge_in_every: int, barge_in_after_ms: int):
+    started_at = time.monotonic()
+    talking_until = 0.0
+    turns = 0
+    # When the caller last stopped talking, until the answer starts
+    turn_ended_at = None
+    answer_started_at = None
+    last_audio_at = 0.0
+    barge_in_at = None
+    # Answers up to this sequence number were interrupted, their audio must not play any more
+    interrupted_sequence = 0
+    latest_sequence = 0
+
+    async def send_frames():
+        nonlocal talking_until, turns, turn_ended_at, answer_started_at, barge_in_at
+        next_at = time.monotonic()
+        talking = False
+        while time.monotonic() < stop_at:
+            now = time.monotonic()
+            if talking and now >= talking_until:
+                talking = False
+                turn_ended_at, answer_started_at = now, None
+            elif not talking:
+                barge_in = barge_in_every > 0 and turns > 0 and turns % barge_in_every == 0
+                if answer_started_at is not None and barge_in and now - answer_started_at >= barge_in_after_ms / 1000:
+                    talking, barge_in_at = True, now
+                    stats.barge_ins += 1
+                elif answer_started_at is not None and now - last_audio_at >= pause_ms / 1000:
+                    talking = True
+                elif answer_started_at is None and now - (turn_ended_at or started_at) >= ANSWER_TIMEOUT:
+                    talking = True
+                if talking:
+                    talking_until = now + talk_ms / 1000
+                    turns += 1
+                    stats.turns += 1
+                    answer_started_at = None
+            await ws.send_str(speech_frame() if talking else SILENCE)
+            next_at += FRAME_MS / 1000
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        await ws.close()
+
+    async def receive():
+        nonlocal turn_ended_at, answer_started_at, last_audio_at, barge_in_at, interrupted_sequence, latest_sequence
+        stamps = StampReader()
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            now = time.monotonic()
+            if data.get("kind") == "StopAudio":
+                interrupted_sequence = latest_sequence
+                if barge_in_at is not None:
+                    stats.stop_latencies.append(now - barge_in_at)
+                    barge_in_at = None
+            elif data.get("kind") == "AudioData":
+                stats.frames_received += 1
+                for sequence, sent_at in stamps.read(binascii.a2b_base64(data["audioData"]["data"])):
+                    if sequence <= interrupted_sequence:
+                        stats.leaked_frames += 1
+                        continue
+                    latest_sequence = max(latest_sequence, sequence)
+                    stats.downstream_latencies.append(now - sent_at)
+                    last_audio_at = now
+                    if answer_started_at is None:
+                        answer_started_at = now
+                        if turn_ended_at is not None:
+                            stats.turn_latencies.append(now - turn_ended_at)
+                            turn_ended_at = None
+
+    await asyncio.gather(send_frames(), receive())
+
+def summarize(stats: CallStats) -> str:
+    ms = lambda values, p: f"{percentile(values, p) * 1000:.1f} ms"
+    return "\n".join([
+        f"turns {stats.turns}, barge-ins {stats.barge_ins}, failed calls {stats.failed_calls}",
+        f"assistant audio relay latency  p50 {ms(stats.downstream_latencies, 0.5)}  p99 {ms(stats.downstream_latencies, 0.99)}",
+        f"end of turn to answer          p50 {ms(stats.turn_latencies, 0.5)}  p99 {ms(stats.turn_latencies, 0.99)}",
+        f"barge-in to StopAudio          p50 {ms(stats.stop_latencies, 0.5)}  p99 {ms(stats.stop_latencies, 0.99)}",
+        f"audio frames received {stats.frames_received}, stamps of interrupted answers after StopAudio {stats.leaked_frames}",
+    ])
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the relay")
+    parser.add_argument("--calls", type=int, default=10, help="Concurrent calls")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Duration of each call")
+    parser.add_argument("--talk-ms", type=int, default=1500, help="Duration of each caller turn")
+    parser.add_argument("--barge-in-every", type=int, default=3, help="Talk over every n-th answer, 0 never")
+    args = parser.parse_args()
+
+    stats = CallStats()
+    stop_at = time.monotonic() + args.seconds
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(acs_call(session, args.url, f"mock-acs-{i}", stop_at, stats, args.talk_ms, barge_in_every=args.barge_in_every)
+                               for i in range(args.calls)))
+    print(summarize(stats))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,217 @@
+"""
+Mock of the OpenAI Realtime API endpoint (`/openai/realtime`) for load tests.
+
+Each connection plays a scripted conversation: the greeting requested by the relay, then an answer
+after every caller turn. A simple server VAD runs on the appended caller audio: `speech_started` as
+soon as a frame carries speech, `speech_stopped` after `--silence-ms` without speech, then the answer
+after `--think-ms`. Answers are streamed as 100 ms `response.audio.delta` events at `--speed` times
+real time and stop on `response.cancel`, like the real service.
+
+Audio frames carry stamps (see `stamp`), so latencies can be measured on the far side of the relay:
+`GET /stats` returns the upstream latencies of the caller audio seen so far and what was sent.
+
+Run from `src/app` and point `AZURE_OPENAI_ENDPOINT` at it:
+
+    python -m benchmarks.loadtest.mock_realtime --port 9100
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import struct
+import time
+from typing import Optional
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+SAMPLE_RATE = 24000
+DELTA_MS = 100
+DELTA_BYTES = SAMPLE_RATE * DELTA_MS // 1000 * 2
+
+# Stamp written at the start of stamped PCM frames: magic, sequence number, send time (time.monotonic)
+STAMP_MAGIC = b"VRLT"
+STAMP = struct.Struct("<4sId")
+# Caller frames louder than this (int16 peak) count as speech
+SPEECH_PEAK = 500
+
+def stamp(pcm: bytearray, sequence: int = 0) -> bytearray:
+    STAMP.pack_into(pcm, 0, STAMP_MAGIC, sequence, time.monotonic())
+    return pcm
+
+class StampReader:
+    """
+    Finds the stamps in a stream of PCM chunks, also when the relay re-chunks the audio or drops part of it.
+    """
+    def __init__(self):
+        self._tail = b""
+
+    def read(self, pcm: bytes) -> list[tuple[int, float]]:
+        data = self._tail + pcm
+        stamps = []
+        position = data.find(STAMP_MAGIC)
+        while position != -1 and position + STAMP.size <= len(data):
+            _, sequence, sent_at = STAMP.unpack_from(data, position)
+            stamps.append((sequence, sent_at))
+            position = data.find(STAMP_MAGIC, position + STAMP.size)
+        self._tail = data[-(STAMP.size - 1):]
+        return stamps
+
+class MockStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.upstream_latencies: list[float] = []
+        self.deltas_sent = 0
+        self.responses = 0
+        self.cancelled = 0
+
+    def to_json(self) -> dict:
+        return {
+            "upstream_latencies": self.upstream_latencies,
+            "deltas_sent": self.deltas_sent,
+            "responses": self.responses,
+            "cancelled": self.cancelled,
+        }
+
+class MockRealtimeSession:
+    def __init__(self, ws: web.WebSocketResponse, stats: MockStats, speed: float, answer_ms: int, think_ms: int, silence_ms: int):
+        self.ws = ws
+        self.stats = stats
+        self.speed = speed
+        self.answer_ms = answer_ms
+        self.think_ms = think_ms
+        self.silence_ms = silence_ms
+        self.stamps = StampReader()
+        self.speaking = False
+        self.last_speech_at = 0.0
+        self.response: Optional[asyncio.Task] = None
+        self.response_count = 0
+        self.cancelled_response = 0
+
+    async def send(self, event: dict):
+        if not self.ws.closed:
+            await self.ws.send_str(json.dumps(event))
+
+    async def run(self):
+        await self.send({"type": "session.created", "session": {}})
+        vad = asyncio.create_task(self.vad())
+        try:
+            async for msg in self.ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                event = json.loads(msg.data)
+                match event.get("type"):
+                    case "input_audio_buffer.append":
+                        await self.append(event["audio"])
+                    case "session.update":
+                        await self.send({"type": "session.updated", "session": event.get("session", {})})
+                    case "response.create":
+                        self.respond(0)
+                    case "response.cancel":
+                        await self.cancel()
+                    case "conversation.item.truncate":
+                        await self.send({"type": "conversation.item.truncated", "item_id": event.get("item_id"),
+                                         "content_index": 0, "audio_end_ms": event.get("audio_end_ms")})
+        finally:
+            vad.cancel()
+            if self.response is not None:
+                self.response.cancel()
+
+    async def append(self, audio: str):
+        pcm = binascii.a2b_base64(audio)
+        received_at = time.monotonic()
+        for _, sent_at in self.stamps.read(pcm):
+            self.stats.upstream_latencies.append(received_at - sent_at)
+        samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+        if len(samples) and int(np.abs(samples).max()) >= SPEECH_PEAK:
+            self.last_speech_at = received_at
+            if not self.speaking:
+                self.speaking = True
+                await self.send({"type": "input_audio_buffer.speech_started", "audio_start_ms": 0, "item_id": f"item_user_{self.response_count}"})
+
+    async def vad(self):
+        # Also ends the turn when the relay stops sending audio altogether, e.g. behind a local VAD gate
+        while True:
+            await asyncio.sleep(0.05)
+            if self.speaking and time.monotonic() - self.last_speech_at >= self.silence_ms / 1000:
+                self.speaking = False
+                await self.send({"type": "input_audio_buffer.speech_stopped", "audio_end_ms": 0, "item_id": f"item_user_{self.response_count}"})
+                self.respond(self.think_ms)
+
+    def respond(self, delay_ms: int):
+        if self.response is not None and not self.response.done() and self.cancelled_response != self.response_count:
+            return
+        self.response_count += 1
+        self.response = asyncio.create_task(self.stream_response(self.response_count, delay_ms))
+
+    async def cancel(self):
+        if self.response is None or self.response.done() or self.cancelled_response == self.response_count:
+            return
+        # The streaming task stops before its next delta, cancelling it could cut a frame in half
+        self.cancelled_response = self.response_count
+        self.stats.cancelled += 1
+        response_id = f"resp_{self.response_count}"
+        await self.send({"type": "response.done", "response": {"id": response_id, "status": "cancelled", "output": []}})
+
+    async def stream_response(self, number: int, delay_ms: int):
+        response_id, item_id = f"resp_{number}", f"item_{number}"
+        await asyncio.sleep(delay_ms / 1000)
+        if self.cancelled_response == number:
+            return
+        self.stats.responses += 1
+        await self.send({"type": "response.created", "response": {"id": response_id, "status": "in_progress"}})
+        await self.send({"type": "response.output_item.added", "response_id": response_id, "output_index": 0,
+                         "item": {"id": item_id, "type": "message", "role": "assistant", "content": []}})
+        next_at = time.monotonic()
+        for _ in range(self.answer_ms // DELTA_MS):
+            if self.cancelled_response == number:
+                return
+            delta = base64.b64encode(stamp(bytearray(DELTA_BYTES), number)).decode("ascii")
+            await self.send({"type": "response.audio.delta", "response_id": response_id, "item_id": item_id,
+                             "output_index": 0, "content_index": 0, "delta": delta})
+            self.stats.deltas_sent += 1
+            next_at += DELTA_MS / 1000 / self.speed
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        await self.send({"type": "response.audio.done", "response_id": response_id, "item_id": item_id, "output_index": 0, "content_index": 0})
+        await self.send({"type": "response.output_item.done", "response_id": response_id, "output_index": 0,
+                         "item": {"id": item_id, "type": "message", "role": "assistant"}})
+        await self.send({"type": "response.done", "response": {"id": response_id, "status": "completed", "output": [
+            {"id": item_id, "type": "message", "role": "assistant", "content": [{"type": "audio", "transcript": f"Risposta {number}"}]}
+        ]}})
+
+def create_app(speed: float = 1.0, answer_ms: int = 3000, think_ms: int = 400, silence_ms: int = 500) -> web.Application:
+    stats = MockStats()
+
+    async def realtime(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await MockRealtimeSession(ws, stats, speed, answer_ms, think_ms, silence_ms).run()
+        return ws
+
+    async def get_stats(request: web.Request) -> web.Response:
+        response = web.json_response(stats.to_json())
+        if request.query.get("reset") == "1":
+            stats.reset()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/openai/realtime", realtime)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--speed", type=float, default=1.0, help="Answer audio is streamed at this multiple of real time")
+    parser.add_argument("--answer-ms", type=int, default=3000, help="Duration of each answer")
+    parser.add_argument("--think-ms", type=int, default=400, help="Delay between the end of the caller's turn and the answer")
+    parser.add_argument("--silence-ms", type=int, default=500, help="Silence that ends the caller's turn, as the server VAD silence_duration_ms")
+    args = parser.parse_args()
+    web.run_app(create_app(args.speed, args.answer_ms, args.think_ms, args.silence_ms), host=args.host, port=args.port, access_log=None, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Microbenchmarks of the functions the relay runs for every message, reporting the time and the memory
+allocated per call. Save a baseline before a change and compare against it after, the script exits
+with status 1 when a case got slower than the tolerance:
+
+    python -m benchmarks.relay_functions --save baseline.json
+    python -m benchmarks.relay_functions --compare baseline.json [--tolerance 0.2]
+
+Run from `src/app`. The messages are synthetic by default; `--recording` takes the first message of
+each kind from a recording written with `RELAY_RECORD_DIR` instead.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+from backend import codec
+from backend.helpers import transform_acs_to_openai_format, transform_openai_to_acs_format
+from backend.recording import read_recording
+from benchmarks.codec_relay import make_acs_frame, make_openai_delta
+from benchmarks.replay import FakeChannel, make_relay, message_kind
+
+ROUNDS = 5
+
+def synthetic_messages() -> dict[str, str]:
+    return {
+        "client:AudioData": make_acs_frame(),
+        "client:AudioMetadata": json.dumps({"kind": "AudioMetadata", "audioMetadata": {"subscriptionId": "a1b2c3", "encoding": "PCM", "sampleRate": 24000, "channels": 1, "length": 960}}),
+        "server:response.audio.delta": make_openai_delta(),
+        "server:response.created": json.dumps({"type": "response.created", "event_id": "event_1", "response": {"id": "resp_1", "status": "in_progress", "output": []}}),
+        "server:input_audio_buffer.speech_started": json.dumps({"type": "input_audio_buffer.speech_started", "event_id": "event_2", "audio_start_ms": 1200, "item_id": "item_1"}),
+        "server:response.audio_transcript.delta": json.dumps({"type": "response.audio_transcript.delta", "event_id": "event_3", "response_id": "resp_1", "item_id": "item_2", "output_index": 0, "content_index": 0, "delta": "Buongiorno, "}),
+    }
+
+def recorded_messages(path: Path) -> dict[str, str]:
+    _, messages = read_recording(path)
+    found: dict[str, str] = {}
+    for _, direction, raw in messages:
+        found.setdefault(message_kind(direction, raw), raw)
+    return found
+
+def build_cases(messages: dict[str, str]) -> list[tuple[str, Callable[[], Any]]]:
+    relay = make_relay(24000)
+    session = relay.create_session("microbenchmark", True)
+    to_client, to_server = FakeChannel("client"), FakeChannel("server")
+    json_codec = codec.get_codec()
+    cases: list[tuple[str, Callable[[], Any]]] = []
+
+    for kind, raw in sorted(messages.items()):
+        direction, _, message_type = kind.partition(":")
+        data = json_codec.loads(raw)
+        if direction == "client":
+            cases.append((f"transform_acs_to_openai_format {message_type}",
+                          lambda data=data: transform_acs_to_openai_format(dict(data), relay.model, relay.tools, None, None, None, None, "alloy")))
+            if message_type != "AudioData":
+                # Audio frames never reach it, they take the fast path in _relay_client_message
+                cases.append((f"_process_message_to_server {message_type}", lambda data=data: relay._process_message_to_server(session, dict(data), to_server)))
+            cases.append((f"_relay_client_message {message_type}", lambda raw=raw: relay._relay_client_message(session, raw, to_server)))
+        else:
+            cases.append((f"transform_openai_to_acs_format {message_type}", lambda data=data: transform_openai_to_acs_format(dict(data))))
+            if message_type != "input_audio_buffer.speech_started":
+                # A barge-in each time would measure the interruption, not the message
+                cases.append((f"_process_message_to_client {message_type}", lambda data=data: relay._process_message_to_client(session, dict(data), to_client, to_server)))
+                cases.append((f"_relay_server_message {message_type}", lambda raw=raw: relay._relay_server_message(session, raw, to_client, to_server)))
+    return cases
+
+async def measure(fn: Callable[[], Any], seconds: float) -> tuple[float, float]:
+    """
+    Returns the nanoseconds of CPU per call and the peak bytes allocated by one call.
+    """
+    async def call():
+        result = fn()
+        if inspect.isawaitable(result):
+            await result
+
+    for _ in range(100):
+        await call()
+    # The best of a few rounds is far steadier than the mean on a busy machine
+    rounds = []
+    for _ in range(ROUNDS):
+        iterations = 0
+        start_cpu = time.process_time_ns()
+        deadline = time.perf_counter() + seconds / ROUNDS
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                await call()
+            iterations += 100
+        rounds.append((time.process_time_ns() - start_cpu) / iterations)
+    ns_per_call = min(rounds)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    await call()
+    allocated = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return ns_per_call, allocated
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=1.0, help="Duration of each measurement")
+    parser.add_argument("--recording", type=Path, default=None, help="Take the messages from this recording")
+    parser.add_argument("--save", type=Path, default=None, help="Write the results to this baseline file")
+    parser.add_argument("--compare", type=Path, default=None, help="Compare the results with this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown against the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    messages = recorded_messages(args.recording) if args.recording else synthetic_messages()
+    baseline = json.loads(args.compare.read_text()) if args.compare else {}
+    results: dict[str, dict[str, float]] = {}
+    regressions = []
+
+    print(f"{'case':<70} {'ns/call':>10} {'alloc B':>9} {'vs base':>8}")
+    for name, fn in build_cases(messages):
+        ns, allocated = await measure(fn, args.seconds)
+        results[name] = {"ns": ns, "allocated": allocated}
+        change = ""
+        if name in baseline:
+            ratio = ns / baseline[name]["ns"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > args.tolerance:
+                regressions.append(name)
+                change += " !"
+        print(f"{name:<70} {ns:>10,.0f} {allocated:>9} {change:>8}")
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,127 @@
+"""
+Replays recorded calls through the relay functions against fake sockets and reports the cost of each
+kind of message: time per message, allocations per message and CPU per second of call.
+
+Record calls by starting the server with `RELAY_RECORD_DIR` set (see the README), then run from `src/app`:
+
+    python -m benchmarks.replay recordings/*.jsonl.gz [--repeat 5] [--allocations]
+
+Messages are fed back to back, without the recorded timing, through `RTMiddleTier._relay_client_message`
+and `RTMiddleTier._relay_server_message`, the functions `forward_messages` runs for every frame.
+The playback pacer needs real time and is left out; relay settings such as `ACS_VAD_GATE` are taken
+from the environment like in `app.py`.
+"""
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Optional
+from azure.core.credentials import AzureKeyCredential
+from backend import codec
+from backend.recording import read_recording
+from backend.rtmt import RTMiddleTier, RTSession
+from benchmarks.worker_capacity import percentile
+
+class FakeChannel:
+    """
+    Stands in for an `OutboundChannel`, keeping count of what would have been written.
+    """
+    def __init__(self, direction: str):
+        self.direction = direction
+        self._codec = codec.get_codec()
+        self.messages = 0
+        self.bytes = 0
+
+    def send_audio(self, message: str):
+        self.messages += 1
+        self.bytes += len(message)
+
+    async def send_str(self, message: str, on_sent: Optional[Callable[[], None]] = None):
+        self.messages += 1
+        self.bytes += len(message)
+        if on_sent is not None:
+            on_sent()
+
+    async def send_json(self, data: Any):
+        await self.send_str(self._codec.dumps(data))
+
+    def drop_audio(self) -> int:
+        return 0
+
+def make_relay(sample_rate: int) -> RTMiddleTier:
+    return RTMiddleTier(
+        "http://replay.invalid",
+        "replay",
+        AzureKeyCredential("replay"),
+        acs_sample_rate=sample_rate,
+        normalize_input_gain=os.environ.get("ACS_AUDIO_NORMALIZE_GAIN", "false").lower() == "true",
+        vad_gate=os.environ.get("ACS_VAD_GATE", "false").lower() == "true",
+        upstream_coalesce_ms=int(os.environ.get("ACS_UPSTREAM_COALESCE_MS", 60)),
+        playback_frame_ms=0,
+        log_sample_every=0,
+    )
+
+def message_kind(direction: str, raw: str) -> str:
+    return f"{direction}:{codec.peek_acs_kind(raw) or codec.peek_openai_type(raw) or '?'}"
+
+async def replay(path: Path, repeat: int, allocations: bool, timings: dict[str, list[float]], allocated: dict[str, list[int]]) -> tuple[float, float]:
+    """
+    Replays one recording `repeat` times. Returns the recorded duration and the CPU time spent, in seconds.
+    """
+    header, messages = read_recording(path)
+    recorded = list(messages)
+    relay = make_relay(header.get("sample_rate", 24000))
+    duration = recorded[-1][0] / 1000 if recorded else 0.0
+    kinds = [message_kind(direction, raw) for _, direction, raw in recorded]
+    cpu = 0.0
+    for iteration in range(repeat):
+        session: RTSession = relay.create_session(f"replay-{iteration}", header.get("acs", True))
+        to_client, to_server = FakeChannel("client"), FakeChannel("server")
+        cpu_start = time.process_time()
+        for (_, direction, raw), kind in zip(recorded, kinds):
+            if allocations:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter_ns()
+            if direction == "client":
+                await relay._relay_client_message(session, raw, to_server)
+            else:
+                await relay._relay_server_message(session, raw, to_client, to_server)
+            timings[kind].append(time.perf_counter_ns() - start)
+            if allocations:
+                allocated[kind].append(tracemalloc.get_traced_memory()[1] - before)
+        cpu += time.process_time() - cpu_start
+        await relay._cancel_tool_calls(session)
+        relay.sessions.pop(session.call_id, None)
+    return duration * repeat, cpu
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", type=Path, help="Recordings written with RELAY_RECORD_DIR")
+    parser.add_argument("--repeat", type=int, default=3, help="Times each recording is replayed")
+    parser.add_argument("--allocations", action="store_true", help="Also measure the peak memory allocated per message (slower)")
+    args = parser.parse_args()
+
+    timings: dict[str, list[float]] = defaultdict(list)
+    allocated: dict[str, list[int]] = defaultdict(list)
+    if args.allocations:
+        tracemalloc.start()
+    duration = cpu = 0.0
+    for path in args.recordings:
+        recorded, spent = await replay(path, args.repeat, args.allocations, timings, allocated)
+        duration += recorded
+        cpu += spent
+
+    print(f"{'message':<46} {'count':>8} {'mean µs':>9} {'p50 µs':>8} {'p99 µs':>8} {'alloc B':>9}")
+    for kind, values in sorted(timings.items(), key=lambda item: -sum(item[1])):
+        alloc = f"{sum(allocated[kind]) / len(allocated[kind]):>9.0f}" if allocated[kind] else f"{'-':>9}"
+        print(f"{kind:<46} {len(values):>8} {sum(values) / len(values) / 1000:>9.1f} "
+              f"{percentile(values, 0.5) / 1000:>8.1f} {percentile(values, 0.99) / 1000:>8.1f} {alloc}")
+    if duration > 0:
+        print(f"\nRelay CPU per second of call: {cpu / duration * 1000:.2f} ms ({duration:.0f} s of calls replayed)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
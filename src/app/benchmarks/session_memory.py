@@ -0,0 +1,52 @@
+"""
+Measures the memory taken by the per-call `RTSession` objects, excluding the tool executor and the transcript journal,
+and checks that it stays within `--max-bytes` per session and that sessions share no per-call state.
+Exits with status 1 when a check fails, so it can gate a build.
+
+Run from `src/app`:
+
+    python -m benchmarks.session_memory [--sessions 1000] [--max-bytes 512]
+"""
+import argparse
+import sys
+import tracemalloc
+from backend.journal import TranscriptJournal
+from backend.rtmt import RTSession
+from backend.tools.executor import ToolExecutor
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000, help="Number of sessions to create")
+    parser.add_argument("--max-bytes", type=int, default=512, help="Largest accepted memory per session")
+    args = parser.parse_args()
+
+    call_ids = [f"call-{i:08d}" for i in range(args.sessions)]
+    journal = TranscriptJournal()
+    dependencies = [(ToolExecutor({}), journal.open(call_id)) for call_id in call_ids]
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    sessions = [RTSession(call_id, True, "alloy", "shared prompt", executor, call_journal) for call_id, (executor, call_journal) in zip(call_ids, dependencies)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The list holding the sessions is not part of their cost
+    per_session = (after - before - sys.getsizeof(sessions)) / args.sessions
+    print(f"{args.sessions} sessions: {after - before:,} bytes, {per_session:,.0f} bytes per session")
+
+    failures = []
+    if per_session > args.max_bytes:
+        failures.append(f"{per_session:,.0f} bytes per session, more than {args.max_bytes:,}")
+    if hasattr(sessions[0], "__dict__"):
+        failures.append("RTSession has an instance __dict__, a slot is missing in a subclass")
+    if len(sessions) > 1:
+        first, second = sessions[0], sessions[1]
+        first.tools_pending["call"] = None
+        first.voice = "echo"
+        if second.tools_pending or second.voice != "alloy":
+            failures.append("sessions share per-call state")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Runs the voice activity gate over recorded calls and reports how much audio it keeps from the upstream,
+where the gate opens, and how fast it is.
+
+Recordings are mono pcm16 WAV files, or raw pcm16 files with `--sample-rate`. Without files a synthetic
+call (silence, line noise and speech-like bursts) is used. Run from `src/app`:
+
+    python -m benchmarks.vad_gate recordings/*.wav --threshold-dbfs -45 --pre-roll-ms 400 --hangover-ms 800
+"""
+import argparse
+import base64
+import time
+import wave
+import numpy as np
+from backend.vad import VoiceActivityGate
+
+FRAME_MS = 20
+
+def load_pcm(path: str, sample_rate: int) -> tuple[bytes, int]:
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as wav:
+            if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                raise ValueError(f"{path}: expected mono 16 bit PCM")
+            return wav.readframes(wav.getnframes()), wav.getframerate()
+    with open(path, "rb") as f:
+        return f.read(), sample_rate
+
+def synthetic_call(sample_rate: int) -> bytes:
+    rng = np.random.default_rng(0)
+    parts = []
+    for silence_s, speech_s in ((2.0, 1.5), (4.0, 0.8), (1.0, 2.5), (6.0, 0.0)):
+        parts.append(30 * rng.standard_normal(int(silence_s * sample_rate)))
+        t = np.arange(int(speech_s * sample_rate)) / sample_rate
+        # Voiced speech: a low fundamental with harmonics, amplitude modulated at syllable rate
+        voiced = sum(np.sin(2 * np.pi * 140 * k * t) / k for k in range(1, 6))
+        parts.append(4000 * voiced * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)))
+    return np.concatenate(parts).astype("<i2").tobytes()
+
+def run(name: str, pcm: bytes, sample_rate: int, args: argparse.Namespace):
+    frame_bytes = sample_rate * FRAME_MS // 1000 * 2
+    frames = [base64.b64encode(pcm[i:i + frame_bytes]).decode("ascii") for i in range(0, len(pcm), frame_bytes)]
+    gate = VoiceActivityGate(sample_rate, args.threshold_dbfs, pre_roll_ms=args.pre_roll_ms, hangover_ms=args.hangover_ms)
+
+    onsets = []
+    was_open = False
+    start = time.process_time()
+    for index, frame in enumerate(frames):
+        sent = gate.process(frame)
+        if sent and not was_open:
+            onsets.append(index * FRAME_MS / 1000)
+        was_open = len(sent) > 0
+    elapsed = time.process_time() - start
+
+    total_bytes = sum(len(frame) for frame in frames)
+    print(f"{name}: {len(frames) * FRAME_MS / 1000:.1f}s at {sample_rate} Hz, {len(frames)} frames")
+    print(f"  sent {gate.frames_sent}, suppressed {gate.frames_suppressed} "
+          f"({gate.bytes_suppressed / max(1, total_bytes):.0%} of the upstream audio bytes)")
+    print(f"  gate opened at: {', '.join(f'{t:.2f}s' for t in onsets) or 'never'}")
+    print(f"  {len(frames) / max(elapsed, 1e-9):,.0f} frames/s per core")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Mono pcm16 WAV or raw pcm16 recordings")
+    parser.add_argument("--sample-rate", type=int, default=24000, help="Sample rate of raw pcm16 files")
+    parser.add_argument("--threshold-dbfs", type=float, default=-45.0)
+    parser.add_argument("--pre-roll-ms", type=int, default=400)
+    parser.add_argument("--hangover-ms", type=int, default=800)
+    args = parser.parse_args()
+
+    if not args.files:
+        run("synthetic call", synthetic_call(args.sample_rate), args.sample_rate, args)
+    for path in args.files:
+        pcm, sample_rate = load_pcm(path, args.sample_rate)
+        run(path, pcm, sample_rate, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Measures concurrent-call capacity of the relay served by gunicorn with a given number of workers.
+
+A mock OpenAI Realtime endpoint runs in this process and streams 24 kHz audio back at real-time
+rate as soon as a response is requested; simulated ACS calls stream 20 ms frames at real-time rate
+to `/realtime-acs`. Every downstream delta carries its send time, so the script reports how late
+the relay delivers audio, together with the CPU used by the gunicorn workers.
+
+Run from `src/app`:
+
+    python -m benchmarks.worker_capacity --workers 1 2 4 --calls 10 50 100 --seconds 20
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+from typing import Optional
+import aiohttp
+from aiohttp import web
+
+FRAME_MS = 20
+ACS_FRAME_BYTES = 960        # 20 ms of 24 kHz 16 bit mono PCM
+DELTA_MS = 100
+DELTA_BYTES = 4800           # 100 ms of 24 kHz 16 bit mono PCM
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def stamped_delta() -> str:
+    # The send time is written into the PCM so it survives the relay untouched
+    return base64.b64encode(struct.pack("<d", time.monotonic()) + bytes(DELTA_BYTES - 8)).decode("ascii")
+
+async def mock_realtime(request: web.Request) -> web.WebSocketResponse:
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    await ws.send_str(json.dumps({"type": "session.created", "session": {}}))
+    speaker: Optional[asyncio.Task] = None
+
+    async def speak():
+        while not ws.closed:
+            await ws.send_str(json.dumps({"type": "response.audio.delta", "response_id": "resp_1", "item_id": "item_1",
+                                          "output_index": 0, "content_index": 0, "delta": stamped_delta()}))
+            await asyncio.sleep(DELTA_MS / 1000)
+
+    try:
+        async for msg in ws:
+            event_type = json.loads(msg.data).get("type") if msg.type == aiohttp.WSMsgType.TEXT else None
+            if event_type == "session.update":
+                await ws.send_str(json.dumps({"type": "session.updated", "session": {}}))
+            elif event_type == "response.create" and speaker is None:
+                speaker = asyncio.create_task(speak())
+    finally:
+        if speaker is not None:
+            speaker.cancel()
+    return ws
+
+async def acs_call(session: aiohttp.ClientSession, url: str, call_id: str, stop_at: float, latencies: list[float]):
+    frame = json.dumps({"kind": "AudioData", "audioData": {"data": base64.b64encode(bytes(ACS_FRAME_BYTES)).decode("ascii"), "silent": False}})
+    async with session.ws_connect(f"{url}/realtime-acs?callConnectionId={call_id}") as ws:
+        await ws.send_str(json.dumps({"kind": "AudioMetadata", "audioMetadata": {"encoding": "PCM", "sampleRate": 24000, "channels": 1, "length": 640}}))
+
+        async def send_frames():
+            next_at = time.monotonic()
+            while time.monotonic() < stop_at:
+                await ws.send_str(frame)
+                next_at += FRAME_MS / 1000
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            await ws.close()
+
+        async def receive_audio():
+            pending = b""
+            async for msg in ws:
+                data = json.loads(msg.data)
+                if data.get("kind") != "AudioData":
+                    continue
+                pending += base64.b64decode(data["audioData"]["data"])
+                # Frames may be re-chunked by the relay, stamps sit at every DELTA_BYTES boundary
+                while len(pending) >= DELTA_BYTES:
+                    latencies.append(time.monotonic() - struct.unpack("<d", pending[:8])[0])
+                    pending = pending[DELTA_BYTES:]
+
+        await asyncio.gather(send_frames(), receive_audio())
+
+def process_tree(pid: int) -> list[int]:
+    pids = [pid]
+    for child in open(f"/proc/{pid}/task/{pid}/children").read().split():
+        pids.extend(process_tree(int(child)))
+    return pids
+
+def cpu_seconds(pids: list[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            fields = open(f"/proc/{pid}/stat").read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except OSError:
+            pass
+    return total / CLK_TCK
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+async def run(workers: int, call_counts: list[int], seconds: float, mock_url: str):
+    port = free_port()
+    env = dict(os.environ,
+               AZURE_OPENAI_ENDPOINT=mock_url,
+               AZURE_OPENAI_COMPLETION_DEPLOYMENT_NAME="benchmark",
+               AZURE_OPENAI_API_KEY="benchmark",
+               WEB_CONCURRENCY=str(workers),
+               HOST="127.0.0.1",
+               PORT=str(port),
+               ACCESS_LOG="")
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "app:create_app", "-c", "gunicorn.conf.py"],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        async with aiohttp.ClientSession() as session:
+            for _ in range(100):
+                try:
+                    async with session.get(url + "/"):
+                        break
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.2)
+
+            for calls in call_counts:
+                latencies: list[float] = []
+                pids = process_tree(server.pid)
+                cpu_start, wall_start = cpu_seconds(pids), time.monotonic()
+                stop_at = wall_start + seconds
+                await asyncio.gather(*(acs_call(session, url, f"bench-{calls}-{i}", stop_at, latencies) for i in range(calls)),
+                                     return_exceptions=True)
+                cores = (cpu_seconds(pids) - cpu_start) / (time.monotonic() - wall_start)
+                expected = calls * seconds * 1000 / DELTA_MS
+                print(f"{workers:>7} {calls:>6} {percentile(latencies, 0.5) * 1000:>9.1f} {percentile(latencies, 0.99) * 1000:>9.1f} "
+                      f"{len(latencies) / expected:>9.0%} {cores:>7.2f} {cores / calls * 100:>10.2f}%")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="Worker counts to test")
+    parser.add_argument("--calls", type=int, nargs="+", default=[10, 25, 50], help="Concurrent calls to test for each worker count")
+    parser.add_argument("--seconds", type=float, default=15.0, help="Duration of each step")
+    args = parser.parse_args()
+
+    mock = web.Application()
+    mock.router.add_get("/openai/realtime", mock_realtime)
+    runner = web.AppRunner(mock)
+    await runner.setup()
+    mock_port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", mock_port).start()
+
+    print(f"{'workers':>7} {'calls':>6} {'p50 ms':>9} {'p99 ms':>9} {'delivered':>9} {'cores':>7} {'core/call':>11}")
+    try:
+        for workers in args.workers:
+            await run(workers, args.calls, args.seconds, f"http://127.0.0.1:{mock_port}")
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
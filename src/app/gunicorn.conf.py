@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+
+# Gunicorn configuration for running the app with one aiohttp event loop per worker process.
+# The master process owns the listening socket and every worker accepts from it; each worker
+# imports the app and runs `create_app()` itself, so no state is shared between workers.
+
+def _available_cpus() -> int:
+    """
+    Number of CPUs this container may use, honouring cgroup v2 quotas (e.g. Azure Container Apps) and CPU affinity.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = multiprocessing.cpu_count()
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+
+# The relay is CPU bound once the sockets are open, so one single-threaded worker per core
+workers = int(os.environ.get("WEB_CONCURRENCY", _available_cpus()))
+
+# uvloop is optional, use it when installed unless explicitly disabled
+worker_class = "backend.worker.DrainingWebWorker"
+if os.environ.get("UVLOOP", "1") != "0":
+    try:
+        import uvloop  # noqa: F401
+        worker_class = "backend.worker.DrainingUVLoopWebWorker"
+    except ImportError:
+        pass
+
+# Each worker builds its own app, pool of upstream sockets and background tasks
+preload_app = False
+
+# On reload (SIGHUP) or shutdown, old workers stop accepting new connections but keep relaying the
+# calls in progress for up to `graceful_timeout` seconds, so live /realtime-acs sockets are not cut.
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 900))
+# Liveness: a worker whose event loop stops sending heartbeats for this long is killed and replaced.
+# The workers keep sending them while draining (see backend/worker.py), so this is independent of the drain
+timeout = int(os.environ.get("WORKER_TIMEOUT", 60))
+keepalive = 75
+
+accesslog = os.environ.get("ACCESS_LOG", "-") or None